@@ -1,45 +1,211 @@
 # api_client.py
 import aiohttp
 import asyncio
-from typing import Optional, Dict, List
+import time
+from typing import Optional, Dict, List, Tuple
 import logging
+from cache import TTLCache
 from config import Config
+from logger import log_payload
+from metrics import API_IN_FLIGHT, API_LATENCY, API_RESPONSES, endpoint_label
+from resilience import CircuitBreaker, backoff_delay
+from tracing import current_trace_id, span
 
 logger = logging.getLogger(__name__)
 
+# Методы, которые безопасно повторять: повтор не меняет результат
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "PUT", "DELETE"})
+
+class ServiceError(Exception):
+    """Временная ошибка сервиса (5xx), после которой запрос можно повторить"""
+
+class OutcomeUnknown(Exception):
+    """Ответ не получен (таймаут, 5xx, обрыв), а запрос мог быть применен сервером"""
+
+# Отметка в журнале идемпотентности: результат операции неизвестен
+_OUTCOME_UNKNOWN = object()
+
 class WarehouseAPIClient:
     """Асинхронный клиент для работы с Warehouse API"""
     
     def __init__(self):
         self.base_url = Config.WAREHOUSE_API_URL.rstrip('/')
-        self.timeout = aiohttp.ClientTimeout(total=30)
+        self.timeout = aiohttp.ClientTimeout(total=Config.API_TIMEOUT)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.cache = TTLCache(max_size=Config.CACHE_MAX_SIZE, max_bytes=Config.CACHE_MAX_BYTES)
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+        self.coalesced_requests = 0
+        self._cache_generation = 0
+        self.breaker = CircuitBreaker(
+            failure_threshold=Config.BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=Config.BREAKER_RESET_TIMEOUT,
+        )
+        self.retries = 0
+        # Журнал выполненных операций с ключами идемпотентности
+        self.idempotency_journal = TTLCache(
+            max_size=Config.IDEMPOTENCY_JOURNAL_SIZE,
+            default_ttl=Config.IDEMPOTENCY_TTL,
+        )
+        self._inflight_operations: Dict[str, asyncio.Future] = {}
+        self.deduplicated_operations = 0
+    
+    async def start(self) -> None:
+        """Открыть общую сессию с пулом keep-alive соединений"""
+        if self._session is not None and not self._session.closed:
+            return
+        
+        connector = aiohttp.TCPConnector(
+            limit=Config.API_POOL_SIZE,
+            limit_per_host=Config.API_POOL_SIZE_PER_HOST,
+            keepalive_timeout=Config.API_KEEPALIVE_TIMEOUT,
+            use_dns_cache=True,
+            ttl_dns_cache=Config.API_DNS_CACHE_TTL,
+        )
+        self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        logger.info(
+            f"API session opened (pool={Config.API_POOL_SIZE}, "
+            f"per_host={Config.API_POOL_SIZE_PER_HOST})"
+        )
+    
+    async def close(self) -> None:
+        """Закрыть общую сессию и освободить соединения"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("API session closed")
+        self._session = None
     
-    async def _make_request(self, method: str, endpoint: str, **kwargs) -> Optional[Dict]:
-        """Универсальный метод для выполнения запросов к API"""
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Вернуть общую сессию, открыв ее при первом обращении"""
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+    
+    def _timeout_for(self, endpoint: str) -> aiohttp.ClientTimeout:
+        """Таймаут эндпоинта: самый длинный подходящий префикс из API_ENDPOINT_TIMEOUTS"""
+        endpoint = endpoint.lstrip('/')
+        matches = [prefix for prefix in Config.API_ENDPOINT_TIMEOUTS if endpoint.startswith(prefix)]
+        if not matches:
+            return self.timeout
+        return aiohttp.ClientTimeout(total=Config.API_ENDPOINT_TIMEOUTS[max(matches, key=len)])
+    
+    async def _make_request(self, method: str, endpoint: str, idempotent: Optional[bool] = None,
+                            raise_unknown: bool = False, **kwargs) -> Optional[Dict]:
+        """
+        Универсальный метод для выполнения запросов к API
+        
+        Временные ошибки (5xx, таймауты, обрывы соединения) повторяются с
+        экспоненциальной задержкой, но только для идемпотентных запросов:
+        PATCH с приращением количества повторять нельзя. Все попытки вместе
+        с паузами укладываются в API_REQUEST_DEADLINE. Пока предохранитель
+        открыт, запросы сразу возвращают None.
+        Raises:
+            OutcomeUnknown: при raise_unknown=True, если последняя попытка
+                могла дойти до сервера, но ответ не получен
+        """
         url = f"{self.base_url}/{endpoint.lstrip('/')}"
         
-        # Логируем параметры для отладки
+        # Параметры для отладки: выборочно и с обрезкой, чтобы не тормозить под нагрузкой
         if 'params' in kwargs:
-            logger.info(f"Request params: {kwargs['params']}")
+            log_payload(logger, f"{method} {endpoint} params", kwargs['params'])
         if 'json' in kwargs:
-            logger.info(f"Request JSON: {kwargs['json']}")
+            log_payload(logger, f"{method} {endpoint} JSON", kwargs['json'])
+        
+        # ID трассировки обновления - чтобы связать запрос с логами сервиса
+        trace_id = current_trace_id()
+        if trace_id is not None:
+            kwargs['headers'] = {**kwargs.get('headers', {}), Config.TRACE_HEADER: trace_id}
+        
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        attempts = 1 + Config.API_RETRY_ATTEMPTS if idempotent else 1
+        timeout = self._timeout_for(endpoint)
+        
+        probe = self.breaker.state == CircuitBreaker.HALF_OPEN
+        if not self.breaker.allow():
+            logger.warning(f"Circuit breaker open, skipping {method} {endpoint}")
+            API_RESPONSES.inc(method=method, endpoint=endpoint_label(endpoint), status="breaker_open")
+            return None
         
         try:
-            async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                async with session.request(method, url, **kwargs) as response:
-                    
-                    if response.status == 204:
-                        return {"success": True}
-                    
-                    if response.status >= 400:
-                        logger.error(f"API error {response.status}: {await response.text()}")
-                        return None
-                    
-                    return await response.json()
+            return await self._attempt_requests(method, endpoint, url, attempts, timeout, raise_unknown, **kwargs)
+        finally:
+            # Пробный запрос мог быть отменен (CancelledError) до record_success/record_failure
+            if probe:
+                self.breaker.release_probe()
+    
+    async def _attempt_requests(self, method: str, endpoint: str, url: str, attempts: int,
+                                timeout: aiohttp.ClientTimeout, raise_unknown: bool = False,
+                                **kwargs) -> Optional[Dict]:
+        """Попытки запроса с повторами и учетом результата в предохранителе"""
+        endpoint_name = endpoint_label(endpoint)
+        maybe_applied = False
+        deadline = time.monotonic() + Config.API_REQUEST_DEADLINE
+        for attempt in range(attempts):
+            # Таймаут попытки не выходит за общий предел: во время сбоя
+            # обработчик не ждет полный API_TIMEOUT на каждую попытку
+            remaining = deadline - time.monotonic()
+            attempt_timeout = aiohttp.ClientTimeout(
+                total=min(timeout.total, remaining) if timeout.total else remaining
+            )
+            started = time.perf_counter()
+            status = "error"
+            API_IN_FLIGHT.inc()
+            try:
+                with span(f"api {method} {endpoint_name}", attempt=attempt + 1) as api_span:
+                    session = await self._get_session()
+                    async with session.request(method, url, timeout=attempt_timeout, **kwargs) as response:
+                        status = str(response.status)
+                        api_span.set(status=status)
                         
-        except Exception as e:
-            logger.error(f"API request error: {e}")
-            return None
+                        if response.status >= 500:
+                            raise ServiceError(f"API error {response.status}: {await response.text()}")
+                        
+                        # Сервис ответил - он доступен, даже если запрос неверный
+                        self.breaker.record_success()
+                        
+                        if response.status == 204:
+                            return {"success": True}
+                        
+                        if response.status >= 400:
+                            logger.error(f"API error {response.status}: {await response.text()}")
+                            return None
+                        
+                        try:
+                            return await response.json()
+                        except (aiohttp.ContentTypeError, ValueError) as e:
+                            logger.error(f"API response decode error: {e}")
+                            return None
+            
+            except (ServiceError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"API request error ({method} {endpoint}, attempt {attempt + 1}/{attempts}): {e!r}")
+                # Не удалось соединиться - запрос точно не отправлен
+                maybe_applied = not isinstance(e, aiohttp.ClientConnectorError)
+            finally:
+                API_IN_FLIGHT.dec()
+                API_LATENCY.observe(time.perf_counter() - started, method=method, endpoint=endpoint_name)
+                API_RESPONSES.inc(method=method, endpoint=endpoint_name, status=status)
+            
+            self.breaker.record_failure()
+            if attempt + 1 >= attempts or self.breaker.state != CircuitBreaker.CLOSED:
+                break
+            
+            delay = backoff_delay(attempt, Config.API_RETRY_BASE_DELAY, Config.API_RETRY_MAX_DELAY)
+            if time.monotonic() + delay >= deadline:
+                logger.warning(f"API request deadline reached ({method} {endpoint}), not retrying")
+                break
+            self.retries += 1
+            await asyncio.sleep(delay)
+        
+        if raise_unknown and maybe_applied:
+            raise OutcomeUnknown(f"{method} {endpoint}: ответ не получен")
+        return None
+
+    def breaker_stats(self) -> Dict:
+        """Состояние предохранителя и число повторов для мониторинга"""
+        stats = self.breaker.stats()
+        stats["retries"] = self.retries
+        stats["deduplicated_operations"] = self.deduplicated_operations
+        return stats
 
     # GET методы
     def _prepare_api_params(self, filters: Dict) -> Dict[str, str]:
@@ -55,44 +221,220 @@ class WarehouseAPIClient:
                     params[key] = str(value)
         return params
 
+    # Кэширование GET-запросов
+    @staticmethod
+    def _cache_key(endpoint: str, params: Optional[Dict[str, str]] = None) -> Tuple:
+        """Ключ кэша: эндпоинт + отсортированные параметры"""
+        return (endpoint, tuple(sorted((params or {}).items())))
+
+    async def _cached_get(self, endpoint: str, ttl: float, params: Optional[Dict[str, str]] = None):
+        """GET-запрос через кэш и single-flight; ошибки (None) не кэшируются"""
+        key = self._cache_key(endpoint, params)
+        if Config.CACHE_ENABLED:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+            
+            # API недоступен - отдаем устаревшие данные, если они есть
+            if self.breaker.state == CircuitBreaker.OPEN:
+                return self.cache.get_stale(key)
+        
+        # Одинаковые одновременные запросы ждут один общий запрос к API
+        task = self._inflight.get(key)
+        if task is None:
+            kwargs = {"params": params} if params is not None else {}
+            task = asyncio.ensure_future(self._fetch_and_cache(key, endpoint, ttl, **kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget_inflight(key, done))
+        else:
+            self.coalesced_requests += 1
+        
+        # shield: отмена одного из ожидающих не отменяет общий запрос
+        result = await asyncio.shield(task)
+        # Предохранитель не закрыт - запрос мог быть отклонен (в том числе пока идет пробный)
+        if result is None and Config.CACHE_ENABLED and self.breaker.state != CircuitBreaker.CLOSED:
+            return self.cache.get_stale(key)
+        return result
+
+    async def _fetch_and_cache(self, key: Tuple, endpoint: str, ttl: float, **kwargs):
+        """Выполнить GET-запрос и сохранить успешный ответ в кэш"""
+        generation = self._cache_generation
+        result = await self._make_request("GET", endpoint, **kwargs)
+        # Не кэшируем ответ, если за время запроса данные были изменены
+        if result is not None and Config.CACHE_ENABLED and generation == self._cache_generation:
+            self.cache.set(key, result, ttl=ttl)
+        return result
+
+    def _forget_inflight(self, key: Tuple, task: asyncio.Future) -> None:
+        """Убрать завершенный запрос из таблицы выполняющихся"""
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def invalidate_product(self, product_id: Optional[int] = None) -> None:
+        """Сбросить кэш списков товаров и (если указан) записей товара"""
+        product_endpoints = set()
+        if product_id is not None:
+            product_endpoints = {f"products/{product_id}", f"products/thermocups/{product_id}"}
+        
+        def affected(key: Tuple) -> bool:
+            return key[0] in ("products", "products/aggregates") or key[0] in product_endpoints
+        
+        self._cache_generation += 1
+        removed = self.cache.invalidate_where(affected)
+        # Новые чтения не должны присоединяться к запросам, начатым до записи
+        for key in [key for key in self._inflight if affected(key)]:
+            del self._inflight[key]
+        logger.debug(f"Cache invalidated for product {product_id}: {removed} entries")
+
+    def cache_stats(self) -> Dict:
+        """Статистика кэша ответов и объединенных запросов"""
+        stats = self.cache.stats()
+        stats["coalesced"] = self.coalesced_requests
+        stats["inflight"] = len(self._inflight)
+        return stats
+
     async def get_products(self, **filters) -> Optional[List[Dict]]:
         """Получить список товаров с фильтрами"""
         params = self._prepare_api_params(filters)
         
-        logger.info(f"Making API request to /products with params: {params}")
-        result = await self._make_request("GET", "products", params=params)
-        logger.info(f"API response type: {type(result)}, length: {len(result) if result else 0}")
+        result = await self._cached_get("products", Config.CACHE_TTL_PRODUCTS, params=params)
+        logger.debug(f"GET products {params}: {len(result) if result else 0} items")
         
         return result
 
+    async def get_products_page(self, offset: int = 0, limit: int = 10, **filters) -> Optional[Tuple[List[Dict], bool]]:
+        """Получить страницу товаров и признак наличия следующей страницы"""
+        # Запрашиваем на один товар больше, чтобы узнать, есть ли продолжение
+        products = await self.get_products(limit=limit + 1, offset=offset, **filters)
+        if products is None:
+            return None
+        return products[:limit], len(products) > limit
+
+    async def get_products_aggregates(self, **filters) -> Optional[Dict]:
+        """Получить агрегаты (count, суммы, min/max/avg цены) по всему результату фильтра"""
+        params = self._prepare_api_params(filters)
+        return await self._cached_get("products/aggregates", Config.CACHE_TTL_PRODUCTS, params=params)
+
     async def get_product_by_id(self, product_id: int) -> Optional[Dict]:
         """Получить товар по ID"""
-        return await self._make_request("GET", f"products/{product_id}")
+        return await self._cached_get(f"products/{product_id}", Config.CACHE_TTL_PRODUCT)
     
     async def get_thermocup_by_id(self, product_id: int) -> Optional[Dict]:
         """Получить термокружку по ID"""
-        return await self._make_request("GET", f"products/thermocups/{product_id}")
+        return await self._cached_get(f"products/thermocups/{product_id}", Config.CACHE_TTL_PRODUCT)
     
     # POST методы
     async def create_thermocup(self, thermocup_data: Dict) -> Optional[Dict]:
         """Создать новую термокружку"""
-        return await self._make_request("POST", "products/thermocups/create", json=thermocup_data)
+        result = await self._make_request("POST", "products/thermocups/create", json=thermocup_data)
+        self.invalidate_product()
+        return result
     
     # PUT методы
     async def update_thermocup(self, product_id: int, update_data: Dict) -> Optional[Dict]:
         """Обновить термокружку по ID"""
-        return await self._make_request("PUT", f"products/thermocups/update/{product_id}", json=update_data)
+        result = await self._make_request("PUT", f"products/thermocups/update/{product_id}", json=update_data)
+        self.invalidate_product(product_id)
+        return result
     
     # PATCH методы
-    async def update_thermocup_reserved(self, product_id: int, quantity_change: int) -> Optional[Dict]:
+    async def _patch_delta(self, endpoint: str, data: Dict, idempotency_key: Optional[str],
+                           confirmed: bool = False) -> Optional[Dict]:
+        """
+        PATCH с приращением количества
+        
+        Без ключа запрос отправляется один раз. С ключом идемпотентности
+        (заголовок Idempotency-Key) уже выполненная операция или операция,
+        которая выполняется прямо сейчас, не отправляется повторно.
+        Автоматические повторы после таймаута или 5xx включаются только при
+        API_IDEMPOTENCY_SUPPORTED: изменение могло быть применено сервером,
+        и без дедупликации на его стороне повтор применит его дважды.
+        Поэтому без API_IDEMPOTENCY_SUPPORTED такой ключ отмечается в журнале
+        как операция с неизвестным результатом (см. outcome_unknown) и снова
+        отправляется только с confirmed=True - после проверки пользователем.
+        """
+        if idempotency_key is None:
+            return await self._make_request("PATCH", endpoint, json=data)
+        
+        journaled = self.idempotency_journal.get(idempotency_key)
+        if journaled is _OUTCOME_UNKNOWN:
+            if not confirmed:
+                logger.warning(f"Operation {idempotency_key} has unknown outcome, resend needs confirmation")
+                return None
+        elif journaled is not None:
+            self.deduplicated_operations += 1
+            logger.info(f"Operation {idempotency_key} already applied, skipping")
+            return journaled
+        
+        task = self._inflight_operations.get(idempotency_key)
+        if task is not None:
+            self.deduplicated_operations += 1
+            return await asyncio.shield(task)
+        
+        task = asyncio.ensure_future(self._make_request(
+            "PATCH", endpoint, idempotent=Config.API_IDEMPOTENCY_SUPPORTED,
+            raise_unknown=not Config.API_IDEMPOTENCY_SUPPORTED,
+            json=data, headers={"Idempotency-Key": idempotency_key},
+        ))
+        self._inflight_operations[idempotency_key] = task
+        try:
+            result = await asyncio.shield(task)
+        except OutcomeUnknown as e:
+            logger.warning(f"Operation {idempotency_key} outcome unknown: {e}")
+            self.idempotency_journal.set(idempotency_key, _OUTCOME_UNKNOWN)
+            return None
+        finally:
+            self._inflight_operations.pop(idempotency_key, None)
+        
+        if result is not None:
+            self.idempotency_journal.set(idempotency_key, result)
+        return result
+    
+    def outcome_unknown(self, idempotency_key: Optional[str]) -> bool:
+        """Операция с этим ключом могла примениться, но ответ сервера не получен"""
+        return idempotency_key is not None and self.idempotency_journal.get(idempotency_key) is _OUTCOME_UNKNOWN
+    
+    async def update_thermocup_reserved(self, product_id: int, quantity_change: int,
+                                        idempotency_key: Optional[str] = None,
+                                        confirmed: bool = False) -> Optional[Dict]:
         """Обновить количество зарезервированного товара"""
         data = {"quantity_change": quantity_change}
-        return await self._make_request("PATCH", f"products/thermocups/update/{product_id}/reserved", json=data)
+        result = await self._patch_delta(f"products/thermocups/update/{product_id}/reserved", data,
+                                         idempotency_key, confirmed)
+        self.invalidate_product(product_id)
+        return result
     
-    async def update_thermocup_stock(self, product_id: int, warehouse_id: int, quantity_change: int) -> Optional[Dict]:
+    async def update_thermocup_stock(self, product_id: int, warehouse_id: int, quantity_change: int,
+                                     idempotency_key: Optional[str] = None,
+                                     confirmed: bool = False) -> Optional[Dict]:
         """Обновить количество товара на складе"""
         data = {
             "warehouse_id": warehouse_id,
             "quantity_change": quantity_change
         }
-        return await self._make_request("PATCH", f"products/thermocups/update/{product_id}/stock", json=data)
\ No newline at end of file
+        result = await self._patch_delta(f"products/thermocups/update/{product_id}/stock", data,
+                                         idempotency_key, confirmed)
+        self.invalidate_product(product_id)
+        return result
+    
+    async def update_thermocup_stock_batch(self, items: List[Dict],
+                                           idempotency_key: Optional[str] = None,
+                                           confirmed: bool = False) -> Optional[List[bool]]:
+        """
+        Обновить склад для многих товаров одним запросом
+        
+        items: [{"product_id", "warehouse_id", "quantity_change"}, ...]
+        Возвращает признак успеха по каждому элементу или None при ошибке запроса.
+        """
+        result = await self._patch_delta("products/thermocups/update/stock/batch", {"items": items},
+                                         idempotency_key, confirmed)
+        for item in items:
+            self.invalidate_product(item["product_id"])
+        if result is None:
+            return None
+        
+        item_results = result.get("results") if isinstance(result, dict) else result
+        if not isinstance(item_results, list) or len(item_results) != len(items):
+            # Сервер подтвердил запрос целиком без деталей по элементам
+            return [True] * len(items)
+        return [bool(item.get("success", True)) if isinstance(item, dict) else bool(item) for item in item_results]
\ No newline at end of file
@@ -0,0 +1,109 @@
+# benchmarks/fake_telegram.py
+import asyncio
+import itertools
+import json
+from typing import Dict, Optional, Tuple
+
+from telegram import Bot, Update
+from telegram.request import BaseRequest, RequestData
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Warehouse", "username": "warehouse_bench_bot"}
+
+# Методы, в ответ на которые Telegram возвращает отправленное сообщение
+_MESSAGE_METHODS = {
+    "sendMessage", "editMessageText", "editMessageReplyMarkup", "sendDocument", "sendPhoto",
+}
+
+class FakeBotRequest(BaseRequest):
+    """
+    BaseRequest без сети: отвечает на вызовы Bot API как Telegram
+
+    Отправка сообщений возвращает сообщение с новым message_id, остальные
+    методы - True. latency имитирует время ответа Telegram. Число вызовов
+    по методам копится в calls.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Dict[str, int] = {}
+        self._message_ids = itertools.count(1_000_000)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=None,
+        write_timeout=None,
+        connect_timeout=None,
+        pool_timeout=None,
+    ) -> Tuple[int, bytes]:
+        name = url.rsplit("/", 1)[-1]
+        self.calls[name] = self.calls.get(name, 0) + 1
+        params = request_data.parameters if request_data else {}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if name == "getMe":
+            result = BOT_USER
+        elif name in _MESSAGE_METHODS:
+            chat_id = params.get("chat_id", 0)
+            result = {
+                "message_id": params.get("message_id", next(self._message_ids)),
+                "date": 0,
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+class UpdateFactory:
+    """Синтетические обновления от пользователей: текст, команды и нажатия кнопок"""
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    @staticmethod
+    def _user(user_id: int) -> Dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+
+    def text(self, user_id: int, text: str) -> Update:
+        message = {
+            "message_id": next(self._message_ids),
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return Update.de_json({"update_id": next(self._update_ids), "message": message}, self.bot)
+
+    def callback(self, user_id: int, data: str) -> Update:
+        update_id = next(self._update_ids)
+        return Update.de_json({
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "from": self._user(user_id),
+                "message": {
+                    "message_id": next(self._message_ids),
+                    "date": 0,
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": BOT_USER,
+                    "text": "menu",
+                },
+            },
+        }, self.bot)
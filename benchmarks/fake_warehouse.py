@@ -0,0 +1,219 @@
+# benchmarks/fake_warehouse.py
+import asyncio
+import random
+from typing import Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+CATEGORIES = ("Thermocups", "Bottles", "Lunchboxes", "Accessories")
+BRANDS = ("Stanley", "Contigo", "Thermos", "Zojirushi", "Tiger")
+
+def make_catalogue(size: int, seed: int = 1) -> List[Dict]:
+    """Синтетический каталог: термокружки с остатками, резервом и ценами"""
+    rng = random.Random(seed)
+    catalogue = []
+    for product_id in range(1, size + 1):
+        category_id = product_id % len(CATEGORIES) + 1
+        brand = BRANDS[product_id % len(BRANDS)]
+        catalogue.append({
+            "id": product_id,
+            "name": f"Термокружка {brand} {product_id}",
+            "sku": f"SKU-{product_id:06d}",
+            "category_id": category_id,
+            "category_name": CATEGORIES[category_id - 1],
+            "brand": brand,
+            "volume": rng.choice((350, 470, 500, 750)),
+            "total_quantity": rng.randint(0, 50),
+            "num_reserved_goods": rng.randint(0, 5),
+            "base_price": round(rng.uniform(500, 5000), 2),
+            "is_active": True,
+            "updated_at": "2024-01-01T00:00:00",
+        })
+    return catalogue
+
+class FakeWarehouse:
+    """
+    Локальная замена Warehouse API для нагрузочных тестов
+
+    Отдает те же эндпоинты, что использует api_client: список с фильтрами
+    и пагинацией, агрегаты, товар и термокружку по ID, создание и
+    обновление (PUT/PATCH). Каждый ответ задерживается на latency
+    секунд +- jitter, чтобы имитировать сеть и базу данных.
+
+    PATCH остатков и резерва меняет каталог. Повтор запроса с уже
+    встречавшимся заголовком Idempotency-Key не применяется второй раз, а
+    получает сохраненный ответ. Счетчики applied_deltas (примененные
+    изменения) и replayed (повторы по ключу) позволяют сверить число
+    примененных изменений с числом отправленных: лишние - изменение
+    применено дважды.
+    """
+
+    def __init__(self, catalogue_size: int = 1000, latency: float = 0.02, jitter: float = 0.0, seed: int = 1):
+        self.catalogue = make_catalogue(catalogue_size, seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.requests: Dict[str, int] = {}
+        self.applied_deltas = 0
+        self.replayed = 0
+        self._responses: Dict[str, Tuple[object, int]] = {}
+        self._rng = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _respond(self, request: web.Request, payload, status: int = 200) -> web.Response:
+        route = f"{request.method} {request.match_info.route.resource.canonical}"
+        self.requests[route] = self.requests.get(route, 0) + 1
+        delay = self.latency + self._rng.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return web.json_response(payload, status=status)
+
+    def _filter(self, query) -> List[Dict]:
+        products = self.catalogue
+        if "search" in query:
+            search = query["search"]
+            products = [p for p in products if search in p["name"] or search in p["sku"]]
+        if "category" in query:
+            products = [p for p in products if p["category_name"] == query["category"]]
+        if "min_price" in query:
+            products = [p for p in products if p["base_price"] >= float(query["min_price"])]
+        if "max_price" in query:
+            products = [p for p in products if p["base_price"] <= float(query["max_price"])]
+        if query.get("include_out_of_stock") == "false":
+            products = [p for p in products if p["total_quantity"] > 0]
+        return products
+
+    async def list_products(self, request: web.Request) -> web.Response:
+        products = self._filter(request.query)
+        offset = int(request.query.get("offset", 0))
+        limit = int(request.query.get("limit", 100))
+        return await self._respond(request, products[offset:offset + limit])
+
+    async def aggregates(self, request: web.Request) -> web.Response:
+        products = self._filter(request.query)
+        prices = [p["base_price"] for p in products]
+        return await self._respond(request, {
+            "total": len(products),
+            "active": sum(1 for p in products if p["is_active"]),
+            "out_of_stock": sum(1 for p in products if p["total_quantity"] <= 0),
+            "total_quantity": sum(p["total_quantity"] for p in products),
+            "total_reserved": sum(p["num_reserved_goods"] for p in products),
+            "min_price": min(prices, default=None),
+            "max_price": max(prices, default=None),
+            "avg_price": sum(prices) / len(prices) if prices else None,
+        })
+
+    def _find(self, product_id: int) -> Optional[Dict]:
+        if 1 <= product_id <= len(self.catalogue):
+            return self.catalogue[product_id - 1]
+        return None
+
+    def _product(self, request: web.Request) -> Optional[Dict]:
+        return self._find(int(request.match_info["product_id"]))
+
+    async def get_product(self, request: web.Request) -> web.Response:
+        product = self._product(request)
+        if product is None:
+            return await self._respond(request, {"detail": "Not found"}, status=404)
+        return await self._respond(request, product)
+
+    async def create_product(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        return await self._respond(request, {**data, "id": len(self.catalogue) + 1}, status=201)
+
+    async def update_product(self, request: web.Request) -> web.Response:
+        product = self._product(request)
+        if product is None:
+            return await self._respond(request, {"detail": "Not found"}, status=404)
+        return await self._respond(request, {**product, **await request.json()})
+
+    def _apply_delta(self, product: Dict, field: str, quantity_change: int) -> Dict:
+        column = "num_reserved_goods" if field == "reserved" else "total_quantity"
+        product[column] += quantity_change
+        self.applied_deltas += 1
+        return {"product_id": product["id"], column: product[column]}
+
+    async def _once(self, request: web.Request, apply: Callable[[Dict], Tuple[object, int]]) -> web.Response:
+        """Применить изменение один раз на Idempotency-Key, на повторы - сохраненный ответ"""
+        data = await request.json()
+        # Между проверкой ключа и сохранением ответа нет await: повтор,
+        # пришедший во время обработки, тоже получит сохраненный ответ
+        key = request.headers.get("Idempotency-Key")
+        if key is not None and key in self._responses:
+            self.replayed += 1
+            payload, status = self._responses[key]
+            return await self._respond(request, payload, status=status)
+        payload, status = apply(data)
+        if key is not None:
+            self._responses[key] = (payload, status)
+        return await self._respond(request, payload, status=status)
+
+    async def update_quantity(self, request: web.Request) -> web.Response:
+        product = self._product(request)
+        if product is None:
+            return await self._respond(request, {"detail": "Not found"}, status=404)
+        field = request.match_info["field"]
+        return await self._once(
+            request, lambda data: (self._apply_delta(product, field, int(data["quantity_change"])), 200)
+        )
+
+    async def update_stock_batch(self, request: web.Request) -> web.Response:
+        def apply(data: Dict) -> Tuple[object, int]:
+            results = []
+            for item in data.get("items", []):
+                product = self._find(int(item["product_id"]))
+                if product is None:
+                    results.append({"product_id": item["product_id"], "success": False})
+                    continue
+                self._apply_delta(product, "stock", int(item["quantity_change"]))
+                results.append({"product_id": product["id"], "success": True})
+            return {"results": results}, 200
+
+        return await self._once(request, apply)
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/api/products", self.list_products)
+        app.router.add_get("/api/products/aggregates", self.aggregates)
+        app.router.add_get(r"/api/products/{product_id:\d+}", self.get_product)
+        app.router.add_get(r"/api/products/thermocups/{product_id:\d+}", self.get_product)
+        app.router.add_post("/api/products/thermocups/create", self.create_product)
+        app.router.add_patch("/api/products/thermocups/update/stock/batch", self.update_stock_batch)
+        app.router.add_put(r"/api/products/thermocups/update/{product_id:\d+}", self.update_product)
+        app.router.add_patch(r"/api/products/thermocups/update/{product_id:\d+}/{field:reserved|stock}",
+                             self.update_quantity)
+        return app
+
+    def reset_counters(self) -> None:
+        """Обнулить счетчики запросов и изменений (например, после прогрева)"""
+        self.requests.clear()
+        self.applied_deltas = 0
+        self.replayed = 0
+
+    async def start(self, host: str = "127.0.0.1", port: int = 18080) -> None:
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+async def _serve(port: int, catalogue_size: int, latency: float) -> None:
+    warehouse = FakeWarehouse(catalogue_size, latency)
+    await warehouse.start(port=port)
+    print(f"Fake warehouse API: http://127.0.0.1:{port}/api ({catalogue_size} products, {latency * 1000:.0f} ms)")
+    await asyncio.Event().wait()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Локальная замена Warehouse API")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--catalogue", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(args.port, args.catalogue, args.latency))
+    except KeyboardInterrupt:
+        pass
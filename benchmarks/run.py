@@ -0,0 +1,249 @@
+# benchmarks/run.py
+"""
+Нагрузочный тест бота без сети
+
+Поднимает локальную замену Warehouse API (fake_warehouse.py), собирает
+Application из bot.py с BaseRequest-заглушкой вместо Telegram
+(fake_telegram.py) и прогоняет сценарий (scenarios.py) от имени
+нескольких пользователей одновременно. Обновления идут через
+update_queue, то есть через тот же обработчик обновлений, ConversationHandler
+и очередь отправки, что и в рабочем боте.
+
+Запуск из корня репозитория:
+    python -m benchmarks.run --scenario list_all --users 50
+    python -m benchmarks.run --scenario bulk_stock --users 10 --api-latency 0.05 --json bulk.json
+    python -m benchmarks.run --scenario search_miss --max-p95-ms 300   # код возврата 1 при превышении
+
+Задержка обновления - от постановки в очередь до завершения всех его
+обработчиков. Пользователь отправляет следующее действие только после
+обработки предыдущего.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+from benchmarks.scenarios import SCENARIOS, Step
+
+# Группа обработчика, который отмечает завершение обработки обновления
+_DONE_GROUP = 1000
+
+def configure_environment(args: argparse.Namespace) -> None:
+    """Переменные окружения для config.py: задаются до импорта модулей бота"""
+    os.environ["WAREHOUSE_API_URL"] = f"http://127.0.0.1:{args.port}/api"
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+    os.environ.setdefault("PERSISTENCE_PATH", ":memory:")
+    os.environ.setdefault("LOG_FILE", "")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("METRICS_ENABLED", "false")
+    # Лимиты Telegram измеряют паузы, а не работу бота; включаются флагом --rate-limit
+    os.environ["RATE_LIMIT_ENABLED"] = "true" if args.rate_limit else "false"
+
+def percentile(values: List[float], percent: float) -> float:
+    """Перцентиль методом ближайшего ранга"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(percent / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def latency_summary(values: List[float]) -> Dict:
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "max_ms": round(max(values, default=0.0) * 1000, 2),
+    }
+
+async def run_benchmark(args: argparse.Namespace) -> Dict:
+    configure_environment(args)
+
+    # Импорт после настройки окружения: Config читается при импорте
+    from telegram import Update
+    from telegram.ext import Application, ContextTypes, TypeHandler
+
+    import bot
+    from benchmarks.fake_telegram import FakeBotRequest, UpdateFactory
+    from benchmarks.fake_warehouse import FakeWarehouse
+    from handlers import get_session_stats
+
+    warehouse = FakeWarehouse(args.catalogue, args.api_latency, args.api_jitter, seed=args.seed)
+    await warehouse.start(port=args.port)
+
+    telegram = FakeBotRequest(args.telegram_latency)
+    application = bot.build_application(
+        Application.builder().request(telegram).get_updates_request(FakeBotRequest())
+    )
+
+    pending: Dict[int, asyncio.Future] = {}
+    errors: List[str] = []
+
+    async def mark_done(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        future = pending.pop(update.update_id, None)
+        if future is not None and not future.done():
+            future.set_result(time.perf_counter())
+
+    async def count_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+        errors.append(repr(context.error))
+
+    application.add_handler(TypeHandler(Update, mark_done), group=_DONE_GROUP)
+    application.add_error_handler(count_error)
+
+    factory = UpdateFactory(application.bot)
+    rng = random.Random(args.seed)
+    scenario = SCENARIOS[args.scenario]
+    latencies: Dict[str, List[float]] = {}
+    timeouts = 0
+
+    async def send(user_id: int, step: Step) -> None:
+        nonlocal timeouts
+        if step.kind == "text":
+            update = factory.text(user_id, step.payload)
+        else:
+            update = factory.callback(user_id, step.payload)
+        future = asyncio.get_running_loop().create_future()
+        pending[update.update_id] = future
+        started = time.perf_counter()
+        await application.update_queue.put(update)
+        try:
+            finished = await asyncio.wait_for(future, timeout=args.timeout)
+        except asyncio.TimeoutError:
+            pending.pop(update.update_id, None)
+            timeouts += 1
+            return
+        latencies.setdefault(step.label, []).append(finished - started)
+
+    async def simulate_user(user_id: int) -> None:
+        for _ in range(args.rounds):
+            for step in scenario(user_id, rng, args.catalogue):
+                await send(user_id, step)
+                if args.think_time:
+                    await asyncio.sleep(rng.uniform(0, 2 * args.think_time))
+
+    user_ids = [100_000 + index for index in range(args.users)]
+    try:
+        async with application:
+            await application.post_init(application)
+            await application.start()
+
+            # Прогрев: импорт ленивых модулей, первое соединение с API
+            await simulate_user(99_999)
+            latencies.clear()
+            application.drop_user_data(99_999)
+            warehouse.reset_counters()
+
+            if args.tracemalloc:
+                tracemalloc.start()
+            memory_before = tracemalloc.get_traced_memory()[0] if args.tracemalloc else 0
+
+            started = time.perf_counter()
+            await asyncio.gather(*(simulate_user(user_id) for user_id in user_ids))
+            elapsed = time.perf_counter() - started
+
+            heap_per_user = None
+            if args.tracemalloc:
+                heap_per_user = (tracemalloc.get_traced_memory()[0] - memory_before) / args.users
+                tracemalloc.stop()
+            sessions = get_session_stats(application.user_data)
+
+            await application.stop()
+            await application.post_shutdown(application)
+    finally:
+        await warehouse.stop()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "scenario": args.scenario,
+        "users": args.users,
+        "rounds": args.rounds,
+        "catalogue": args.catalogue,
+        "api_latency_ms": args.api_latency * 1000,
+        "telegram_latency_ms": args.telegram_latency * 1000,
+        "rate_limit": args.rate_limit,
+        "updates": len(all_latencies),
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(len(all_latencies) / elapsed, 1) if elapsed else 0.0,
+        "latency": latency_summary(all_latencies),
+        "latency_by_step": {label: latency_summary(values) for label, values in latencies.items()},
+        "user_data_bytes_per_user": round(sessions["user_data_bytes"] / max(sessions["users"], 1)),
+        "heap_bytes_per_user": None if heap_per_user is None else round(heap_per_user),
+        "cache_bytes": {"api": sessions["page_cache_bytes"], "cards": sessions["card_cache_bytes"]},
+        "warehouse_requests": dict(sorted(warehouse.requests.items())),
+        "stock_deltas": {"applied": warehouse.applied_deltas, "replayed": warehouse.replayed},
+        "telegram_requests": dict(sorted(telegram.calls.items())),
+        "errors": len(errors),
+        "timeouts": timeouts,
+    }
+
+def format_report(report: Dict) -> str:
+    lines = [
+        f"Сценарий {report['scenario']}: {report['users']} польз. x {report['rounds']}, "
+        f"каталог {report['catalogue']}, API {report['api_latency_ms']:.0f} мс, "
+        f"Telegram {report['telegram_latency_ms']:.0f} мс, лимиты {'вкл' if report['rate_limit'] else 'выкл'}",
+        f"Обновлений: {report['updates']} за {report['elapsed_s']} с -> {report['updates_per_s']} обн/с",
+        "",
+        f"{'шаг':<24}{'кол-во':>8}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'max мс':>10}",
+    ]
+    rows = list(report["latency_by_step"].items()) + [("ВСЕГО", report["latency"])]
+    for label, summary in rows:
+        lines.append(
+            f"{label:<24}{summary['count']:>8}{summary['p50_ms']:>10}{summary['p95_ms']:>10}"
+            f"{summary['p99_ms']:>10}{summary['max_ms']:>10}"
+        )
+    lines.append("")
+    lines.append(f"user_data на пользователя: {report['user_data_bytes_per_user']} байт")
+    if report["heap_bytes_per_user"] is not None:
+        lines.append(f"Прирост кучи на пользователя (tracemalloc): {report['heap_bytes_per_user']} байт")
+    lines.append(f"Кэши: API {report['cache_bytes']['api']} байт, карточки {report['cache_bytes']['cards']} байт")
+    lines.append(f"Запросы к Warehouse API: {report['warehouse_requests']}")
+    lines.append(
+        f"Изменения остатков: применено {report['stock_deltas']['applied']}, "
+        f"повторов по Idempotency-Key {report['stock_deltas']['replayed']}"
+    )
+    lines.append(f"Запросы к Telegram: {report['telegram_requests']}")
+    lines.append(f"Ошибок обработчиков: {report['errors']}, таймаутов: {report['timeouts']}")
+    return "\n".join(lines)
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с локальным Warehouse API")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="list_all")
+    parser.add_argument("--users", type=int, default=20, help="одновременных пользователей")
+    parser.add_argument("--rounds", type=int, default=1, help="повторов сценария каждым пользователем")
+    parser.add_argument("--think-time", type=float, default=0.0, help="средняя пауза между действиями, с")
+    parser.add_argument("--catalogue", type=int, default=1000, help="товаров в каталоге")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="задержка ответа API, с")
+    parser.add_argument("--api-jitter", type=float, default=0.005, help="разброс задержки API, с")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="задержка ответа Telegram, с")
+    parser.add_argument("--rate-limit", action="store_true", help="включить очередь отправки с лимитами Telegram")
+    parser.add_argument("--tracemalloc", action="store_true", help="измерить прирост кучи (замедляет прогон)")
+    parser.add_argument("--port", type=int, default=18080, help="порт локального Warehouse API")
+    parser.add_argument("--timeout", type=float, default=60.0, help="предельное время обработки обновления, с")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", dest="json_path", help="сохранить отчет в JSON")
+    parser.add_argument("--max-p95-ms", type=float, help="завершиться с кодом 1, если p95 выше")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    report = asyncio.run(run_benchmark(args))
+    print(format_report(report))
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+    if report["errors"] or report["timeouts"]:
+        return 1
+    if args.max_p95_ms is not None and report["latency"]["p95_ms"] > args.max_p95_ms:
+        print(f"p95 {report['latency']['p95_ms']} мс выше порога {args.max_p95_ms} мс")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
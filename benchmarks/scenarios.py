@@ -0,0 +1,60 @@
+# benchmarks/scenarios.py
+import random
+from typing import Callable, Dict, List, NamedTuple
+
+class Step(NamedTuple):
+    """Действие пользователя: текст/команда (text) или нажатие кнопки (callback)"""
+    kind: str
+    payload: str
+    label: str
+
+def text(payload: str, label: str) -> Step:
+    return Step("text", payload, label)
+
+def press(callback_data: str) -> Step:
+    return Step("callback", callback_data, callback_data)
+
+# Сценарий: (ID пользователя, генератор случайных чисел, размер каталога) -> шаги
+Scenario = Callable[[int, random.Random, int], List[Step]]
+
+def list_all(user_id: int, rng: random.Random, catalogue_size: int) -> List[Step]:
+    """Список всех товаров с листанием страниц вперед и назад"""
+    return [
+        text("/start", "start"),
+        press("get_products"),
+        press("all_products"),
+        press("show_more_products"),
+        press("show_more_products"),
+        press("show_prev_products"),
+        press("back_to_products_menu"),
+        press("back_to_main"),
+    ]
+
+def search_miss(user_id: int, rng: random.Random, catalogue_size: int) -> List[Step]:
+    """Быстрый поиск без результатов: проходит все стратегии поиска"""
+    return [
+        text("/start", "start"),
+        press("get_products"),
+        press("search_products"),
+        text(f"нет-такого-товара-{user_id}-{rng.randrange(10 ** 6)}", "search_query"),
+        press("back_to_products_menu"),
+    ]
+
+def bulk_stock(user_id: int, rng: random.Random, catalogue_size: int, lines: int = 50) -> List[Step]:
+    """Массовое обновление склада: lines строк "ID|склад|изменение" одним сообщением"""
+    rows = "\n".join(
+        f"{rng.randint(1, catalogue_size)}|{rng.randint(1, 3)}|{rng.choice((-2, -1, 1, 2, 5))}"
+        for _ in range(lines)
+    )
+    return [
+        text("/start", "start"),
+        press("update_products"),
+        press("bulk_stock"),
+        text(rows, "bulk_stock_lines"),
+    ]
+
+SCENARIOS: Dict[str, Scenario] = {
+    "list_all": list_all,
+    "search_miss": search_miss,
+    "bulk_stock": bulk_stock,
+}
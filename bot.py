@@ -1,13 +1,28 @@
 # bot.py
+import asyncio
 import logging
+from typing import Optional
+from telegram import Update
 from telegram.ext import (
-    Application, CommandHandler, CallbackQueryHandler, 
-    MessageHandler, filters, ContextTypes, ConversationHandler
+    Application, ApplicationBuilder, CallbackQueryHandler, CommandHandler, 
+    MessageHandler, TypeHandler, filters, ContextTypes, ConversationHandler
 )
 
+from concurrency import PerChatUpdateProcessor
 from config import Config
 from logger import logger
+from menus import build_callback_routers
+from metrics import (
+    REGISTRY, SEND_QUEUE_DEPTH, UPDATES_ACTIVE,
+    cache_collector, start_metrics_server, timed_handler,
+)
+from persistence import SQLitePersistence
+from ratelimit import SendScheduler
+from tracing import traced_handler
+from webhook import run_webhook
 from handlers import (
+    api_client, get_render_cache_stats,
+    
     # Основные меню
     start, back_to_main, back_to_main_from_message, cancel,
     
@@ -23,63 +38,175 @@ from handlers import (
     
     # Добавить продукты
     add_products_menu, add_thermocup_start, add_thermocup_process,
+    import_thermocups_start, import_thermocups_document,
     
     # Обновить продукты
     update_products_menu, update_thermocup_start, update_thermocup_process,
     update_thermocup_data_process, update_reserved_start, update_reserved_process,
     update_reserved_quantity_process, update_stock_start, update_stock_process,
     update_stock_warehouse_process, update_stock_quantity_process,
+    bulk_stock_start, bulk_stock_process, bulk_stock_document,
     
     # Вспомогательные
-    error_handler, show_more_products,
+    error_handler, profile_command, memprofile_command, show_more_products, show_prev_products, refresh_product_index,
+    track_session_activity, evict_idle_sessions, get_session_stats,
     
     # Состояния
     MAIN_MENU, GET_PRODUCTS_MENU, ADD_PRODUCT_MENU, UPDATE_PRODUCT_MENU,
     ENTER_PRODUCT_ID, ENTER_SEARCH_QUERY, ENTER_THERMOCUP_DATA, ENTER_CATEGORY, ENTER_PRICE_RANGE,
     ENTER_UPDATE_DATA, ENTER_RESERVED_QUANTITY, ENTER_STOCK_QUANTITY, 
-    ENTER_WAREHOUSE_ID
+    ENTER_WAREHOUSE_ID, ENTER_BULK_STOCK, ENTER_IMPORT_FILE
 )
 
-def main() -> None:
-    """Запуск бота"""
-    
-    logger.info(f"Токен бота: {Config.BOT_TOKEN[:10]}...")
+# Обработчики кнопок меню из реестра menus.py
+CALLBACK_ACTIONS = {
+    "get_products": get_products_menu,
+    "add_products": add_products_menu,
+    "update_products": update_products_menu,
+    "back_to_main": back_to_main,
+    "back_to_products_menu": get_products_menu,
+    "all_products": get_all_products,
+    "search_products": search_products_start,
+    "search_name": search_products_start,
+    "advanced_search": advanced_search_start,
+    "search_category": search_by_category_start,
+    "search_price_range": search_by_price_start,
+    "search_in_stock": search_in_stock_only,
+    "by_id": get_product_by_id_start,
+    "thermocup_by_id": get_thermocup_by_id_start,
+    "show_more_products": show_more_products,
+    "show_prev_products": show_prev_products,
+    "add_thermocup": add_thermocup_start,
+    "import_thermocups": import_thermocups_start,
+    "update_thermocup": update_thermocup_start,
+    "update_reserved": update_reserved_start,
+    "update_stock": update_stock_start,
+    "bulk_stock": bulk_stock_start,
+}
+
+def instrument(callback):
+    """Метрики и участок трассировки для обработчика"""
+    return timed_handler(traced_handler(callback))
+
+def instrument_conversation(conversation: ConversationHandler) -> None:
+    """
+    Замер времени и трассировка обработчиков сообщений и команд диалога
+
+    Нажатия кнопок не трогаются: их обработчики обернуты в CALLBACK_ACTIONS,
+    иначе все они попали бы в метрики под именем CallbackRouter.dispatch.
+    """
+    handlers = list(conversation.entry_points) + list(conversation.fallbacks)
+    for state_handlers in conversation.states.values():
+        handlers.extend(state_handlers)
+    for handler in handlers:
+        if not isinstance(handler, CallbackQueryHandler):
+            handler.callback = instrument(handler.callback)
+
+def runtime_collector(application: Application):
+    """Коллектор метрик очереди отправки и обработки обновлений"""
+    def collect():
+        metrics = []
+        if isinstance(application.bot.rate_limiter, SendScheduler):
+            queued = application.bot.rate_limiter.stats()["queued"]
+            metrics.append((SEND_QUEUE_DEPTH, [({"priority": name}, depth) for name, depth in queued.items()]))
+        if isinstance(application.update_processor, PerChatUpdateProcessor):
+            metrics.append((UPDATES_ACTIVE, [({}, application.update_processor.stats()["active"])]))
+        return metrics
+    return collect
+
+async def post_init(application: Application) -> None:
+    """Открыть общую сессию API и запустить фоновые задачи при старте бота"""
+    await api_client.start()
+    if Config.METRICS_ENABLED:
+        REGISTRY.add_collector(cache_collector({"api": api_client.cache_stats, "cards": get_render_cache_stats}))
+        REGISTRY.add_collector(runtime_collector(application))
+        application.bot_data["metrics_runner"] = await start_metrics_server(
+            Config.METRICS_HOST, Config.METRICS_PORT
+        )
+    application.job_queue.run_repeating(
+        refresh_product_index,
+        interval=Config.SEARCH_INDEX_REFRESH_INTERVAL,
+        first=0,
+        name="refresh_product_index",
+    )
+    application.job_queue.run_repeating(
+        evict_idle_sessions,
+        interval=Config.SESSION_JANITOR_INTERVAL,
+        name="evict_idle_sessions",
+    )
+
+async def post_shutdown(application: Application) -> None:
+    """Закрыть сессию API и сервер метрик при остановке бота"""
+    await api_client.close()
+    metrics_runner = application.bot_data.pop("metrics_runner", None)
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+
+def health_info(application: Application) -> dict:
+    """Состояние API и обработки обновлений для /readyz"""
+    info = {"api": api_client.breaker_stats()}
+    if isinstance(application.update_processor, PerChatUpdateProcessor):
+        info["updates"] = application.update_processor.stats()
+    if isinstance(application.persistence, SQLitePersistence):
+        info["persistence"] = application.persistence.stats()
+    if isinstance(application.bot.rate_limiter, SendScheduler):
+        info["send_queue"] = application.bot.rate_limiter.stats()
+    info["sessions"] = get_session_stats(application.user_data)
+    info["caches"] = {"api": api_client.cache_stats(), "cards": get_render_cache_stats()}
+    return info
+
+def build_application(builder: Optional[ApplicationBuilder] = None) -> Application:
+    """
+    Собрать Application со всеми обработчиками
 
-    application = Application.builder().token(Config.BOT_TOKEN).build()
+    builder - заготовка с уже заданными параметрами (например, своим
+    BaseRequest для нагрузочных тестов, см. benchmarks/).
+    """
+    builder = (
+        (builder or Application.builder())
+        .token(Config.BOT_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if Config.RATE_LIMIT_ENABLED:
+        # Все исходящие запросы обработчиков проходят через общую очередь
+        builder = builder.rate_limiter(SendScheduler(
+            overall_rate=Config.RATE_LIMIT_OVERALL,
+            chat_rate=Config.RATE_LIMIT_CHAT,
+            chat_burst=Config.RATE_LIMIT_CHAT_BURST,
+            group_rate=Config.RATE_LIMIT_GROUP_PER_MINUTE / 60,
+            max_retries=Config.RATE_LIMIT_MAX_RETRIES,
+        ))
+    if Config.PERSISTENCE_PATH:
+        builder = builder.persistence(SQLitePersistence(
+            Config.PERSISTENCE_PATH,
+            update_interval=Config.PERSISTENCE_FLUSH_INTERVAL,
+            session_ttl=Config.SESSION_TTL,
+        ))
+    # Разные чаты обрабатываются параллельно, внутри чата - по порядку;
+    # при UPDATE_WORKERS=1 - по одному, но тоже с трассировкой обновлений
+    builder = builder.concurrent_updates(
+        PerChatUpdateProcessor(max(Config.UPDATE_WORKERS, 1), Config.UPDATE_MAX_PENDING)
+    )
+    application = builder.build()
+    
+    # Нажатия кнопок: по одному обработчику на состояние, выбор по callback_data
+    routers = build_callback_routers(
+        {data: instrument(action) for data, action in CALLBACK_ACTIONS.items()}
+    )
     
     # ConversationHandler с новой структурой
     conv_handler = ConversationHandler(
+        name="main",
+        persistent=bool(Config.PERSISTENCE_PATH),
+        # Диалог завершается вместе с удалением user_data неактивного пользователя
+        conversation_timeout=Config.SESSION_IDLE_TIMEOUT,
         entry_points=[CommandHandler("start", start)],
         states={
-            MAIN_MENU: [
-                CallbackQueryHandler(get_products_menu, pattern="^get_products$"),
-                CallbackQueryHandler(add_products_menu, pattern="^add_products$"),
-                CallbackQueryHandler(update_products_menu, pattern="^update_products$"),
-                CallbackQueryHandler(back_to_main, pattern="^back_to_main$"),
-            ],
-            GET_PRODUCTS_MENU: [
-                CallbackQueryHandler(get_all_products, pattern="^all_products$"),
-                CallbackQueryHandler(search_products_start, pattern="^search_products$"),
-                CallbackQueryHandler(advanced_search_start, pattern="^advanced_search$"),
-                CallbackQueryHandler(search_by_category_start, pattern="^search_category$"),
-                CallbackQueryHandler(search_by_price_start, pattern="^search_price_range$"),
-                CallbackQueryHandler(search_in_stock_only, pattern="^search_in_stock$"),
-                CallbackQueryHandler(get_product_by_id_start, pattern="^by_id$"),
-                CallbackQueryHandler(get_thermocup_by_id_start, pattern="^thermocup_by_id$"),
-                CallbackQueryHandler(back_to_main, pattern="^back_to_main$"),
-                CallbackQueryHandler(get_products_menu, pattern="^back_to_products_menu$"),
-                CallbackQueryHandler(show_more_products, pattern="^show_more_products$"),
-            ],
-            ADD_PRODUCT_MENU: [
-                CallbackQueryHandler(add_thermocup_start, pattern="^add_thermocup$"),
-                CallbackQueryHandler(back_to_main, pattern="^back_to_main$"),
-            ],
-            UPDATE_PRODUCT_MENU: [
-                CallbackQueryHandler(update_thermocup_start, pattern="^update_thermocup$"),
-                CallbackQueryHandler(update_reserved_start, pattern="^update_reserved$"),
-                CallbackQueryHandler(update_stock_start, pattern="^update_stock$"),
-                CallbackQueryHandler(back_to_main, pattern="^back_to_main$"),
-            ],
+            MAIN_MENU: [routers[MAIN_MENU].handler()],
+            GET_PRODUCTS_MENU: [routers[GET_PRODUCTS_MENU].handler()],
+            ADD_PRODUCT_MENU: [routers[ADD_PRODUCT_MENU].handler()],
+            UPDATE_PRODUCT_MENU: [routers[UPDATE_PRODUCT_MENU].handler()],
             ENTER_PRODUCT_ID: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_product_id_input),
             ],
@@ -95,6 +222,9 @@ def main() -> None:
             ENTER_THERMOCUP_DATA: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, add_thermocup_process),
             ],
+            ENTER_IMPORT_FILE: [
+                MessageHandler(filters.Document.ALL, import_thermocups_document),
+            ],
             ENTER_UPDATE_DATA: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, update_thermocup_data_process),
             ],
@@ -107,15 +237,36 @@ def main() -> None:
             ENTER_STOCK_QUANTITY: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, update_stock_quantity_process),
             ],
+            ENTER_BULK_STOCK: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, bulk_stock_process),
+                MessageHandler(filters.Document.ALL, bulk_stock_document),
+            ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
     )
+    instrument_conversation(conv_handler)
     
+    # Учет активности до всех остальных обработчиков
+    application.add_handler(TypeHandler(Update, track_session_activity), group=-1)
+    # Команды администраторов - раньше диалога, в любом его состоянии
+    application.add_handler(CommandHandler("profile", instrument(profile_command)))
+    application.add_handler(CommandHandler("memprofile", instrument(memprofile_command)))
     application.add_handler(conv_handler)
     application.add_error_handler(error_handler)
+    return application
+
+def main() -> None:
+    """Запуск бота"""
+    
+    logger.info(f"Токен бота: {Config.BOT_TOKEN[:10]}...")
+    application = build_application()
     
-    logger.info("Бот запущен...")
-    application.run_polling()
+    if Config.BOT_MODE == 'webhook':
+        logger.info("Бот запущен в режиме webhook...")
+        asyncio.run(run_webhook(application, health_info=lambda: health_info(application)))
+    else:
+        logger.info("Бот запущен...")
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,413 @@
+# bulk.py
+import asyncio
+import csv
+import hashlib
+import io
+import itertools
+import json
+import logging
+import re
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Разделители полей: "|" из формата бота, а также "," и ";" из CSV
+_FIELD_SPLIT = re.compile(r'[|,;\t]')
+
+class StockChange(NamedTuple):
+    """Одна строка массового обновления склада"""
+    line_no: int
+    product_id: int
+    warehouse_id: int
+    quantity_change: int
+
+class LineError(NamedTuple):
+    """Строка, не прошедшая проверку"""
+    line_no: int
+    raw: str
+    reason: str
+
+def parse_stock_lines(lines: Iterable[str], max_lines: Optional[int] = None) -> Tuple[List[StockChange], List[LineError]]:
+    """
+    Разбирает строки `product_id | warehouse_id | delta`
+
+    Пустые строки и строка заголовка (первая строка без чисел) пропускаются.
+
+    Returns:
+        Tuple[List[StockChange], List[LineError]]: корректные изменения и ошибки
+    """
+    changes: List[StockChange] = []
+    errors: List[LineError] = []
+    seen_data = False
+
+    for line_no, raw in enumerate(lines, 1):
+        line = raw.strip()
+        if not line:
+            continue
+
+        parts = [part.strip() for part in _FIELD_SPLIT.split(line)]
+
+        if not seen_data and not any(part.lstrip('+-').isdigit() for part in parts):
+            # Заголовок CSV
+            continue
+        seen_data = True
+
+        if max_lines is not None and len(changes) + len(errors) >= max_lines:
+            errors.append(LineError(line_no, line, f"превышен лимит в {max_lines} строк"))
+            break
+
+        if len(parts) != 3:
+            errors.append(LineError(line_no, line, "нужно 3 поля: ID продукта | ID склада | изменение"))
+            continue
+
+        try:
+            product_id, warehouse_id, quantity_change = (int(part) for part in parts)
+        except ValueError:
+            errors.append(LineError(line_no, line, "все поля должны быть целыми числами"))
+            continue
+
+        if product_id <= 0 or warehouse_id <= 0:
+            errors.append(LineError(line_no, line, "ID должны быть положительными"))
+        elif quantity_change == 0:
+            errors.append(LineError(line_no, line, "изменение не может быть нулевым"))
+        else:
+            changes.append(StockChange(line_no, product_id, warehouse_id, quantity_change))
+
+    return changes, errors
+
+def stock_change_keys(changes: List[StockChange], key_prefix: str) -> List[str]:
+    """
+    Ключи идемпотентности строк: содержимое + номер среди одинаковых строк
+
+    Две одинаковые строки в одном сообщении - два разных изменения
+    (:0 и :1), а позиция строки в ключ не входит.
+    """
+    seen: Dict[Tuple[int, int, int], int] = {}
+    keys = []
+    for change in changes:
+        content = (change.product_id, change.warehouse_id, change.quantity_change)
+        occurrence = seen.get(content, 0)
+        seen[content] = occurrence + 1
+        keys.append(f"{key_prefix}:{change.product_id}:{change.warehouse_id}:{change.quantity_change}:{occurrence}")
+    return keys
+
+async def apply_stock_changes(api_client, changes: List[StockChange], concurrency: int = 5,
+                              use_batch: bool = False, key_prefix: Optional[str] = None,
+                              confirmed: bool = False) -> List[Tuple[StockChange, Optional[bool]]]:
+    """
+    Отправляет изменения склада: одним batch-запросом или параллельно с ограничением
+
+    Args:
+        key_prefix: Префикс ключей идемпотентности операции; ключ каждой
+            строки - ее содержимое и номер среди одинаковых строк (но не
+            позиция в сообщении), поэтому повторная отправка тех же строк,
+            в другом порядке или только непримененных, не применит
+            изменения дважды
+        confirmed: Отправить и изменения с неизвестным результатом
+            (см. WarehouseAPIClient.outcome_unknown) - после проверки остатков
+
+    Returns:
+        List[Tuple[StockChange, Optional[bool]]]: результат по каждой строке
+            в исходном порядке; None - ответ не получен, изменение могло примениться
+    """
+    if use_batch:
+        items = [
+            {
+                "product_id": change.product_id,
+                "warehouse_id": change.warehouse_id,
+                "quantity_change": change.quantity_change,
+            }
+            for change in changes
+        ]
+        batch_key = None
+        if key_prefix is not None:
+            # Порядок строк не влияет на ключ
+            canonical = sorted(json.dumps(item, sort_keys=True) for item in items)
+            digest = hashlib.sha1(json.dumps(canonical).encode()).hexdigest()
+            batch_key = f"{key_prefix}:batch:{digest}"
+        results = await api_client.update_thermocup_stock_batch(items, idempotency_key=batch_key,
+                                                                confirmed=confirmed)
+        # Повторять по одной нельзя: часть изменений могла уже примениться
+        if results is None:
+            outcome = None if api_client.outcome_unknown(batch_key) else False
+            return [(change, outcome) for change in changes]
+        return list(zip(changes, results))
+
+    semaphore = asyncio.Semaphore(concurrency)
+    keys = stock_change_keys(changes, key_prefix) if key_prefix is not None else [None] * len(changes)
+
+    async def apply(change: StockChange, key: Optional[str]) -> Tuple[StockChange, Optional[bool]]:
+        async with semaphore:
+            result = await api_client.update_thermocup_stock(
+                change.product_id, change.warehouse_id, change.quantity_change,
+                idempotency_key=key, confirmed=confirmed
+            )
+        if result is None and api_client.outcome_unknown(key):
+            return change, None
+        return change, result is not None
+
+    return await asyncio.gather(*(apply(change, key) for change, key in zip(changes, keys)))
+
+def format_stock_report(results: List[Tuple[StockChange, Optional[bool]]]) -> str:
+    """Сводка по массовому обновлению: сначала ошибки и неизвестные результаты, затем успешные строки"""
+    failed = [change for change, ok in results if ok is False]
+    unknown = [change for change, ok in results if ok is None]
+    succeeded = [change for change, ok in results if ok]
+
+    lines = [
+        "🏭 Массовое обновление склада завершено",
+        f"✅ Успешно: {len(succeeded)}",
+        f"❌ Ошибок: {len(failed)}",
+    ]
+    if unknown:
+        lines.append(f"⚠️ Результат неизвестен: {len(unknown)}")
+    for title, group in (("Не применены", failed), ("Могли примениться (ответ не получен)", unknown),
+                         ("Применены", succeeded)):
+        if group:
+            lines.append(f"\n{title}:")
+            lines.extend(
+                f"• стр. {c.line_no}: продукт {c.product_id}, склад {c.warehouse_id}, {c.quantity_change:+d}"
+                for c in group
+            )
+    return "\n".join(lines)
+
+def format_line_errors(errors: List[LineError]) -> str:
+    """Список строк с ошибками проверки"""
+    lines = [f"❌ Найдены ошибки в {len(errors)} строках, ничего не отправлено:"]
+    lines.extend(f"• стр. {e.line_no}: \"{e.raw}\" - {e.reason}" for e in errors)
+    return "\n".join(lines)
+
+# ===== ИМПОРТ ТЕРМОКРУЖЕК ИЗ ФАЙЛА =====
+class RejectedRow(NamedTuple):
+    """Строка файла, которая не была импортирована"""
+    row_no: int
+    values: List[str]
+    reason: str
+
+class ImportAborted(Exception):
+    """
+    Импорт прерван ошибкой (чтение файла, сбой воркера)
+
+    created и rejected - итог до ошибки; исходная ошибка - в __cause__.
+    """
+
+    def __init__(self, created: int, rejected: List[RejectedRow]):
+        super().__init__(f"импорт прерван: создано {created}, отклонено {len(rejected)}")
+        self.created = created
+        self.rejected = rejected
+
+def parse_thermocup_row(parts: List[str]) -> Dict:
+    """
+    Данные термокружки из полей `Название | Категория ID | Цена | Количество | ...`
+
+    Значения по умолчанию те же, что и при добавлении одной термокружки.
+    Raises:
+        ValueError: если полей меньше четырех или числа указаны неверно
+    """
+    if len(parts) < 4:
+        raise ValueError("нужно минимум 4 поля: Название | Категория ID | Цена | Количество")
+
+    return {
+        "name": parts[0],
+        "category_id": int(parts[1]),
+        "base_price": float(parts[2]),
+        "initial_quantity": int(parts[3]),
+        "warehouse_id": int(parts[4]) if len(parts) > 4 and parts[4] else 1,
+        "path_to_photo": parts[5] if len(parts) > 5 else "",
+        "attributes": {
+            "volume_ml": int(parts[6]) if len(parts) > 6 and parts[6] else 500,
+            "color": parts[7] if len(parts) > 7 and parts[7] else "Черный",
+            "brand": parts[8] if len(parts) > 8 and parts[8] else "Unknown",
+            "model": parts[0],
+            "is_hermetic": True,
+            "material": "Нержавеющая сталь"
+        }
+    }
+
+def _cell_to_str(value) -> str:
+    """Значение ячейки XLSX в строку (1.0 -> "1")"""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+# Сколько строк файла читать за один переход в поток
+_ROWS_PER_READ = 200
+
+async def _rows_in_thread(rows: Iterator[List[str]]) -> AsyncIterator[List[str]]:
+    """
+    Строки синхронного итератора, прочитанные в потоке пачками
+
+    Открытие файла, разбор XLSX и чтение строк не блокируют цикл событий;
+    итератор закрывается (и файл вместе с ним), даже если строки дочитаны
+    не до конца.
+    """
+    read: Optional[asyncio.Future] = None
+    try:
+        while True:
+            read = asyncio.ensure_future(asyncio.to_thread(list, itertools.islice(rows, _ROWS_PER_READ)))
+            chunk = await asyncio.shield(read)
+            if not chunk:
+                return
+            for row in chunk:
+                yield row
+    finally:
+        # Поток нельзя прервать: при отмене дожидаемся чтения пачки, иначе
+        # итератор закрывался бы, пока поток его еще читает
+        if read is not None and not read.done():
+            await asyncio.wait([read])
+        await asyncio.to_thread(rows.close)
+
+def _read_csv_rows(path: str) -> Iterator[List[str]]:
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        first_line = f.readline()
+        f.seek(0)
+        delimiter = max(',;|\t', key=first_line.count)
+        for row in csv.reader(f, delimiter=delimiter):
+            yield [cell.strip() for cell in row]
+
+def _read_xlsx_rows(path: str) -> Iterator[List[str]]:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield [_cell_to_str(value) for value in row]
+    finally:
+        workbook.close()
+
+def iter_csv_rows(path: str) -> AsyncIterator[List[str]]:
+    """Построчно читает CSV в потоке; разделитель - самый частый из ,;|\\t в первой строке"""
+    return _rows_in_thread(_read_csv_rows(path))
+
+def iter_xlsx_rows(path: str) -> AsyncIterator[List[str]]:
+    """Построчно читает первый лист XLSX в потоке, в режиме read_only (нужен openpyxl)"""
+    return _rows_in_thread(_read_xlsx_rows(path))
+
+# Числовые поля строки импорта: Категория ID, Цена, Количество
+_NUMERIC_COLUMNS = (1, 2, 3)
+
+def _is_number(value: str) -> bool:
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return True
+
+def _is_header(values: List[str]) -> bool:
+    """
+    Первая строка считается заголовком, если ни одно из ее числовых полей
+    не число: строка данных с опечаткой в одном поле не пропускается молча,
+    а попадает в отчет об ошибках.
+    """
+    numeric = [values[index] for index in _NUMERIC_COLUMNS if index < len(values)]
+    return bool(numeric) and not any(_is_number(value) for value in numeric)
+
+async def import_thermocups(api_client, rows: AsyncIterator[List[str]], concurrency: int = 5,
+                            max_rows: Optional[int] = None,
+                            on_progress: Optional[Callable[[int, int, int], Awaitable[None]]] = None
+                            ) -> Tuple[int, List[RejectedRow]]:
+    """
+    Создает термокружки из строк файла, не загружая файл целиком
+
+    Несколько воркеров по очереди берут строки из общего итератора
+    (iter_csv_rows, iter_xlsx_rows), поэтому в памяти одновременно не
+    больше `concurrency` строк и одной прочитанной пачки.
+
+    Args:
+        on_progress: корутина (обработано, создано, отклонено)
+
+    Returns:
+        Tuple[int, List[RejectedRow]]: число созданных и отклоненные строки
+    Raises:
+        ImportAborted: при первой ошибке одного из воркеров; остальные
+            воркеры отменяются, строки, создание которых было прервано,
+            попадают в отклоненные
+    """
+    row_no = 0
+    created = 0
+    processed = 0
+    rejected: List[RejectedRow] = []
+    header_checked = False
+    taken = 0
+    exhausted = False
+    # Асинхронный генератор нельзя продвигать из двух задач одновременно
+    read_lock = asyncio.Lock()
+
+    async def next_row() -> Optional[Tuple[int, List[str]]]:
+        async with read_lock:
+            return await _next_row()
+
+    async def _next_row() -> Optional[Tuple[int, List[str]]]:
+        nonlocal row_no, header_checked, taken, exhausted
+        if exhausted:
+            return None
+        async for values in rows:
+            row_no += 1
+            if not any(values):
+                continue
+            if not header_checked:
+                header_checked = True
+                if _is_header(values):
+                    continue
+            if max_rows is not None and taken >= max_rows:
+                rejected.append(RejectedRow(row_no, values, f"превышен лимит в {max_rows} строк, дальше файл не читался"))
+                break
+            taken += 1
+            return row_no, values
+        exhausted = True
+        return None
+
+    async def worker() -> None:
+        nonlocal created, processed
+        while True:
+            item = await next_row()
+            if item is None:
+                return
+            row_no, values = item
+
+            try:
+                thermocup_data = parse_thermocup_row(values)
+            except (ValueError, IndexError) as e:
+                rejected.append(RejectedRow(row_no, values, str(e)))
+            else:
+                try:
+                    result = await api_client.create_thermocup(thermocup_data)
+                except asyncio.CancelledError:
+                    rejected.append(RejectedRow(row_no, values, "импорт прерван во время создания - проверьте, создан ли товар"))
+                    raise
+                if result:
+                    created += 1
+                else:
+                    rejected.append(RejectedRow(row_no, values, "ошибка API при создании"))
+
+            processed += 1
+            if on_progress is not None:
+                await on_progress(processed, created, len(rejected))
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+    try:
+        await asyncio.wait(workers, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        # Ошибка одного воркера (или отмена импорта) останавливает остальные:
+        # после ответа пользователю товары не должны создаваться
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await rows.aclose()
+
+    rejected.sort(key=lambda row: row.row_no)
+    errors = [task.exception() for task in workers if not task.cancelled() and task.exception() is not None]
+    if errors:
+        raise ImportAborted(created, rejected) from errors[0]
+    return created, rejected
+
+def build_rejected_report(rejected: List[RejectedRow]) -> bytes:
+    """CSV-отчет по отклоненным строкам"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["row", "reason", "values"])
+    for row in rejected:
+        writer.writerow([row.row_no, row.reason, " | ".join(row.values)])
+    return buffer.getvalue().encode('utf-8-sig')
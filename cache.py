@@ -0,0 +1,124 @@
+# cache.py
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+_MISSING = object()
+
+def estimate_size(value: Any) -> int:
+    """Приблизительный объем памяти значения с вложенными dict/list/tuple (в байтах)"""
+    size = 0
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set)):
+            stack.extend(item)
+    return size
+
+class TTLCache:
+    """
+    LRU-кэш с ограничением размера и временем жизни записей
+
+    Если задан max_bytes, дополнительно ограничивается суммарный объем
+    значений (по estimate_size): при превышении вытесняются самые давно
+    использованные записи.
+    """
+
+    def __init__(self, max_size: int = 1024, default_ttl: Optional[float] = None,
+                 max_bytes: Optional[int] = None):
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[Hashable, Tuple[Optional[float], Any]]" = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_hits = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Вернуть значение по ключу или default, если его нет или оно устарело"""
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            # Устаревшая запись остается до вытеснения: ее можно отдать через get_stale
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def get_stale(self, key: Hashable, default: Any = None) -> Any:
+        """Вернуть значение по ключу, даже если время его жизни истекло"""
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            return default
+        self.stale_hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Сохранить значение; ttl=None берет время жизни по умолчанию"""
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        if self.max_bytes is not None:
+            self.total_bytes -= self._sizes.get(key, 0)
+            self._sizes[key] = estimate_size(value)
+            self.total_bytes += self._sizes[key]
+
+        while len(self._data) > self.max_size or (
+            self.max_bytes is not None and self.total_bytes > self.max_bytes and len(self._data) > 1
+        ):
+            evicted_key, _ = self._data.popitem(last=False)
+            self.total_bytes -= self._sizes.pop(evicted_key, 0)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> bool:
+        """Удалить запись по ключу"""
+        self.total_bytes -= self._sizes.pop(key, 0)
+        return self._data.pop(key, _MISSING) is not _MISSING
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Удалить все записи, ключи которых удовлетворяют условию"""
+        keys = [key for key in self._data if predicate(key)]
+        for key in keys:
+            del self._data[key]
+            self.total_bytes -= self._sizes.pop(key, 0)
+        return len(keys)
+
+    def clear(self) -> None:
+        """Очистить кэш"""
+        self._data.clear()
+        self._sizes.clear()
+        self.total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий и промахов"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "stale_hits": self.stale_hits,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._data)
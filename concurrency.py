@@ -0,0 +1,122 @@
+# concurrency.py
+import asyncio
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import AsyncIterator, Dict, Hashable, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from tracing import span, start_trace
+
+class KeyedLocks:
+    """Набор asyncio.Lock по ключу; неиспользуемые блокировки удаляются"""
+
+    def __init__(self):
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._holders: Dict[Hashable, int] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        """Захватить блокировку ключа (ожидающие обслуживаются по очереди)"""
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._holders[key] = self._holders.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._holders[key] -= 1
+            if not self._holders[key]:
+                del self._holders[key]
+                del self._locks[key]
+
+    def locked(self, key: Hashable) -> bool:
+        """Занята ли блокировка ключа"""
+        lock = self._locks.get(key)
+        return lock is not None and lock.locked()
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+# Блокировки пользователей: под ними выполняются обработчики обновлений,
+# и их же должны брать фоновые задачи, меняющие context.user_data
+user_locks = KeyedLocks()
+
+def _update_keys(update: object) -> Tuple[Optional[int], Optional[int]]:
+    """ID чата и пользователя обновления"""
+    if not isinstance(update, Update):
+        return None, None
+    chat = update.effective_chat
+    user = update.effective_user
+    return (chat.id if chat else None), (user.id if user else None)
+
+def _update_attributes(update: object) -> Dict[str, object]:
+    """Атрибуты трассировки: ID обновления, чата, пользователя и что пришло (без текста сообщений)"""
+    if not isinstance(update, Update):
+        return {"type": type(update).__name__}
+    chat_id, user_id = _update_keys(update)
+    attributes: Dict[str, object] = {"update_id": update.update_id, "chat_id": chat_id, "user_id": user_id}
+    if update.callback_query is not None:
+        attributes["callback"] = update.callback_query.data
+    elif update.effective_message is not None:
+        text = update.effective_message.text or ""
+        attributes["message"] = text.split()[0] if text.startswith("/") else ("text" if text else "other")
+    return attributes
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка обновлений с сохранением порядка внутри чата
+
+    Обновления одного чата (и одного пользователя) выполняются строго по
+    очереди, поэтому состояние ConversationHandler и context.user_data
+    не меняются одновременно. Разные чаты обрабатываются параллельно,
+    но не более чем `workers` обработчиков сразу. Блокировки берутся
+    в порядке чат -> пользователь, поэтому взаимоблокировок нет.
+
+    Args:
+        workers: Сколько обработчиков выполняется одновременно
+        max_pending: Сколько обновлений может ждать очереди своего чата
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        super().__init__(max_concurrent_updates=max(workers, max_pending))
+        self.workers = workers
+        self._worker_slots = asyncio.BoundedSemaphore(workers)
+        self._chat_locks = KeyedLocks()
+        self.active = 0
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        chat_id, user_id = _update_keys(update)
+        # Трассировка покрывает и ожидание своей очереди, и обработку
+        with start_trace("update", **_update_attributes(update)):
+            async with AsyncExitStack() as stack:
+                with span("wait"):
+                    if chat_id is not None:
+                        await stack.enter_async_context(self._chat_locks.hold(chat_id))
+                    if user_id is not None:
+                        await stack.enter_async_context(user_locks.hold(user_id))
+                    # Слот обработчика занимается только после очереди своего чата,
+                    # чтобы один активный чат не занял всех обработчиков ожиданием
+                    await stack.enter_async_context(self._worker_slots)
+
+                self.active += 1
+                try:
+                    await coroutine
+                finally:
+                    self.active -= 1
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> Dict:
+        """Активные обработчики и чаты с обновлениями в работе или в очереди"""
+        return {
+            "workers": self.workers,
+            "active": self.active,
+            "chats": len(self._chat_locks),
+            "users": len(user_locks),
+        }
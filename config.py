@@ -1,5 +1,6 @@
 # config.py
 import os
+import re
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,6 +10,135 @@ class Config:
     BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
     WAREHOUSE_API_URL = os.getenv('WAREHOUSE_API_URL', 'http://localhost:8000/api')
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    # Логирование: формат text/json, файл с ротацией по размеру или по времени (midnight, H...)
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+    LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+    LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', '')
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+    # Уровни отдельных логгеров: "api_client=DEBUG,httpx=WARNING"
+    LOG_LEVELS = {
+        name.strip(): level.strip()
+        for name, level in (
+            item.split('=', 1)
+            for item in os.getenv('LOG_LEVELS', 'httpx=WARNING,apscheduler=WARNING').split(',') if '=' in item
+        )
+    }
+    # Тела запросов к API пишутся в DEBUG выборочно и с обрезкой
+    LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '0.01'))
+    LOG_PAYLOAD_MAX_CHARS = int(os.getenv('LOG_PAYLOAD_MAX_CHARS', '500'))
+    
+    # Режим получения обновлений: polling или webhook
+    BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+    WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+    
+    # Трассировка обновлений: ID в логах и заголовке запросов к API, дерево медленных обновлений в логе
+    TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'true').lower() == 'true'
+    TRACE_HEADER = os.getenv('TRACE_HEADER', 'X-Request-ID')
+    TRACE_SLOW_THRESHOLD = float(os.getenv('TRACE_SLOW_THRESHOLD', '2.0'))
+    TRACE_SLOW_SAMPLE_RATE = float(os.getenv('TRACE_SLOW_SAMPLE_RATE', '1.0'))
+    TRACE_MAX_SPANS = int(os.getenv('TRACE_MAX_SPANS', '200'))
+    
+    # Метрики в формате Prometheus: GET http://METRICS_HOST:METRICS_PORT/metrics
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() == 'true'
+    METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
+    
+    # Пул соединений к Warehouse API
+    API_TIMEOUT = float(os.getenv('API_TIMEOUT', '30'))
+    API_POOL_SIZE = int(os.getenv('API_POOL_SIZE', '100'))
+    API_POOL_SIZE_PER_HOST = int(os.getenv('API_POOL_SIZE_PER_HOST', '20'))
+    API_KEEPALIVE_TIMEOUT = float(os.getenv('API_KEEPALIVE_TIMEOUT', '30'))
+    API_DNS_CACHE_TTL = int(os.getenv('API_DNS_CACHE_TTL', '300'))
+    
+    # Повторы и предохранитель для Warehouse API
+    API_RETRY_ATTEMPTS = int(os.getenv('API_RETRY_ATTEMPTS', '2'))
+    API_RETRY_BASE_DELAY = float(os.getenv('API_RETRY_BASE_DELAY', '0.2'))
+    API_RETRY_MAX_DELAY = float(os.getenv('API_RETRY_MAX_DELAY', '2'))
+    # Общий предел времени на запрос со всеми повторами, секунды
+    API_REQUEST_DEADLINE = float(os.getenv('API_REQUEST_DEADLINE', '30'))
+    BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))
+    BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', '30'))
+    # Журнал операций с ключами идемпотентности (TTL в секундах)
+    IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL', '86400'))
+    IDEMPOTENCY_JOURNAL_SIZE = int(os.getenv('IDEMPOTENCY_JOURNAL_SIZE', '10000'))
+    # Сервис склада дедуплицирует PATCH по Idempotency-Key: только тогда изменения
+    # количества с ключом можно повторять автоматически после таймаута или 5xx
+    API_IDEMPOTENCY_SUPPORTED = os.getenv('API_IDEMPOTENCY_SUPPORTED', 'false').lower() == 'true'
+    # Таймауты по эндпоинтам: "products=5,products/thermocups/create=15"
+    API_ENDPOINT_TIMEOUTS = {
+        prefix.strip(): float(value)
+        for prefix, value in (
+            item.split('=', 1) for item in os.getenv('API_ENDPOINT_TIMEOUTS', '').split(',') if '=' in item
+        )
+    }
+    
+    # Кэш ответов на GET-запросы (TTL в секундах)
+    CACHE_ENABLED = os.getenv('CACHE_ENABLED', 'true').lower() == 'true'
+    CACHE_MAX_SIZE = int(os.getenv('CACHE_MAX_SIZE', '512'))
+    CACHE_TTL_PRODUCTS = float(os.getenv('CACHE_TTL_PRODUCTS', '15'))
+    CACHE_TTL_PRODUCT = float(os.getenv('CACHE_TTL_PRODUCT', '30'))
+    # Общий бюджет памяти страниц в кэше (байты, на всех пользователей)
+    CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+    
+    # Локальный индекс товаров для подсказок "возможно, вы искали"
+    SEARCH_INDEX_REFRESH_INTERVAL = float(os.getenv('SEARCH_INDEX_REFRESH_INTERVAL', '300'))
+    SEARCH_INDEX_PAGE_SIZE = int(os.getenv('SEARCH_INDEX_PAGE_SIZE', '100'))
+    SEARCH_MIN_SIMILARITY = float(os.getenv('SEARCH_MIN_SIMILARITY', '0.3'))
+    
+    # Постраничный вывод списка товаров
+    PRODUCTS_PAGE_SIZE = int(os.getenv('PRODUCTS_PAGE_SIZE', '10'))
+    # Переходы по меню и страницам редактируют сообщение с кнопками вместо отправки нового
+    NAVIGATION_EDIT_IN_PLACE = os.getenv('NAVIGATION_EDIT_IN_PLACE', 'true').lower() == 'true'
+    
+    # Ограничение исходящих запросов к Telegram (сообщений в секунду)
+    RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    RATE_LIMIT_OVERALL = float(os.getenv('RATE_LIMIT_OVERALL', '30'))
+    RATE_LIMIT_CHAT = float(os.getenv('RATE_LIMIT_CHAT', '1'))
+    RATE_LIMIT_CHAT_BURST = float(os.getenv('RATE_LIMIT_CHAT_BURST', '3'))
+    RATE_LIMIT_GROUP_PER_MINUTE = float(os.getenv('RATE_LIMIT_GROUP_PER_MINUTE', '20'))
+    RATE_LIMIT_MAX_RETRIES = int(os.getenv('RATE_LIMIT_MAX_RETRIES', '2'))
+    
+    # Кэш отрендеренных карточек товаров
+    RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', '2048'))
+    RENDER_CACHE_MAX_BYTES = int(os.getenv('RENDER_CACHE_MAX_BYTES', str(8 * 1024 * 1024)))
+    
+    # Статистика по товарам
+    STATS_USE_SERVER_AGGREGATES = os.getenv('STATS_USE_SERVER_AGGREGATES', 'false').lower() == 'true'
+    STATS_NUMPY_THRESHOLD = int(os.getenv('STATS_NUMPY_THRESHOLD', '5000'))
+    # Без серверных агрегатов: сколько первых товаров результата учитывать
+    STATS_WINDOW_SIZE = int(os.getenv('STATS_WINDOW_SIZE', '100'))
+    
+    # Массовые операции
+    BULK_MAX_LINES = int(os.getenv('BULK_MAX_LINES', '1000'))
+    BULK_CONCURRENCY = int(os.getenv('BULK_CONCURRENCY', '5'))
+    API_STOCK_BATCH_ENDPOINT = os.getenv('API_STOCK_BATCH_ENDPOINT', 'false').lower() == 'true'
+    IMPORT_MAX_ROWS = int(os.getenv('IMPORT_MAX_ROWS', '5000'))
+    
+    # Параллельная обработка обновлений (1 - последовательно)
+    UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', '8'))
+    UPDATE_MAX_PENDING = int(os.getenv('UPDATE_MAX_PENDING', '256'))
+    
+    # Хранение диалогов и user_data между перезапусками (пустой путь - выключено)
+    PERSISTENCE_PATH = os.getenv('PERSISTENCE_PATH', 'bot_state.sqlite3')
+    PERSISTENCE_FLUSH_INTERVAL = float(os.getenv('PERSISTENCE_FLUSH_INTERVAL', '10'))
+    SESSION_TTL = float(os.getenv('SESSION_TTL', '86400'))
+    # Сброс состояния пользователя после простоя (секунды) и период проверки
+    SESSION_IDLE_TIMEOUT = float(os.getenv('SESSION_IDLE_TIMEOUT', '3600'))
+    SESSION_JANITOR_INTERVAL = float(os.getenv('SESSION_JANITOR_INTERVAL', '300'))
+    
+    # Администраторы (Telegram user ID через запятую): /profile и /memprofile
+    ADMIN_IDS = {int(item) for item in os.getenv('ADMIN_IDS', '').replace(' ', '').split(',') if item}
+    PROFILE_DEFAULT_SECONDS = float(os.getenv('PROFILE_DEFAULT_SECONDS', '10'))
+    PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '60'))
+    PROFILE_TOP = int(os.getenv('PROFILE_TOP', '40'))
+    # Глубина стека в снимках tracemalloc (больше - точнее, но медленнее)
+    MEMPROFILE_FRAMES = int(os.getenv('MEMPROFILE_FRAMES', '1'))
     
     @classmethod
     def validate(cls):
@@ -16,5 +146,16 @@ class Config:
             raise ValueError("TELEGRAM_BOT_TOKEN не установлен в .env файле")
         if not cls.WAREHOUSE_API_URL:
             raise ValueError("WAREHOUSE_API_URL не установлен в .env файле")
+        if cls.LOG_FORMAT not in ('text', 'json'):
+            raise ValueError("LOG_FORMAT должен быть text или json")
+        if cls.BOT_MODE not in ('polling', 'webhook'):
+            raise ValueError("BOT_MODE должен быть polling или webhook")
+        if cls.BOT_MODE == 'webhook' and not cls.WEBHOOK_URL:
+            raise ValueError("WEBHOOK_URL не установлен в .env файле (нужен для BOT_MODE=webhook)")
+        if cls.BOT_MODE == 'webhook' and not re.fullmatch(r'[A-Za-z0-9_-]{1,256}', cls.WEBHOOK_SECRET):
+            raise ValueError(
+                "WEBHOOK_SECRET не установлен в .env файле или некорректен "
+                "(нужен для BOT_MODE=webhook: 1-256 символов A-Z, a-z, 0-9, _ и -)"
+            )
 
 Config.validate()
\ No newline at end of file
@@ -1,26 +1,168 @@
 # handlers.py
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardRemove
+from telegram import Update, InlineKeyboardMarkup, InputFile, ReplyKeyboardRemove
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes, ConversationHandler, MessageHandler, filters
 import logging
+import os
+import tempfile
+import time
+import uuid
 from api_client import WarehouseAPIClient
-from typing import List, Dict
+from bulk import (
+    ImportAborted, RejectedRow, apply_stock_changes, build_rejected_report, format_line_errors,
+    format_stock_report, import_thermocups, iter_csv_rows, iter_xlsx_rows, parse_stock_lines, parse_thermocup_row
+)
+from cache import TTLCache, estimate_size
+from concurrency import user_locks
+from config import Config
+from menus import (
+    ADD_PRODUCT_MENU, ENTER_BULK_STOCK, ENTER_CATEGORY, ENTER_IMPORT_FILE, ENTER_PRICE_RANGE,
+    ENTER_PRODUCT_ID, ENTER_RESERVED_QUANTITY, ENTER_SEARCH_QUERY, ENTER_STOCK_QUANTITY,
+    ENTER_THERMOCUP_DATA, ENTER_UPDATE_DATA, ENTER_WAREHOUSE_ID, GET_PRODUCTS_MENU, MAIN_MENU,
+    UPDATE_PRODUCT_MENU, ADD_MENU_KB, ADVANCED_SEARCH_KB, MAIN_MENU_KB, PRODUCT_PAGE_KB,
+    PRODUCTS_MENU_KB, RESULTS_KB, SEARCH_RESULTS_KB, UPDATE_MENU_KB, Menu, is_content_keyboard
+)
+from product_stats import aggregate_products, format_statistics, normalize_aggregates
+import profiling
+from ratelimit import bulk_sends
+from search import ProductIndex, SearchStrategy, run_search_strategies
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
 
 logger = logging.getLogger(__name__)
 api_client = WarehouseAPIClient()
+product_index = ProductIndex(min_score=Config.SEARCH_MIN_SIMILARITY)
+# Готовые карточки товаров: (текст, длина в UTF-16) по версии товара
+card_cache = TTLCache(max_size=Config.RENDER_CACHE_SIZE, max_bytes=Config.RENDER_CACHE_MAX_BYTES)
+# Суммарное время форматирования карточек при промахах кэша
+render_seconds = 0.0
+# Время последнего обновления от каждого пользователя (time.monotonic)
+session_last_seen: Dict[int, float] = {}
 
-# Состояния для ConversationHandler
-(
-    MAIN_MENU, GET_PRODUCTS_MENU, ADD_PRODUCT_MENU, UPDATE_PRODUCT_MENU,
-    ENTER_PRODUCT_ID, ENTER_SEARCH_QUERY, ENTER_CATEGORY, ENTER_PRICE_RANGE,
-    ENTER_THERMOCUP_DATA, ENTER_UPDATE_DATA, ENTER_RESERVED_QUANTITY, 
-    ENTER_STOCK_QUANTITY, ENTER_WAREHOUSE_ID
-) = range(13)
+# Экранирование специальных символов Markdown одной таблицей
+MARKDOWN_ESCAPE = str.maketrans({'_': '\\_', '*': '\\*', '`': '\\`'})
+
+def utf16_len(text: str) -> int:
+    """Длина текста в UTF-16 единицах - так Telegram считает лимит 4096"""
+    return len(text.encode('utf-16-le')) // 2
 
 def truncate_message(text: str, max_length: int = 4096) -> str:
     """Обрезает текст до максимальной длины для Telegram"""
-    if len(text) <= max_length:
+    if utf16_len(text) <= max_length:
         return text
-    return text[:max_length - 100] + "\n\n... (сообщение обрезано)"
+    # errors='ignore' отбрасывает половинку суррогатной пары на границе среза
+    cut = text.encode('utf-16-le')[:(max_length - 100) * 2].decode('utf-16-le', errors='ignore')
+    return cut + "\n\n... (сообщение обрезано)"
+
+def user_data_lock(user_id: int):
+    """
+    Блокировка context.user_data пользователя для кода вне обработчиков
+    
+    Обработчики диалога уже выполняются под этой блокировкой (ее берет
+    PerChatUpdateProcessor), повторный захват внутри обработчика зависнет.
+    Нужна фоновым задачам и задачам JobQueue, которые меняют user_data.
+    """
+    return user_locks.hold(user_id)
+
+async def remove_pressed_keyboard(update: Update) -> None:
+    """
+    Снять кнопки с сообщения, под которым нажата кнопка
+    
+    Сообщение остается в чате, а его кнопки больше не действуют: нажатия
+    под ним управляли бы диалогом из устаревшего места (например, с
+    другой страницы списка).
+    """
+    query = update.callback_query
+    if query is None or query.message is None or query.message.reply_markup is None:
+        return
+    try:
+        await query.edit_message_reply_markup(reply_markup=None)
+    except BadRequest as e:
+        logger.debug(f"Keyboard removal failed: {e}")
+
+async def edit_or_reply(update: Update, text: str, parse_mode: Optional[str] = None,
+                        reply_markup: Optional[InlineKeyboardMarkup] = None,
+                        replace_content: bool = False) -> None:
+    """
+    Показать текст на месте сообщения с нажатой кнопкой
+    
+    На месте заменяются только меню. Сообщение с результатами (клавиатура
+    content=True: список, найденные товары, карточка) остается в чате, с него
+    снимаются кнопки, а текст отправляется новым сообщением; replace_content=True
+    заменяет и его (переход между страницами списка).
+    Новое сообщение отправляется и если обновление пришло не от кнопки,
+    режим редактирования выключен или сообщение нельзя изменить
+    (слишком старое, не текстовое, удалено).
+    """
+    query = update.callback_query
+    if query is not None and query.message is not None and Config.NAVIGATION_EDIT_IN_PLACE:
+        if replace_content or not is_content_keyboard(query.message.reply_markup):
+            try:
+                await query.edit_message_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+                return
+            except BadRequest as e:
+                if "message is not modified" in str(e).lower():
+                    return
+                logger.debug(f"Message edit failed, sending a new one: {e}")
+        await remove_pressed_keyboard(update)
+    
+    message = query.message if query is not None else update.message
+    await message.reply_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+
+async def show_menu(update: Update, menu: Menu, text: Optional[str] = None) -> None:
+    """Показать меню из реестра (текст по умолчанию - текст меню)"""
+    await edit_or_reply(update, text or menu.text, parse_mode=menu.parse_mode, reply_markup=menu.markup)
+
+def begin_operation(context: ContextTypes.DEFAULT_TYPE, name: str) -> str:
+    """Начать логическую операцию изменения данных (шаг диалога)"""
+    operation_id = uuid.uuid4().hex
+    context.user_data[f'{name}_operation_id'] = operation_id
+    context.user_data.pop(f'{name}_unconfirmed', None)
+    return operation_id
+
+def operation_key(update: Update, context: ContextTypes.DEFAULT_TYPE, name: str, *parts) -> str:
+    """
+    Ключ идемпотентности: пользователь + операция + ее параметры
+    
+    Пока операция не завершена, повторная отправка тех же данных
+    (двойное нажатие, повтор после таймаута) дает тот же ключ.
+    """
+    operation_id = context.user_data.get(f'{name}_operation_id') or begin_operation(context, name)
+    return ":".join([name, str(update.effective_user.id), operation_id, *map(str, parts)])
+
+def end_operation(context: ContextTypes.DEFAULT_TYPE, name: str) -> None:
+    """Завершить операцию: следующий ввод получит новый ключ"""
+    context.user_data.pop(f'{name}_operation_id', None)
+    context.user_data.pop(f'{name}_unconfirmed', None)
+
+# Ответ, подтверждающий повторную отправку изменения с неизвестным результатом
+CONFIRM_RESEND = "да"
+
+def take_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE, name: str):
+    """Данные изменения, повторную отправку которого пользователь подтвердил (иначе None)"""
+    if update.message.text.strip().lower() != CONFIRM_RESEND:
+        return None
+    return context.user_data.pop(f'{name}_unconfirmed', None)
+
+def failed_change_text(context: ContextTypes.DEFAULT_TYPE, name: str, key: str, what: str, change) -> str:
+    """
+    Текст после неудачного изменения количества
+    
+    Обещать безопасный повтор можно, только если сервер сам отбрасывает
+    повторы по Idempotency-Key. Иначе изменение, ответ на которое не
+    получен, могло примениться: данные для повтора сохраняются, а снова
+    оно отправляется только после ответа CONFIRM_RESEND.
+    """
+    if Config.API_IDEMPOTENCY_SUPPORTED:
+        return (f"❌ Ошибка при обновлении {what}\n"
+                "Отправьте то же число еще раз, чтобы безопасно повторить, или /cancel")
+    if api_client.outcome_unknown(key):
+        context.user_data[f'{name}_unconfirmed'] = change
+        return (f"⚠️ Сервер не ответил: неизвестно, применено ли обновление {what}.\n"
+                "Проверьте текущее количество товара - то же число без подтверждения отправлено не будет.\n"
+                f"Если изменение не применилось, отправьте «{CONFIRM_RESEND}», чтобы отправить его еще раз, "
+                "или /cancel")
+    return (f"❌ Ошибка при обновлении {what}: изменение не применено\n"
+            "Отправьте число еще раз, чтобы повторить, или /cancel")
 
 # ===== ГЛАВНОЕ МЕНЮ =====
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -28,17 +170,10 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user = update.message.from_user
     logger.info(f"User {user.first_name} started the conversation")
     
-    keyboard = [
-        [InlineKeyboardButton("📦 Получить продукты", callback_data="get_products")],
-        [InlineKeyboardButton("➕ Добавить продукты", callback_data="add_products")],
-        [InlineKeyboardButton("🔄 Обновить продукты", callback_data="update_products")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await update.message.reply_text(
+    await show_menu(
+        update, MAIN_MENU_KB,
         f"🏭 Добро пожаловать в систему управления складом, {user.first_name}!\n"
-        "Выберите действие:",
-        reply_markup=reply_markup
+        "Выберите действие:"
     )
     
     return MAIN_MENU
@@ -49,18 +184,7 @@ async def back_to_main(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     query = update.callback_query
     await query.answer()
     
-    keyboard = [
-        [InlineKeyboardButton("📦 Получить продукты", callback_data="get_products")],
-        [InlineKeyboardButton("➕ Добавить продукты", callback_data="add_products")],
-        [InlineKeyboardButton("🔄 Обновить продукты", callback_data="update_products")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    # ИСПРАВЛЕНИЕ: используем message.reply_text вместо reply_text
-    await query.message.reply_text(
-        "🏭 Главное меню управления складом\nВыберите действие:",
-        reply_markup=reply_markup
-    )
+    await show_menu(update, MAIN_MENU_KB)
     
     return MAIN_MENU
 
@@ -70,117 +194,121 @@ async def get_products_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     await query.answer()
     
-    keyboard = [
-        [InlineKeyboardButton("📋 Все продукты", callback_data="all_products")],
-        [InlineKeyboardButton("🔍 Быстрый поиск", callback_data="search_products")],
-        [InlineKeyboardButton("🎯 Расширенный поиск", callback_data="advanced_search")],
-        [InlineKeyboardButton("🆔 По ID продукта", callback_data="by_id")],
-        [InlineKeyboardButton("☕ Термокружка по ID", callback_data="thermocup_by_id")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    # ИСПРАВЛЕНИЕ: используем message.reply_text вместо reply_text
-    await query.message.reply_text(
-        "📦 **Получить продукты**\nВыберите тип запроса:",
-        parse_mode='Markdown',
-        reply_markup=reply_markup
-    )
+    await show_menu(update, PRODUCTS_MENU_KB)
     
     return GET_PRODUCTS_MENU
 
 async def get_all_products(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Получить все продукты - простая версия с пошаговым выводом"""
+    """Получить все продукты - постраничная загрузка с сервера"""
     query = update.callback_query
     await query.answer()
     
-    products = await api_client.get_products(
-        limit=100,
-        include_inactive=False,
-        include_out_of_stock=True
-    )
+    # Храним только фильтры и позицию, а не отрендеренные страницы
+    context.user_data['product_list'] = {
+        'title': "Все продукты на складе",
+        'filters': {'include_inactive': False, 'include_out_of_stock': True},
+        'offset': 0,
+    }
     
-    if not products:
-        await query.message.reply_text("❌ Нет продуктов на складе")
-        return GET_PRODUCTS_MENU
-
-    # Генерируем статистику
-    statistics = get_products_statistics(products)
-    await query.message.reply_text(statistics, parse_mode='Markdown')
+    return await show_next_product_message(update, context)
 
-    # Формируем сообщения с помощью новой функции
-    messages = format_products_list(products, "Все продукты на складе")
+async def show_next_product_message(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                    navigate: bool = False) -> int:
+    """
+    Показать текущую страницу продуктов, загрузив ее с сервера
     
-    # Сохраняем все сообщения в контексте
-    context.user_data['product_messages'] = messages
-    context.user_data['current_message_index'] = 0
+    navigate=True - переход между страницами: страница, помещающаяся в одно
+    сообщение, показывается на месте предыдущей, статистика не повторяется.
+    """
+    product_list = context.user_data.get('product_list')
+    message = update.callback_query.message if update.callback_query else update.message
     
-    # Показываем первое сообщение
-    return await show_next_product_message(update, context)
-
-async def show_next_product_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Показать следующее сообщение с продуктами"""
-    messages = context.user_data.get('product_messages', [])
-    current_index = context.user_data.get('current_message_index', 0)
+    if not product_list:
+        await message.reply_text("❌ Нет данных для отображения")
+        return GET_PRODUCTS_MENU
     
-    if not messages or current_index >= len(messages):
-        # Определяем откуда пришел запрос
-        if update.callback_query:
-            await update.callback_query.message.reply_text("❌ Нет данных для отображения")
+    page_size = Config.PRODUCTS_PAGE_SIZE
+    offset = product_list['offset']
+    filters = product_list['filters']
+    
+    show_statistics = offset == 0 and not navigate
+    # Без серверных агрегатов первая страница слишком мала для статистики:
+    # одним запросом загружаем окно шире, страница - его начало
+    stats_window = (show_statistics and not Config.STATS_USE_SERVER_AGGREGATES
+                    and Config.STATS_WINDOW_SIZE > page_size)
+    limit = Config.STATS_WINDOW_SIZE if stats_window else page_size
+    
+    page = await api_client.get_products_page(offset=offset, limit=limit, **filters)
+    if page is None or not page[0]:
+        if offset == 0:
+            await message.reply_text("❌ Нет продуктов на складе")
         else:
-            await update.message.reply_text("❌ Нет данных для отображения")
+            await message.reply_text("❌ Нет данных для отображения")
         return GET_PRODUCTS_MENU
     
-    current_message = messages[current_index]
+    stats_products, stats_partial = page
+    products, has_more = stats_products[:page_size], stats_partial or len(stats_products) > page_size
     
-    # Создаем кнопки
-    keyboard = []
+    if show_statistics:
+        # Статистика заменяет меню, из которого открыт список
+        statistics = await build_products_statistics(stats_products, filters, partial=stats_partial)
+        await edit_or_reply(update, statistics, parse_mode='Markdown')
     
-    # Если есть еще сообщения - показываем кнопку "Далее"
-    if current_index < len(messages) - 1:
-        keyboard.append([InlineKeyboardButton("📄 Показать еще", callback_data="show_more_products")])
+    page_number = offset // page_size + 1
+    title = product_list['title'] if page_number == 1 else f"{product_list['title']} (стр. {page_number})"
     
-    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back_to_products_menu")])
+    # Кнопки "Предыдущие" / "Далее" по наличию соседних страниц
+    menu = PRODUCT_PAGE_KB[(offset > 0, has_more)]
+    if has_more:
+        # Заранее загружаем следующую страницу в кэш клиента
+        context.application.create_task(
+            api_client.get_products_page(offset=offset + page_size, limit=page_size, **filters)
+        )
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    if navigate:
+        pages = format_products_list(products, title)
+        if len(pages) == 1:
+            await edit_or_reply(update, pages[0], parse_mode='Markdown', reply_markup=menu.markup,
+                                replace_content=True)
+            return GET_PRODUCTS_MENU
+        # Страница из нескольких сообщений отправляется заново: у старой снимаем кнопки
+        await remove_pressed_keyboard(update)
     
-    # Определяем откуда пришел запрос и отправляем сообщение
-    if update.callback_query:
-        # Если это callback от кнопки
-        await update.callback_query.message.reply_text(
-            current_message, 
-            parse_mode='Markdown',
-            reply_markup=reply_markup
-        )
-        await update.callback_query.answer()
-    else:
-        # Если это текстовое сообщение
-        await update.message.reply_text(
-            current_message,
-            parse_mode='Markdown',
-            reply_markup=reply_markup
-        )
+    await send_products_pages(message, products, title, reply_markup=menu.markup, parse_mode='Markdown')
     
     return GET_PRODUCTS_MENU
 
 
 async def show_more_products(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Показать следующую часть продуктов"""
+    """Показать следующую страницу продуктов"""
     query = update.callback_query
     await query.answer()
     
-    # Увеличиваем индекс и показываем следующее сообщение
-    current_index = context.user_data.get('current_message_index', 0)
-    context.user_data['current_message_index'] = current_index + 1
+    # Сдвигаем позицию и загружаем следующую страницу
+    product_list = context.user_data.get('product_list')
+    if product_list:
+        product_list['offset'] += Config.PRODUCTS_PAGE_SIZE
     
-    return await show_next_product_message(update, context)
+    return await show_next_product_message(update, context, navigate=True)
+
+async def show_prev_products(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Показать предыдущую страницу продуктов"""
+    query = update.callback_query
+    await query.answer()
+    
+    product_list = context.user_data.get('product_list')
+    if product_list:
+        product_list['offset'] = max(0, product_list['offset'] - Config.PRODUCTS_PAGE_SIZE)
+    
+    return await show_next_product_message(update, context, navigate=True)
 
 async def search_products_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Начать поиск по названию через API фильтры"""
     query = update.callback_query
     await query.answer()
     
-    await query.message.reply_text(
+    await edit_or_reply(
+        update,
         "🔍 **Поиск продуктов**\n\n"
         "Введите название продукта или часть названия:\n"
         "• Можно вводить неполное название\n" 
@@ -207,27 +335,20 @@ async def search_products_process(update: Update, context: ContextTypes.DEFAULT_
     search_message = await update.message.reply_text(f"🔍 Ищу \"{search_query}\"...")
     
     try:
-        # Используем встроенный поиск API
-        products = await api_client.get_products(
-            search=search_query,
-            limit=50,
-            include_inactive=False,
-            include_out_of_stock=True
+        # Запускаем все варианты поиска одновременно вместо цепочки запросов
+        strategy_name, result = await run_search_strategies(
+            build_search_strategies(search_query)
         )
+        products = result if strategy_name in ("exact", "lowercase") else None
+        used_query = search_query.lower() if strategy_name == "lowercase" else search_query
         
         if not products:
-            # Пробуем поискать без учета регистра и с частичным совпадением
-            products = await api_client.get_products(
-                search=search_query.lower(),
-                limit=50,
-                include_inactive=False,
-                include_out_of_stock=True
-            )
-        
-        if not products:
-            # Предлагаем альтернативы - ищем похожие товары
-            all_products = await api_client.get_products(limit=100)
-            similar_products = await find_similar_products(all_products, search_query)
+            if strategy_name == "similar":
+                similar_products = result
+            elif not product_index.ready:
+                similar_products = await find_similar_without_index(search_query)
+            else:
+                similar_products = []
             
             if similar_products:
                 message = (
@@ -252,8 +373,13 @@ async def search_products_process(update: Update, context: ContextTypes.DEFAULT_
             await search_message.reply_text(message)
             return await get_products_menu_from_message(update, context)
         
+        partial = len(products) > QUICK_SEARCH_LIMIT
+        products = products[:QUICK_SEARCH_LIMIT]
+        
         # Генерируем статистику
-        statistics = get_products_statistics(products)
+        statistics = await build_products_statistics(
+            products, dict(QUICK_SEARCH_FILTERS, search=used_query), partial=partial
+        )
         
         # Формируем сообщение с результатами с помощью новой функции
         if len(products) == 1:
@@ -261,23 +387,12 @@ async def search_products_process(update: Update, context: ContextTypes.DEFAULT_
         else:
             title = f"Найдено {len(products)} продуктов по запросу \"{search_query}\""
         
-        messages = format_products_list(products, title)
-        
         # Сначала отправляем статистику
         await search_message.reply_text(statistics, parse_mode='Markdown')
         
-        # Затем отправляем все сообщения с продуктами
-        for i, message in enumerate(messages):
-            if i == len(messages) - 1:
-                # Последнее сообщение с кнопками
-                keyboard = [
-                    [InlineKeyboardButton("🔍 Новый поиск", callback_data="search_products")],
-                    [InlineKeyboardButton("🔙 В меню", callback_data="back_to_products_menu")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await search_message.reply_text(message, parse_mode='Markdown', reply_markup=reply_markup)
-            else:
-                await search_message.reply_text(message, parse_mode='Markdown')
+        # Затем отправляем страницы с продуктами по мере форматирования,
+        # последнее сообщение - с кнопками
+        await send_products_pages(search_message, products, title, reply_markup=SEARCH_RESULTS_KB.markup, parse_mode='Markdown')
         
     except Exception as e:
         logger.error(f"Search error: {e}")
@@ -287,6 +402,49 @@ async def search_products_process(update: Update, context: ContextTypes.DEFAULT_
     
     return GET_PRODUCTS_MENU
 
+# Фильтры быстрого поиска (кроме самой строки поиска)
+QUICK_SEARCH_FILTERS = {'include_inactive': False, 'include_out_of_stock': True}
+# Сколько найденных товаров показывать; запрашивается на один больше,
+# чтобы знать, есть ли еще (см. get_products_page)
+QUICK_SEARCH_LIMIT = 50
+
+def build_search_strategies(search_query: str) -> List[SearchStrategy]:
+    """Варианты быстрого поиска в порядке приоритета"""
+    search_filters = dict(QUICK_SEARCH_FILTERS, limit=QUICK_SEARCH_LIMIT + 1)
+    
+    # Используем встроенный поиск API
+    strategies = [
+        SearchStrategy("exact", 0, lambda: api_client.get_products(search=search_query, **search_filters)),
+    ]
+    
+    # Поиск в нижнем регистре имеет смысл, только если запрос от него отличается.
+    # Он идет одновременно с точным, но точный результат (если не пуст) важнее,
+    # иначе выдача по одному и тому же запросу зависела бы от того, кто ответил первым
+    lowered_query = search_query.lower()
+    if lowered_query != search_query:
+        strategies.append(
+            SearchStrategy("lowercase", 1, lambda: api_client.get_products(search=lowered_query, **search_filters))
+        )
+    
+    # Альтернативы - похожие товары; используются, только если поиск ничего не дал.
+    # Одновременно с поиском - только по готовому индексу: он не обращается к API
+    if product_index.ready:
+        async def similar() -> List[Dict]:
+            return product_index.search(search_query, limit=5)
+        
+        strategies.append(SearchStrategy("similar", 2, similar))
+    return strategies
+
+async def find_similar_without_index(search_query: str) -> List[Dict]:
+    """
+    Похожие товары, пока индекс не построен: старый способ по первым 100 товарам
+    
+    Запрос к API делается только после пустого поиска, а не для каждого
+    запроса заранее - иначе при холодном старте нагрузка на API растет.
+    """
+    all_products = await api_client.get_products(limit=100)
+    return await find_similar_products(all_products, search_query)
+
 async def find_similar_products(products, search_query):
     """Находит похожие продукты на основе простого сравнения строк"""
     if not products or not search_query:
@@ -306,26 +464,69 @@ async def find_similar_products(products, search_query):
     
     return similar[:5]  # Возвращаем до 5 похожих продуктов
 
+async def refresh_product_index(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Фоновое обновление локального индекса товаров (задача JobQueue)"""
+    async def fetch_page(limit: int, offset: int):
+        return await api_client.get_products(limit=limit, offset=offset)
+    
+    try:
+        await product_index.refresh(fetch_page, page_size=Config.SEARCH_INDEX_PAGE_SIZE)
+    except Exception as e:
+        logger.error(f"Product index refresh error: {e}")
+
+async def track_session_activity(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Запомнить время активности пользователя (вызывается для каждого обновления)"""
+    if update.effective_user:
+        session_last_seen[update.effective_user.id] = time.monotonic()
+
+def get_session_stats(user_data: Dict[int, Dict], top: int = 5) -> Dict:
+    """Объем состояния пользователей: всего и самые большие user_data"""
+    sizes = {user_id: estimate_size(data) for user_id, data in user_data.items()}
+    largest = sorted(sizes.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "users": len(sizes),
+        "user_data_bytes": sum(sizes.values()),
+        "largest": [{"user_id": user_id, "bytes": size} for user_id, size in largest],
+        "page_cache_bytes": api_client.cache.total_bytes,
+        "card_cache_bytes": card_cache.total_bytes,
+    }
+
+async def evict_idle_sessions(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Удалить user_data пользователей, неактивных дольше SESSION_IDLE_TIMEOUT (задача JobQueue)"""
+    application = context.application
+    now = time.monotonic()
+    idle_before = now - Config.SESSION_IDLE_TIMEOUT
+    evicted = 0
+    
+    for user_id in list(application.user_data):
+        # Состояние, загруженное из хранилища, считаем активным с момента запуска
+        if session_last_seen.setdefault(user_id, now) >= idle_before:
+            continue
+        async with user_data_lock(user_id):
+            # Пока ждали блокировку, пользователь мог вернуться
+            if session_last_seen.get(user_id, now) >= idle_before:
+                continue
+            application.drop_user_data(user_id)
+            session_last_seen.pop(user_id, None)
+            evicted += 1
+    
+    for user_id in [user_id for user_id in session_last_seen if user_id not in application.user_data]:
+        if session_last_seen[user_id] < idle_before:
+            del session_last_seen[user_id]
+    
+    stats = get_session_stats(application.user_data)
+    logger.info(
+        f"Sessions: {stats['users']} users, user_data {stats['user_data_bytes']} B, "
+        f"page cache {stats['page_cache_bytes']} B, card cache {stats['card_cache_bytes']} B, "
+        f"evicted {evicted}"
+    )
+
 async def advanced_search_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Меню расширенного поиска с фильтрами"""
     query = update.callback_query
     await query.answer()
     
-    keyboard = [
-        [InlineKeyboardButton("🔍 Поиск по названию", callback_data="search_name")],
-        [InlineKeyboardButton("📂 Поиск по категории", callback_data="search_category")],
-        [InlineKeyboardButton("💰 Поиск по цене", callback_data="search_price_range")],
-        [InlineKeyboardButton("📦 Только в наличии", callback_data="search_in_stock")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_products_menu")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.message.reply_text(
-        "🎯 **Расширенный поиск**\n\n"
-        "Выберите тип поиска:",
-        parse_mode='Markdown',
-        reply_markup=reply_markup
-    )
+    await show_menu(update, ADVANCED_SEARCH_KB)
     
     return GET_PRODUCTS_MENU
 
@@ -334,7 +535,8 @@ async def search_by_category_start(update: Update, context: ContextTypes.DEFAULT
     query = update.callback_query
     await query.answer()
     
-    await query.message.reply_text(
+    await edit_or_reply(
+        update,
         f"📂 **Поиск по категории**\n\n"
         f"Введите название категории:\n\n"
         f"Пример: Thermocups",
@@ -355,35 +557,25 @@ async def search_by_category_process(update: Update, context: ContextTypes.DEFAU
     
     try:
         # API запрос с параметром category
-        products = await api_client.get_products(
+        filters = dict(
             category=category_query,
-            limit=50,
             include_inactive=False,
             include_out_of_stock=True
         )
+        products, partial = await api_client.get_products_page(limit=50, **filters) or ([], False)
         
         if not products:
             await search_message.reply_text(f"❌ В категории \"{category_query}\" товаров не найдено")
             return await get_products_menu_from_message(update, context)
         
         # Генерируем статистику
-        statistics = get_products_statistics(products)
-        
-        # Используем новую функцию для форматирования
-        messages = format_products_list(products, f"Продукты в категории \"{category_query}\"")
+        statistics = await build_products_statistics(products, filters, partial=partial)
         
         # Сначала отправляем статистику
         await search_message.reply_text(statistics)
         
-        # Затем отправляем все сообщения с продуктами
-        for i, message in enumerate(messages):
-            if i == len(messages) - 1:
-                # Последнее сообщение с кнопками
-                keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="back_to_products_menu")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await search_message.reply_text(message, reply_markup=reply_markup)
-            else:
-                await search_message.reply_text(message)
+        # Затем отправляем страницы с продуктами, последнее сообщение - с кнопками
+        await send_products_pages(search_message, products, f"Продукты в категории \"{category_query}\"", reply_markup=RESULTS_KB.markup)
         
     except Exception as e:
         logger.error(f"Category search error: {e}")
@@ -408,13 +600,13 @@ async def search_by_price_process(update: Update, context: ContextTypes.DEFAULT_
             return ENTER_SEARCH_QUERY
         
         # API запрос с параметрами min_price и max_price
-        products = await api_client.get_products(
+        filters = dict(
             min_price=min_price,
             max_price=max_price,
-            limit=50,
             include_inactive=False,
             include_out_of_stock=True
         )
+        products, partial = await api_client.get_products_page(limit=50, **filters) or ([], False)
         
         if not products:
             range_text = ""
@@ -437,23 +629,13 @@ async def search_by_price_process(update: Update, context: ContextTypes.DEFAULT_
             range_text = f"до ${max_price}"
         
         # Генерируем статистику
-        statistics = get_products_statistics(products)
-        
-        # Используем новую функцию для форматирования
-        messages = format_products_list(products, f"Продукты в диапазоне {range_text}")
+        statistics = await build_products_statistics(products, filters, partial=partial)
         
         # Сначала отправляем статистику
         await search_message.reply_text(statistics)
         
-        # Затем отправляем все сообщения с продуктами
-        for i, message in enumerate(messages):
-            if i == len(messages) - 1:
-                # Последнее сообщение с кнопками
-                keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="back_to_products_menu")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await search_message.reply_text(message, reply_markup=reply_markup)
-            else:
-                await search_message.reply_text(message)
+        # Затем отправляем страницы с продуктами, последнее сообщение - с кнопками
+        await send_products_pages(search_message, products, f"Продукты в диапазоне {range_text}", reply_markup=RESULTS_KB.markup)
         
     except ValueError:
         await search_message.reply_text("❌ Неверный формат цен. Используйте числа")
@@ -473,34 +655,24 @@ async def search_in_stock_only(update: Update, context: ContextTypes.DEFAULT_TYP
     
     try:
         # API запрос с параметром include_out_of_stock=False
-        products = await api_client.get_products(
+        filters = dict(
             include_out_of_stock=False,  # Только товары в наличии
-            limit=50,
             include_inactive=False
         )
+        products, partial = await api_client.get_products_page(limit=50, **filters) or ([], False)
         
         if not products:
             await search_message.reply_text("❌ Нет товаров в наличии")
             return GET_PRODUCTS_MENU
         
         # Генерируем статистику
-        statistics = get_products_statistics(products)
-        
-        # Используем новую функцию для форматирования
-        messages = format_products_list(products, "Товары в наличии")
+        statistics = await build_products_statistics(products, filters, partial=partial)
         
         # Сначала отправляем статистику
         await search_message.reply_text(statistics)
         
-        # Затем отправляем все сообщения с продуктами
-        for i, message in enumerate(messages):
-            if i == len(messages) - 1:
-                # Последнее сообщение с кнопками
-                keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="back_to_products_menu")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await search_message.reply_text(message, reply_markup=reply_markup)
-            else:
-                await search_message.reply_text(message)
+        # Затем отправляем страницы с продуктами, последнее сообщение - с кнопками
+        await send_products_pages(search_message, products, "Товары в наличии", reply_markup=RESULTS_KB.markup)
         
     except Exception as e:
         logger.error(f"In-stock search error: {e}")
@@ -513,7 +685,8 @@ async def search_by_price_start(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await query.answer()
     
-    await query.message.reply_text(
+    await edit_or_reply(
+        update,
         "💰 **Поиск по цене**\n\n"
         "Введите диапазон цен в формате:\n"
         "`мин_цена - макс_цена`\n\n"
@@ -535,7 +708,8 @@ async def get_thermocup_by_id_start(update: Update, context: ContextTypes.DEFAUL
     # ДОБАВЬ ЭТУ СТРОЧКУ ↓
     context.user_data['request_type'] = 'thermocup'
     
-    await query.message.reply_text(
+    await edit_or_reply(
+        update,
         "☕ **Получить термокружку по ID**\n\n"
         "Введите ID термокружки:"
     )
@@ -550,13 +724,44 @@ async def get_product_by_id_start(update: Update, context: ContextTypes.DEFAULT_
     # ДОБАВЬ ЭТУ СТРОЧКУ ↓
     context.user_data['request_type'] = 'product'
     
-    await query.message.reply_text(
+    await edit_or_reply(
+        update,
         "🆔 **Получить продукт по ID**\n\n"
         "Введите ID продукта:"
     )
     
     return ENTER_PRODUCT_ID
 
+def render_product_card(product: Dict) -> Tuple[str, int]:
+    """
+    Карточка товара и ее длина в UTF-16 с кэшированием по версии товара
+    
+    Ключ - ID и updated_at; количество и резерв тоже входят в ключ на случай,
+    если API меняет их без обновления updated_at.
+    """
+    product_id = product.get('id')
+    updated_at = product.get('updated_at')
+    if product_id is None or updated_at is None:
+        product_text = format_single_product(product)
+        return product_text, utf16_len(product_text)
+    
+    key = (product_id, updated_at, product.get('total_quantity'), product.get('num_reserved_goods'))
+    card = card_cache.get(key)
+    if card is None:
+        global render_seconds
+        started = time.perf_counter()
+        product_text = format_single_product(product)
+        card = (product_text, utf16_len(product_text))
+        render_seconds += time.perf_counter() - started
+        card_cache.set(key, card)
+    return card
+
+def get_render_cache_stats() -> Dict:
+    """Статистика кэша карточек товаров и время, потраченное на форматирование"""
+    stats = card_cache.stats()
+    stats["render_seconds"] = render_seconds
+    return stats
+
 def format_single_product(product: Dict) -> str:
     """
     Форматирует один продукт в текст для Telegram со всеми параметрами
@@ -591,9 +796,9 @@ def format_single_product(product: Dict) -> str:
     updated_date = product_updated_at[:10] if product_updated_at and len(product_updated_at) >= 10 else "Не указана"
     
     # Экранируем специальные символы для Markdown
-    product_name_escaped = product_name.replace('_', '\\_').replace('*', '\\*').replace('`', '\\`')
-    product_sku_escaped = product_sku.replace('_', '\\_').replace('*', '\\*').replace('`', '\\`') if product_sku else "Не указан"
-    product_category_escaped = product_category.replace('_', '\\_').replace('*', '\\*').replace('`', '\\`')
+    product_name_escaped = product_name.translate(MARKDOWN_ESCAPE)
+    product_sku_escaped = product_sku.translate(MARKDOWN_ESCAPE) if product_sku else "Не указан"
+    product_category_escaped = product_category.translate(MARKDOWN_ESCAPE)
     
     # Формируем текст продукта со всеми параметрами (БЕЗ Markdown разметки)
     product_text = (
@@ -613,6 +818,79 @@ def format_single_product(product: Dict) -> str:
     
     return product_text
 
+class ProductPageBuilder:
+    """Собирает карточки товаров в страницы не длиннее max_length (в UTF-16)"""
+    
+    def __init__(self, title: str, max_length: int = 3500):
+        self.max_length = max_length
+        self._header = f"📦 **{title}**\n\n"
+        self._parts = [self._header]
+        self._length = utf16_len(self._header)
+        self._has_products = False
+        self.pages_built = 0
+    
+    def add(self, product: Dict) -> Optional[str]:
+        """Добавить товар; возвращает готовую страницу, если текущая заполнилась"""
+        product_text, product_length = render_product_card(product)
+        
+        page = None
+        # Проверяем не превысим ли лимит Telegram
+        if self._has_products and self._length + product_length > self.max_length:
+            page = self._flush("📦 **Продолжение:**\n\n")
+        
+        self._parts.append(product_text)
+        self._length += product_length
+        self._has_products = True
+        return page
+    
+    def finish(self) -> Optional[str]:
+        """Вернуть последнюю страницу (или None, если товаров не было)"""
+        if not self._has_products:
+            return None
+        return self._flush()
+    
+    def _flush(self, next_header: str = "") -> str:
+        page = ''.join(self._parts)
+        self._parts = [next_header] if next_header else []
+        self._length = utf16_len(next_header)
+        self._has_products = False
+        self.pages_built += 1
+        return page
+
+def iter_products_pages(products: Iterable[Dict], title: str = "Продукты", max_length: int = 3500) -> Iterable[str]:
+    """Лениво выдает страницы по мере форматирования товаров"""
+    builder = ProductPageBuilder(title, max_length)
+    for product in products:
+        page = builder.add(product)
+        if page is not None:
+            yield page
+    
+    last_page = builder.finish()
+    if last_page is not None:
+        yield last_page
+    elif not builder.pages_built:
+        yield "📦 Список продуктов пуст"
+
+async def aiter_products_pages(products: Union[Iterable[Dict], AsyncIterable[Dict]],
+                               title: str = "Продукты", max_length: int = 3500) -> AsyncIterator[str]:
+    """Асинхронная версия iter_products_pages для потока товаров"""
+    if not hasattr(products, '__aiter__'):
+        for page in iter_products_pages(products, title, max_length):
+            yield page
+        return
+    
+    builder = ProductPageBuilder(title, max_length)
+    async for product in products:
+        page = builder.add(product)
+        if page is not None:
+            yield page
+    
+    last_page = builder.finish()
+    if last_page is not None:
+        yield last_page
+    elif not builder.pages_built:
+        yield "📦 Список продуктов пуст"
+
 def format_products_list(products: List[Dict], title: str = "Продукты", max_length: int = 3500) -> List[str]:
     """
     Форматирует список продуктов в сообщения для Telegram
@@ -620,40 +898,50 @@ def format_products_list(products: List[Dict], title: str = "Продукты",
     Args:
         products: Список словарей с продуктами
         title: Заголовок для сообщения
-        max_length: Максимальная длина сообщения
+        max_length: Максимальная длина сообщения (в UTF-16 единицах)
         
     Returns:
         List[str]: Список сообщений (если не помещается в одно)
     """
-    if not products:
-        return ["📦 Список продуктов пуст"]
-    
-    messages = []
-    current_message = f"📦 **{title}**\n\n"
-    
-    for product in products:
-        # Форматируем один продукт
-        product_text = format_single_product(product)
-        
-        # Проверяем не превысим ли лимит Telegram
-        if len(current_message) + len(product_text) > max_length:
-            messages.append(current_message)
-            current_message = "📦 **Продолжение:**\n\n" + product_text
-        else:
-            current_message += product_text
-    
-    # Добавляем последнее сообщение
-    if current_message and current_message != f"📦 **{title}**\n\n":
-        messages.append(current_message)
+    return list(iter_products_pages(products, title, max_length))
+
+async def send_products_pages(message, products: Union[Iterable[Dict], AsyncIterable[Dict]], title: str,
+                              reply_markup: Optional[InlineKeyboardMarkup] = None,
+                              parse_mode: Optional[str] = None) -> None:
+    """
+    Отправляет страницы по мере готовности; кнопки прикрепляются к последней
     
-    return messages
+    Одна страница придерживается до появления следующей, чтобы знать,
+    какая из них последняя. Первая страница - ответ пользователю, остальные
+    уходят с низким приоритетом и не задерживают ответы другим.
+    """
+    previous = None
+    sent = 0
+    async for page in aiter_products_pages(products, title):
+        if previous is not None:
+            await reply_page(message, previous, sent, parse_mode=parse_mode)
+            sent += 1
+        previous = page
+    
+    if previous is not None:
+        await reply_page(message, previous, sent, parse_mode=parse_mode, reply_markup=reply_markup)
+
+async def reply_page(message, text: str, index: int, **kwargs) -> None:
+    """Отправить страницу результатов; все, кроме первой, - как массовую рассылку"""
+    if index == 0:
+        await message.reply_text(text, **kwargs)
+        return
+    with bulk_sends():
+        await message.reply_text(text, **kwargs)
 
-def get_products_statistics(products: List[Dict]) -> str:
+def get_products_statistics(products: List[Dict], note: str = "", partial: bool = False) -> str:
     """
-    Генерирует статистику по списку продуктов
+    Генерирует статистику по списку продуктов за один проход
     
     Args:
         products: Список продуктов
+        note: Пояснение, добавляемое последней строкой
+        partial: Список - только часть результата (общее число неизвестно)
         
     Returns:
         str: Текст со статистикой
@@ -661,37 +949,38 @@ def get_products_statistics(products: List[Dict]) -> str:
     if not products:
         return "📊 Статистика: нет данных"
     
-    total_products = len(products)
-    active_products = sum(1 for p in products if p.get('is_active', True))
-    out_of_stock = sum(1 for p in products if p.get('total_quantity', 0) <= 0)
-    total_quantity = sum(p.get('total_quantity', 0) for p in products)
-    total_reserved = sum(p.get('num_reserved_goods', 0) for p in products)
-    
-    # Находим самый дорогой и дешевый товар
-    if products:
-        prices = [float(p.get('base_price', 0)) for p in products if p.get('base_price') is not None]
-        max_price = max(prices) if prices else 0
-        min_price = min(prices) if prices else 0
-        avg_price = sum(prices) / len(prices) if prices else 0
-    else:
-        max_price = min_price = avg_price = 0
-    
-    statistics = (
-        f"📊 Статистика поиска:\n"
-        f"• Всего найдено: {total_products} товаров\n"
-        f"• Активных: {active_products}\n"
-        f"• Неактивных: {total_products - active_products}\n"
-        f"• Нет в наличии: {out_of_stock}\n"
-        f"• Общее количество: {total_quantity} шт.\n"
-        f"• Зарезервировано: {total_reserved} шт.\n"
-        f"• Цены: от ${min_price:.2f} до ${max_price:.2f}\n"
-        f"• Средняя цена: ${avg_price:.2f}"
-    )
+    stats = aggregate_products(products, numpy_threshold=Config.STATS_NUMPY_THRESHOLD)
+    return format_statistics(stats, note, partial)
+
+async def build_products_statistics(products: List[Dict], filters: Dict, partial: bool = False) -> str:
+    """
+    Статистика по всему результату фильтра
     
-    return statistics
+    Если включены серверные агрегаты, они покрывают весь результат,
+    а не только загруженную страницу; иначе (или при ошибке API)
+    считаем по загруженным товарам; partial=True - загружена только часть
+    результата, итоги помечаются как неполные.
+    """
+    if Config.STATS_USE_SERVER_AGGREGATES:
+        aggregate_filters = {k: v for k, v in filters.items() if k not in ('limit', 'offset')}
+        stats = normalize_aggregates(await api_client.get_products_aggregates(**aggregate_filters))
+        if stats is not None:
+            return format_statistics(stats)
+    
+    note = f"(по первым {len(products)} товарам)" if partial else ""
+    return get_products_statistics(products, note, partial)
 
 async def handle_product_id_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработать ввод ID (универсальный обработчик)"""
+    # Ввод ID для сценариев обновления передаем их обработчикам
+    update_handler = {
+        'update_thermocup': update_thermocup_process,
+        'update_reserved': update_reserved_process,
+        'update_stock': update_stock_process,
+    }.get(context.user_data.get('request_type'))
+    if update_handler is not None:
+        return await update_handler(update, context)
+    
     try:
         product_id = int(update.message.text)
         request_type = context.user_data.get('request_type', 'product')
@@ -714,10 +1003,7 @@ async def handle_product_id_input(update: Update, context: ContextTypes.DEFAULT_
             message += f"{key}: {value}\n"
         
         message = truncate_message(message)
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="back_to_products_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(message, reply_markup=reply_markup)
+        await update.message.reply_text(message, reply_markup=RESULTS_KB.markup)
         
     except ValueError:
         await update.message.reply_text("❌ Пожалуйста, введите числовой ID")
@@ -734,18 +1020,7 @@ async def add_products_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     await query.answer()
     
-    keyboard = [
-        [InlineKeyboardButton("☕ Добавить термокружку", callback_data="add_thermocup")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    # ИСПРАВЛЕНИЕ: используем message.reply_text вместо reply_text
-    await query.message.reply_text(
-        "➕ **Добавить продукты**\nВыберите тип продукта:",
-        parse_mode='Markdown',
-        reply_markup=reply_markup
-    )
+    await show_menu(update, ADD_MENU_KB)
     
     return ADD_PRODUCT_MENU
 
@@ -755,7 +1030,8 @@ async def add_thermocup_start(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
     await query.answer()
     
-    await query.message.reply_text(
+    await edit_or_reply(
+        update,
         "☕ **Добавить новую термокружку**\n\n"
         "Введите данные в формате:\n"
         "`Название | Категория ID | Цена | Количество | Склад ID | Объем(мл) | Цвет | Бренд`\n\n"
@@ -780,22 +1056,7 @@ async def add_thermocup_process(update: Update, context: ContextTypes.DEFAULT_TY
         return ENTER_THERMOCUP_DATA
     
     try:
-        thermocup_data = {
-            "name": parts[0],
-            "category_id": int(parts[1]),
-            "base_price": float(parts[2]),
-            "initial_quantity": int(parts[3]),
-            "warehouse_id": int(parts[4]) if len(parts) > 4 else 1,
-            "path_to_photo": parts[5] if len(parts) > 5 else "",
-            "attributes": {
-                "volume_ml": int(parts[6]) if len(parts) > 6 else 500,
-                "color": parts[7] if len(parts) > 7 else "Черный",
-                "brand": parts[8] if len(parts) > 8 else "Unknown",
-                "model": parts[0],
-                "is_hermetic": True,
-                "material": "Нержавеющая сталь"
-            }
-        }
+        thermocup_data = parse_thermocup_row(parts)
     except (ValueError, IndexError) as e:
         await update.message.reply_text(f"❌ Ошибка в данных: {e}")
         return ENTER_THERMOCUP_DATA
@@ -813,26 +1074,116 @@ async def add_thermocup_process(update: Update, context: ContextTypes.DEFAULT_TY
     
     return await add_products_menu_from_message(update, context)
 
+async def import_thermocups_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Начать импорт термокружек из файла"""
+    query = update.callback_query
+    await query.answer()
+    
+    await edit_or_reply(
+        update,
+        "📥 **Импорт термокружек из файла**\n\n"
+        "Загрузите CSV или XLSX файл, по одной термокружке в строке:\n"
+        "`Название | Категория ID | Цена | Количество | Склад ID | Фото | Объем(мл) | Цвет | Бренд`\n\n"
+        "Обязательные колонки: Название, Категория ID, Цена, Количество.\n"
+        "Строка заголовка допускается.",
+        parse_mode='Markdown'
+    )
+    
+    return ENTER_IMPORT_FILE
+
+def import_error_text(error: Optional[BaseException]) -> str:
+    """Сообщение об ошибке импорта для пользователя"""
+    if isinstance(error, ImportError):
+        return "❌ Для XLSX файлов на сервере нужен пакет openpyxl"
+    if isinstance(error, (UnicodeDecodeError, ValueError)):
+        return "❌ Не удалось прочитать файл (ожидается CSV в UTF-8 или XLSX)"
+    return "❌ Ошибка при импорте файла"
+
+async def send_rejected_report(update: Update, rejected: List[RejectedRow]) -> None:
+    """Отправить CSV-отчет по отклоненным строкам импорта, если они есть"""
+    if rejected:
+        await update.message.reply_document(
+            document=InputFile(build_rejected_report(rejected), filename="import_errors.csv"),
+            caption=f"❌ Отклоненные строки: {len(rejected)}"
+        )
+
+async def import_thermocups_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Импортировать термокружки из загруженного CSV/XLSX файла"""
+    document = update.message.document
+    file_name = (document.file_name or "").lower()
+    
+    if file_name.endswith('.xlsx'):
+        row_reader = iter_xlsx_rows
+    elif file_name.endswith(('.csv', '.txt')):
+        row_reader = iter_csv_rows
+    else:
+        await update.message.reply_text("❌ Поддерживаются только файлы CSV и XLSX")
+        return ENTER_IMPORT_FILE
+    
+    progress_message = await update.message.reply_text("⏳ Загружаю файл...")
+    
+    # Файл сохраняется на диск и читается построчно, а не целиком в память
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(file_name)[1])
+    os.close(fd)
+    try:
+        file = await document.get_file()
+        await file.download_to_drive(path)
+        
+        last_edit = 0.0
+        
+        async def on_progress(processed: int, created: int, rejected: int) -> None:
+            nonlocal last_edit
+            # Редактируем сообщение не чаще раза в 2 секунды
+            now = time.monotonic()
+            if now - last_edit < 2:
+                return
+            last_edit = now
+            try:
+                with bulk_sends():
+                    await progress_message.edit_text(
+                        f"⏳ Импорт: обработано {processed}, создано {created}, отклонено {rejected}"
+                    )
+            except BadRequest:
+                pass
+        
+        created, rejected = await import_thermocups(
+            api_client, row_reader(path),
+            concurrency=Config.BULK_CONCURRENCY,
+            max_rows=Config.IMPORT_MAX_ROWS,
+            on_progress=on_progress
+        )
+    except ImportAborted as e:
+        # Часть строк могла быть создана до ошибки: сообщаем итог и отклоненные строки
+        logger.error(f"Import aborted: {e.__cause__!r}")
+        await progress_message.edit_text(
+            f"{import_error_text(e.__cause__)}\n"
+            f"До ошибки создано: {e.created}, отклонено: {len(e.rejected)}"
+        )
+        await send_rejected_report(update, e.rejected)
+        return ENTER_IMPORT_FILE
+    except Exception as e:
+        logger.error(f"Import error: {e}")
+        await progress_message.edit_text(import_error_text(e))
+        return ENTER_IMPORT_FILE
+    finally:
+        os.remove(path)
+    
+    await progress_message.edit_text(
+        f"✅ Импорт завершен\n"
+        f"Создано: {created}\n"
+        f"Отклонено: {len(rejected)}"
+    )
+    await send_rejected_report(update, rejected)
+    
+    return await add_products_menu_from_message(update, context)
+
 # ===== ОБНОВИТЬ ПРОДУКТЫ =====
 async def update_products_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Меню обновления продуктов"""
     query = update.callback_query
     await query.answer()
     
-    keyboard = [
-        [InlineKeyboardButton("✏️ Обновить термокружку", callback_data="update_thermocup")],
-        [InlineKeyboardButton("📦 Обновить резерв", callback_data="update_reserved")],
-        [InlineKeyboardButton("🏭 Обновить склад", callback_data="update_stock")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    # ИСПРАВЛЕНИЕ: используем message.reply_text вместо reply_text
-    await query.message.reply_text(
-        "🔄 **Обновить продукты**\nВыберите действие:",
-        parse_mode='Markdown',
-        reply_markup=reply_markup
-    )
+    await show_menu(update, UPDATE_MENU_KB)
     
     return UPDATE_PRODUCT_MENU
 
@@ -842,21 +1193,7 @@ async def back_to_products_menu(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await query.answer()
     
-    keyboard = [
-        [InlineKeyboardButton("📋 Все продукты", callback_data="all_products")],
-        [InlineKeyboardButton("🔍 Быстрый поиск", callback_data="search_products")],
-        [InlineKeyboardButton("🎯 Расширенный поиск", callback_data="advanced_search")],
-        [InlineKeyboardButton("🆔 По ID продукта", callback_data="by_id")],
-        [InlineKeyboardButton("☕ Термокружка по ID", callback_data="thermocup_by_id")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.message.reply_text(
-        "📦 **Получить продукты**\nВыберите тип запроса:",
-        parse_mode='Markdown',
-        reply_markup=reply_markup
-    )
+    await show_menu(update, PRODUCTS_MENU_KB)
     
     return GET_PRODUCTS_MENU
 
@@ -865,7 +1202,10 @@ async def update_thermocup_start(update: Update, context: ContextTypes.DEFAULT_T
     query = update.callback_query
     await query.answer()
     
-    await query.message.reply_text(
+    context.user_data['request_type'] = 'update_thermocup'
+    
+    await edit_or_reply(
+        update,
         "✏️ **Обновить термокружку**\n\n"
         "Введите ID термокружки для обновления:"
     )
@@ -937,7 +1277,10 @@ async def update_reserved_start(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await query.answer()
     
-    await query.message.reply_text(
+    context.user_data['request_type'] = 'update_reserved'
+    
+    await edit_or_reply(
+        update,
         "📦 **Обновить количество зарезервированного товара**\n\n"
         "Введите ID продукта:"
     )
@@ -949,6 +1292,7 @@ async def update_reserved_process(update: Update, context: ContextTypes.DEFAULT_
     try:
         product_id = int(update.message.text)
         context.user_data['update_reserved_id'] = product_id
+        begin_operation(context, 'reserved')
         
         await update.message.reply_text(
             f"📦 **Обновление резерва для ID {product_id}**\n\n"
@@ -967,14 +1311,19 @@ async def update_reserved_process(update: Update, context: ContextTypes.DEFAULT_
 async def update_reserved_quantity_process(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработать ввод количества для резерва"""
     try:
-        quantity_change = int(update.message.text)
+        confirmed_change = take_confirmation(update, context, 'reserved')
+        confirmed = confirmed_change is not None
+        quantity_change = confirmed_change if confirmed else int(update.message.text)
         product_id = context.user_data.get('update_reserved_id')
         
         if not product_id:
             await update.message.reply_text("❌ Ошибка: ID продукта не найден")
             return await update_products_menu_from_message(update, context)
         
-        result = await api_client.update_thermocup_reserved(product_id, quantity_change)
+        key = operation_key(update, context, 'reserved', product_id, quantity_change)
+        result = await api_client.update_thermocup_reserved(
+            product_id, quantity_change, idempotency_key=key, confirmed=confirmed
+        )
         
         if result:
             await update.message.reply_text(
@@ -982,7 +1331,12 @@ async def update_reserved_quantity_process(update: Update, context: ContextTypes
                 f"Изменение: {quantity_change} единиц"
             )
         else:
-            await update.message.reply_text("❌ Ошибка при обновлении резерва")
+            await update.message.reply_text(
+                failed_change_text(context, 'reserved', key, "резерва", quantity_change)
+            )
+            return ENTER_RESERVED_QUANTITY
+        
+        end_operation(context, 'reserved')
     
     except ValueError:
         await update.message.reply_text("❌ Пожалуйста, введите целое число")
@@ -995,7 +1349,10 @@ async def update_stock_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     await query.answer()
     
-    await query.message.reply_text(
+    context.user_data['request_type'] = 'update_stock'
+    
+    await edit_or_reply(
+        update,
         "🏭 **Обновить количество товара на складе**\n\n"
         "Введите ID продукта:"
     )
@@ -1024,6 +1381,7 @@ async def update_stock_warehouse_process(update: Update, context: ContextTypes.D
     try:
         warehouse_id = int(update.message.text)
         context.user_data['update_stock_warehouse_id'] = warehouse_id
+        begin_operation(context, 'stock')
         
         product_id = context.user_data.get('update_stock_id')
         
@@ -1042,7 +1400,9 @@ async def update_stock_warehouse_process(update: Update, context: ContextTypes.D
 async def update_stock_quantity_process(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработать ввод количества для склада"""
     try:
-        quantity_change = int(update.message.text)
+        confirmed_change = take_confirmation(update, context, 'stock')
+        confirmed = confirmed_change is not None
+        quantity_change = confirmed_change if confirmed else int(update.message.text)
         product_id = context.user_data.get('update_stock_id')
         warehouse_id = context.user_data.get('update_stock_warehouse_id')
         
@@ -1050,7 +1410,10 @@ async def update_stock_quantity_process(update: Update, context: ContextTypes.DE
             await update.message.reply_text("❌ Ошибка: данные не найдены")
             return await update_products_menu_from_message(update, context)
         
-        result = await api_client.update_thermocup_stock(product_id, warehouse_id, quantity_change)
+        key = operation_key(update, context, 'stock', product_id, warehouse_id, quantity_change)
+        result = await api_client.update_thermocup_stock(
+            product_id, warehouse_id, quantity_change, idempotency_key=key, confirmed=confirmed
+        )
         
         if result:
             await update.message.reply_text(
@@ -1060,7 +1423,12 @@ async def update_stock_quantity_process(update: Update, context: ContextTypes.DE
                 f"Изменение: {quantity_change} единиц"
             )
         else:
-            await update.message.reply_text("❌ Ошибка при обновлении склада")
+            await update.message.reply_text(
+                failed_change_text(context, 'stock', key, "склада", quantity_change)
+            )
+            return ENTER_STOCK_QUANTITY
+        
+        end_operation(context, 'stock')
     
     except ValueError:
         await update.message.reply_text("❌ Пожалуйста, введите целое число")
@@ -1068,61 +1436,122 @@ async def update_stock_quantity_process(update: Update, context: ContextTypes.DE
     
     return await update_products_menu_from_message(update, context)
 
-async def advanced_search_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Меню расширенного поиска с фильтрами"""
+async def bulk_stock_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Начать массовое обновление склада"""
     query = update.callback_query
     await query.answer()
     
-    keyboard = [
-        [InlineKeyboardButton("🔍 Поиск по названию", callback_data="search_name")],
-        [InlineKeyboardButton("📂 Поиск по категории", callback_data="search_category")],
-        [InlineKeyboardButton("💰 Поиск по цене", callback_data="search_price_range")],
-        [InlineKeyboardButton("📦 Только в наличии", callback_data="search_in_stock")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_products_menu")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    # ИСПРАВЛЕНИЕ: используем message.reply_text вместо reply_text
-    await query.message.reply_text(
-        "🎯 **Расширенный поиск**\n\n"
-        "Выберите тип поиска:",
-        parse_mode='Markdown',
-        reply_markup=reply_markup
+    begin_operation(context, 'bulk_stock')
+    
+    await edit_or_reply(
+        update,
+        "📑 **Массовое обновление склада**\n\n"
+        "Отправьте строки в формате:\n"
+        "`ID продукта | ID склада | изменение`\n\n"
+        "Пример:\n"
+        "`12 | 1 | 10`\n"
+        "`15 | 2 | -3`\n\n"
+        f"Или загрузите CSV-файл с такими же колонками (до {Config.BULK_MAX_LINES} строк).",
+        parse_mode='Markdown'
     )
     
-    return GET_PRODUCTS_MENU
+    return ENTER_BULK_STOCK
 
-async def add_products_menu_from_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Вернуться в меню добавления из сообщения"""
-    keyboard = [
-        [InlineKeyboardButton("☕ Добавить термокружку", callback_data="add_thermocup")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+async def bulk_stock_process(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Обработать строки массового обновления склада"""
+    confirmed_lines = take_confirmation(update, context, 'bulk_stock')
+    if confirmed_lines is not None:
+        return await run_bulk_stock_update(update, context, confirmed_lines, confirmed=True)
+    return await run_bulk_stock_update(update, context, update.message.text.splitlines())
+
+async def bulk_stock_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Обработать CSV-файл массового обновления склада"""
+    document = update.message.document
     
-    await update.message.reply_text(
-        "➕ **Добавить продукты**\nВыберите тип продукта:",
-        parse_mode='Markdown',
-        reply_markup=reply_markup
+    try:
+        file = await document.get_file()
+        content = await file.download_as_bytearray()
+        text = bytes(content).decode('utf-8-sig')
+    except UnicodeDecodeError:
+        await update.message.reply_text("❌ Файл должен быть в кодировке UTF-8")
+        return ENTER_BULK_STOCK
+    except Exception as e:
+        logger.error(f"Bulk stock download error: {e}")
+        await update.message.reply_text("❌ Не удалось загрузить файл")
+        return ENTER_BULK_STOCK
+    
+    return await run_bulk_stock_update(update, context, text.splitlines())
+
+async def run_bulk_stock_update(update: Update, context: ContextTypes.DEFAULT_TYPE, lines: List[str],
+                                confirmed: bool = False) -> int:
+    """
+    Проверить все строки и отправить изменения склада
+    
+    confirmed=True - пользователь подтвердил повторную отправку строк,
+    ответ на которые не был получен.
+    """
+    changes, errors = parse_stock_lines(lines, max_lines=Config.BULK_MAX_LINES)
+    
+    # Все строки проверяются заранее: при любой ошибке ничего не отправляем
+    if errors:
+        await update.message.reply_text(truncate_message(format_line_errors(errors)))
+        return ENTER_BULK_STOCK
+    
+    if not changes:
+        await update.message.reply_text("❌ Не найдено ни одной строки с изменениями")
+        return ENTER_BULK_STOCK
+    
+    progress_message = await update.message.reply_text(f"⏳ Обновляю склад: {len(changes)} строк...")
+    
+    results = await apply_stock_changes(
+        api_client, changes,
+        concurrency=Config.BULK_CONCURRENCY,
+        use_batch=Config.API_STOCK_BATCH_ENDPOINT,
+        key_prefix=operation_key(update, context, 'bulk_stock'),
+        confirmed=confirmed
     )
     
+    await progress_message.reply_text(truncate_message(format_stock_report(results)))
+    
+    if any(ok is None for _, ok in results):
+        # Сервер не дедуплицирует повторы: строки без ответа отправляются снова только после проверки
+        context.user_data['bulk_stock_unconfirmed'] = lines
+        await update.message.reply_text(
+            "⚠️ По части строк сервер не ответил: неизвестно, применены ли они. "
+            "Проверьте остатки этих товаров - без подтверждения такие строки повторно не отправляются.\n"
+            f"Если они не применились, отправьте «{CONFIRM_RESEND}»: строки будут отправлены снова, "
+            "уже примененные изменения не повторятся. Для выхода - /cancel"
+        )
+        return ENTER_BULK_STOCK
+    
+    if not all(ok for _, ok in results):
+        # Ключ строки не зависит от ее позиции: примененные не задублируются
+        await update.message.reply_text(
+            "Можно отправить строки еще раз - все или только непримененные, в любом порядке: "
+            "уже примененные изменения не повторятся. "
+            "Одинаковые строки отправляйте все вместе: вторая такая же строка - отдельное изменение. "
+            "Для выхода - /cancel"
+        )
+        return ENTER_BULK_STOCK
+    
+    end_operation(context, 'bulk_stock')
+    return await update_products_menu_from_message(update, context)
+
+async def add_products_menu_from_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Вернуться в меню добавления из сообщения"""
+    await show_menu(update, ADD_MENU_KB)
+    
     return ADD_PRODUCT_MENU
 
+async def get_products_menu_from_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Вернуться в меню продуктов из сообщения"""
+    await show_menu(update, PRODUCTS_MENU_KB)
+    
+    return GET_PRODUCTS_MENU
+
 async def update_products_menu_from_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Вернуться в меню обновления из сообщения"""
-    keyboard = [
-        [InlineKeyboardButton("✏️ Обновить термокружку", callback_data="update_thermocup")],
-        [InlineKeyboardButton("📦 Обновить резерв", callback_data="update_reserved")],
-        [InlineKeyboardButton("🏭 Обновить склад", callback_data="update_stock")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await update.message.reply_text(
-        "🔄 **Обновить продукты**\nВыберите действие:",
-        parse_mode='Markdown',
-        reply_markup=reply_markup
-    )
+    await show_menu(update, UPDATE_MENU_KB)
     
     return UPDATE_PRODUCT_MENU
 
@@ -1133,20 +1562,84 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def back_to_main_from_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Вернуться в главное меню из сообщения"""
-    keyboard = [
-        [InlineKeyboardButton("📦 Получить продукты", callback_data="get_products")],
-        [InlineKeyboardButton("➕ Добавить продукты", callback_data="add_products")],
-        [InlineKeyboardButton("🔄 Обновить продукты", callback_data="update_products")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await update.message.reply_text(
-        "🏭 Главное меню управления складом\nВыберите действие:",
-        reply_markup=reply_markup
-    )
+    await show_menu(update, MAIN_MENU_KB)
     
     return MAIN_MENU
 
+# ===== АДМИНИСТРИРОВАНИЕ =====
+def is_admin(update: Update) -> bool:
+    """Пользователь указан в ADMIN_IDS"""
+    return update.effective_user is not None and update.effective_user.id in Config.ADMIN_IDS
+
+def parse_profile_seconds(args: List[str]) -> Optional[float]:
+    """Длительность окна из аргумента команды (по умолчанию и не больше лимита из Config)"""
+    if not args:
+        return Config.PROFILE_DEFAULT_SECONDS
+    try:
+        seconds = float(args[0])
+    except ValueError:
+        return None
+    if seconds <= 0:
+        return None
+    return min(seconds, Config.PROFILE_MAX_SECONDS)
+
+async def start_profiling(update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str,
+                          run_profiler: Callable[[float], Awaitable[str]]) -> None:
+    """
+    Общая часть /profile и /memprofile: проверки и запуск окна в фоне
+
+    Окно выполняется отдельной задачей, чтобы не держать очередь
+    обновлений чата администратора, а отчет приходит документом.
+    """
+    if not is_admin(update):
+        logger.warning(f"/{kind} denied for user {update.effective_user.id if update.effective_user else None}")
+        await update.message.reply_text("⛔ Команда доступна только администраторам")
+        return
+    
+    seconds = parse_profile_seconds(context.args)
+    if seconds is None:
+        await update.message.reply_text(f"❌ Использование: /{kind} <секунды>, не больше {Config.PROFILE_MAX_SECONDS:.0f}")
+        return
+    
+    if profiling.is_busy():
+        await update.message.reply_text("⏳ Профилирование уже идет, дождитесь отчета")
+        return
+    
+    async def run_and_report() -> None:
+        try:
+            report = await run_profiler(seconds)
+        except profiling.ProfilerBusy:
+            await update.message.reply_text("⏳ Профилирование уже идет, дождитесь отчета")
+            return
+        except Exception as e:
+            logger.error(f"/{kind} failed: {e}")
+            await update.message.reply_text("❌ Не удалось снять профиль")
+            return
+        
+        filename = f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}.txt"
+        await update.message.reply_document(
+            document=InputFile(report.encode('utf-8'), filename=filename),
+            caption=f"📈 Отчет /{kind} за {seconds:g} с"
+        )
+    
+    logger.info(f"/{kind} for {seconds:g}s started by admin {update.effective_user.id}")
+    await update.message.reply_text(f"⏱ Профилирую {seconds:g} с, отчет придет файлом")
+    context.application.create_task(run_and_report(), update=update)
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/profile <секунды>: cProfile всего бота на время окна, отчет по горячим функциям"""
+    await start_profiling(
+        update, context, "profile",
+        lambda seconds: profiling.profile_for(seconds, top=Config.PROFILE_TOP)
+    )
+
+async def memprofile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/memprofile <секунды>: разница снимков tracemalloc в начале и в конце окна"""
+    await start_profiling(
+        update, context, "memprofile",
+        lambda seconds: profiling.memory_diff_for(seconds, top=Config.PROFILE_TOP, frames=Config.MEMPROFILE_FRAMES)
+    )
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик ошибок"""
     logger.error(f"Exception while handling an update: {context.error}")
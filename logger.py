@@ -1,26 +1,111 @@
 # logger.py
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
+import random
 import sys
+from typing import Any, Dict
 from config import Config
+from tracing import TraceIdFilter
 
-def setup_logger():
-    """Настройка логирования"""
-    logger = logging.getLogger(__name__)
-    log_level = getattr(logging, Config.LOG_LEVEL.upper())
-    logger.setLevel(log_level)
-    
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Стандартные атрибуты LogRecord: все остальное пришло через extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-запись на строку: время, уровень, логгер, сообщение и поля из extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который при переполненной очереди отбрасывает запись, а не блокирует"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def _file_handler() -> logging.Handler:
+    """Файл с ротацией по времени (LOG_ROTATE_WHEN) или по размеру"""
+    if Config.LOG_ROTATE_WHEN:
+        return logging.handlers.TimedRotatingFileHandler(
+            Config.LOG_FILE, when=Config.LOG_ROTATE_WHEN,
+            backupCount=Config.LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+    return logging.handlers.RotatingFileHandler(
+        Config.LOG_FILE, maxBytes=Config.LOG_MAX_BYTES,
+        backupCount=Config.LOG_BACKUP_COUNT, encoding='utf-8'
     )
-    
+
+def setup_logger():
+    """
+    Настройка логирования
+
+    Обработчики вызываются из отдельного потока QueueListener, поэтому
+    запись в файл и вывод в консоль не блокируют цикл событий.
+    """
+    if Config.LOG_FORMAT == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(trace_id)s - %(message)s')
+
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
-    
-    file_handler = logging.FileHandler('bot.log', encoding='utf-8')
-    file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
-    
-    return logger
-
-logger = setup_logger()
\ No newline at end of file
+    sinks = [console_handler]
+
+    if Config.LOG_FILE:
+        file_handler = _file_handler()
+        file_handler.setFormatter(formatter)
+        sinks.append(file_handler)
+
+    log_queue = queue.Queue(maxsize=Config.LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    # ID трассировки берется в потоке, который пишет запись, до постановки в очередь
+    queue_handler.addFilter(TraceIdFilter())
+    listener = logging.handlers.QueueListener(log_queue, *sinks, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    # Обработчик на корневом логгере: записи всех модулей идут через очередь
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, Config.LOG_LEVEL.upper()))
+    root.addHandler(queue_handler)
+
+    for name, level in Config.LOG_LEVELS.items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    return logging.getLogger(__name__)
+
+def log_payload(target: logging.Logger, message: str, payload: Any) -> None:
+    """
+    Записать тело запроса/ответа на уровне DEBUG с выборкой и обрезкой
+
+    Пишется доля LOG_PAYLOAD_SAMPLE_RATE вызовов, текст обрезается до
+    LOG_PAYLOAD_MAX_CHARS; если DEBUG выключен, payload даже не форматируется.
+    """
+    if not target.isEnabledFor(logging.DEBUG) or random.random() >= Config.LOG_PAYLOAD_SAMPLE_RATE:
+        return
+    text = repr(payload)
+    if len(text) > Config.LOG_PAYLOAD_MAX_CHARS:
+        text = f"{text[:Config.LOG_PAYLOAD_MAX_CHARS]}... ({len(text)} chars)"
+    target.debug(f"{message}: {text}", extra={"payload_sampled": True})
+
+logger = setup_logger()
@@ -0,0 +1,210 @@
+# menus.py
+from typing import Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.ext import CallbackQueryHandler, ContextTypes
+
+# Состояния для ConversationHandler
+(
+    MAIN_MENU, GET_PRODUCTS_MENU, ADD_PRODUCT_MENU, UPDATE_PRODUCT_MENU,
+    ENTER_PRODUCT_ID, ENTER_SEARCH_QUERY, ENTER_CATEGORY, ENTER_PRICE_RANGE,
+    ENTER_THERMOCUP_DATA, ENTER_UPDATE_DATA, ENTER_RESERVED_QUANTITY,
+    ENTER_STOCK_QUANTITY, ENTER_WAREHOUSE_ID, ENTER_BULK_STOCK, ENTER_IMPORT_FILE
+) = range(15)
+
+Callback = Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[int]]
+
+class Button(NamedTuple):
+    """Кнопка меню: подпись и callback_data"""
+    text: str
+    callback_data: str
+
+class Menu:
+    """
+    Статическое меню: текст и клавиатура, собранная один раз при импорте
+
+    state - состояние диалога, в котором меню показано пользователю;
+    по нему строится таблица обработчиков нажатий (см. build_callback_routers).
+    content=True - клавиатура под результатами (список, карточка), а не
+    самостоятельное меню: такое сообщение не заменяется другим меню.
+    """
+
+    def __init__(self, name: str, state: int, text: str, rows: Sequence[Sequence[Button]],
+                 parse_mode: Optional[str] = None, content: bool = False):
+        self.name = name
+        self.state = state
+        self.content = content
+        self.text = text
+        self.parse_mode = parse_mode
+        self.rows = tuple(tuple(row) for row in rows)
+        self.markup = InlineKeyboardMarkup(tuple(
+            tuple(InlineKeyboardButton(button.text, callback_data=button.callback_data) for button in row)
+            for row in self.rows
+        ))
+
+    @property
+    def callback_data(self) -> List[str]:
+        """callback_data всех кнопок меню"""
+        return [button.callback_data for row in self.rows for button in row]
+
+# Реестр меню по имени
+MENUS: Dict[str, Menu] = {}
+
+# callback_data клавиатур под результатами, по кнопкам
+_CONTENT_KEYBOARDS: Set[Tuple[str, ...]] = set()
+
+def register_menu(name: str, state: int, text: str, rows: Sequence[Sequence[Button]],
+                  parse_mode: Optional[str] = None, content: bool = False) -> Menu:
+    """Создать меню и добавить его в реестр"""
+    if name in MENUS:
+        raise ValueError(f"Меню {name} уже зарегистрировано")
+    menu = MENUS[name] = Menu(name, state, text, rows, parse_mode, content)
+    if content:
+        _CONTENT_KEYBOARDS.add(tuple(menu.callback_data))
+    return menu
+
+def is_content_keyboard(markup: Optional[InlineKeyboardMarkup]) -> bool:
+    """Клавиатура сообщения - из клавиатур под результатами (content=True)"""
+    if markup is None:
+        return False
+    callback_data = tuple(button.callback_data for row in markup.inline_keyboard for button in row)
+    return callback_data in _CONTENT_KEYBOARDS
+
+class CallbackRouter:
+    """Один CallbackQueryHandler на состояние: выбор обработчика по точному callback_data"""
+
+    def __init__(self, routes: Dict[str, Callback]):
+        self.routes = routes
+
+    def matches(self, callback_data: object) -> bool:
+        return callback_data in self.routes
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        return await self.routes[update.callback_query.data](update, context)
+
+    def handler(self) -> CallbackQueryHandler:
+        return CallbackQueryHandler(self.dispatch, pattern=self.matches)
+
+def build_callback_routers(actions: Dict[str, Callback],
+                           menus: Optional[Iterable[Menu]] = None) -> Dict[int, CallbackRouter]:
+    """
+    Таблица обработчиков нажатий из реестра меню
+
+    В каждом состоянии обрабатываются кнопки меню, показанных в этом состоянии.
+    Raises:
+        ValueError: если для кнопки не указан обработчик
+    """
+    routes: Dict[int, Dict[str, Callback]] = {}
+    for menu in (MENUS.values() if menus is None else menus):
+        for callback_data in menu.callback_data:
+            if callback_data not in actions:
+                raise ValueError(f"Нет обработчика для кнопки {callback_data} (меню {menu.name})")
+            routes.setdefault(menu.state, {})[callback_data] = actions[callback_data]
+    return {state: CallbackRouter(state_routes) for state, state_routes in routes.items()}
+
+# ===== МЕНЮ =====
+MAIN_MENU_KB = register_menu(
+    "main", MAIN_MENU,
+    "🏭 Главное меню управления складом\nВыберите действие:",
+    [
+        [Button("📦 Получить продукты", "get_products")],
+        [Button("➕ Добавить продукты", "add_products")],
+        [Button("🔄 Обновить продукты", "update_products")],
+    ],
+)
+
+PRODUCTS_MENU_KB = register_menu(
+    "products", GET_PRODUCTS_MENU,
+    "📦 **Получить продукты**\nВыберите тип запроса:",
+    [
+        [Button("📋 Все продукты", "all_products")],
+        [Button("🔍 Быстрый поиск", "search_products")],
+        [Button("🎯 Расширенный поиск", "advanced_search")],
+        [Button("🆔 По ID продукта", "by_id")],
+        [Button("☕ Термокружка по ID", "thermocup_by_id")],
+        [Button("🔙 Назад", "back_to_main")],
+    ],
+    parse_mode='Markdown',
+)
+
+ADVANCED_SEARCH_KB = register_menu(
+    "advanced_search", GET_PRODUCTS_MENU,
+    "🎯 **Расширенный поиск**\n\nВыберите тип поиска:",
+    [
+        [Button("🔍 Поиск по названию", "search_name")],
+        [Button("📂 Поиск по категории", "search_category")],
+        [Button("💰 Поиск по цене", "search_price_range")],
+        [Button("📦 Только в наличии", "search_in_stock")],
+        [Button("🔙 Назад", "back_to_products_menu")],
+    ],
+    parse_mode='Markdown',
+)
+
+ADD_MENU_KB = register_menu(
+    "add", ADD_PRODUCT_MENU,
+    "➕ **Добавить продукты**\nВыберите тип продукта:",
+    [
+        [Button("☕ Добавить термокружку", "add_thermocup")],
+        [Button("📥 Импорт из файла", "import_thermocups")],
+        [Button("🔙 Назад", "back_to_main")],
+    ],
+    parse_mode='Markdown',
+)
+
+UPDATE_MENU_KB = register_menu(
+    "update", UPDATE_PRODUCT_MENU,
+    "🔄 **Обновить продукты**\nВыберите действие:",
+    [
+        [Button("✏️ Обновить термокружку", "update_thermocup")],
+        [Button("📦 Обновить резерв", "update_reserved")],
+        [Button("🏭 Обновить склад", "update_stock")],
+        [Button("📑 Массовое обновление склада", "bulk_stock")],
+        [Button("🔙 Назад", "back_to_main")],
+    ],
+    parse_mode='Markdown',
+)
+
+# Клавиатуры под результатами (текст задает обработчик)
+SEARCH_RESULTS_KB = register_menu(
+    "search_results", GET_PRODUCTS_MENU, "",
+    [
+        [Button("🔍 Новый поиск", "search_products")],
+        [Button("🔙 В меню", "back_to_products_menu")],
+    ],
+    content=True,
+)
+
+RESULTS_KB = register_menu(
+    "results", GET_PRODUCTS_MENU, "",
+    [[Button("🔙 Назад", "back_to_products_menu")]],
+    content=True,
+)
+
+# Навигация по страницам списка: клавиатура зависит от наличия соседних страниц
+PRODUCT_PAGE_KB = {
+    (False, False): RESULTS_KB,
+    (False, True): register_menu(
+        "product_page_next", GET_PRODUCTS_MENU, "",
+        [
+            [Button("➡️ Далее", "show_more_products")],
+            [Button("🔙 Назад", "back_to_products_menu")],
+        ],
+        content=True,
+    ),
+    (True, False): register_menu(
+        "product_page_prev", GET_PRODUCTS_MENU, "",
+        [
+            [Button("⬅️ Предыдущие", "show_prev_products")],
+            [Button("🔙 Назад", "back_to_products_menu")],
+        ],
+        content=True,
+    ),
+    (True, True): register_menu(
+        "product_page_both", GET_PRODUCTS_MENU, "",
+        [
+            [Button("⬅️ Предыдущие", "show_prev_products"), Button("➡️ Далее", "show_more_products")],
+            [Button("🔙 Назад", "back_to_products_menu")],
+        ],
+        content=True,
+    ),
+}
@@ -0,0 +1,257 @@
+# metrics.py
+import bisect
+import functools
+import logging
+import re
+import time
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+# Значение для экспорта: имя, метки, значение
+Sample = Tuple[str, Dict[str, str], float]
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_sample(name: str, labels: Dict[str, str], value: float) -> str:
+    if labels:
+        label_text = ",".join(f'{key}="{_escape(str(val))}"' for key, val in labels.items())
+        return f"{name}{{{label_text}}} {value}"
+    return f"{name} {value}"
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def _labels(self, key: LabelValues) -> Dict[str, str]:
+        return dict(zip(self.label_names, key))
+
+    def samples(self) -> Iterable[Sample]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        super().__init__(name, description, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[Sample]:
+        for key, value in self._values.items():
+            yield self.name, self._labels(key), value
+
+class Gauge(_Metric):
+    """Текущее значение (может уменьшаться)"""
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        super().__init__(name, description, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def samples(self) -> Iterable[Sample]:
+        for key, value in self._values.items():
+            yield self.name, self._labels(key), value
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам (для задержек в секундах)"""
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Метки -> (счетчики по корзинам, сумма, количество)
+        self._values: Dict[LabelValues, List] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            entry[0][index] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def samples(self) -> Iterable[Sample]:
+        for key, (counts, total, count) in self._values.items():
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", {**labels, "le": str(bound)}, cumulative
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+class Registry:
+    """
+    Набор метрик и функций, снимающих значения в момент запроса
+
+    Коллектор возвращает список (метрика, [(метки, значение)]): так
+    экспортируются счетчики, которые уже ведут другие модули (кэш,
+    очередь отправки), без дублирования учета.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[_Metric, Iterable[Tuple[Dict[str, str], float]]]]]] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, description: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, description, labels))
+
+    def gauge(self, name: str, description: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, description, labels))
+
+    def histogram(self, name: str, description: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, description, labels, buckets))
+
+    def add_collector(self, collector: Callable) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines: List[str] = []
+        metrics = list(self._metrics.values())
+
+        collected: Dict[str, Tuple[_Metric, List[Sample]]] = {}
+        for collector in self._collectors:
+            try:
+                for metric, values in collector():
+                    entry = collected.setdefault(metric.name, (metric, []))
+                    entry[1].extend((metric.name, labels, value) for labels, value in values)
+            except Exception as e:
+                logger.error(f"Metrics collector {collector!r} failed: {e}")
+
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(_format_sample(*sample) for sample in metric.samples())
+        for metric, samples in collected.values():
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(_format_sample(*sample) for sample in samples)
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+# ===== МЕТРИКИ БОТА =====
+HANDLER_LATENCY = REGISTRY.histogram(
+    "bot_handler_duration_seconds", "Время обработчика обновления от начала до конца", ["handler"])
+HANDLER_ERRORS = REGISTRY.counter(
+    "bot_handler_errors_total", "Исключения в обработчиках обновлений", ["handler"])
+HANDLERS_IN_PROGRESS = REGISTRY.gauge(
+    "bot_handlers_in_progress", "Обработчики, выполняющиеся сейчас")
+
+API_LATENCY = REGISTRY.histogram(
+    "warehouse_request_duration_seconds", "Время запроса к Warehouse API (одна попытка)", ["method", "endpoint"])
+API_RESPONSES = REGISTRY.counter(
+    "warehouse_responses_total", "Ответы Warehouse API по статусу (error - сбой соединения или таймаут)",
+    ["method", "endpoint", "status"])
+API_IN_FLIGHT = REGISTRY.gauge(
+    "warehouse_requests_in_flight", "Запросы к Warehouse API, ожидающие ответа")
+
+TELEGRAM_REQUESTS = REGISTRY.counter(
+    "telegram_requests_total", "Исходящие запросы к Telegram Bot API", ["endpoint", "result"])
+
+# Для сбора значений, которые считают другие модули
+CACHE_EVENTS = Counter("cache_events_total", "Обращения к кэшам", ["cache", "result"])
+CACHE_HIT_RATE = Gauge("cache_hit_ratio", "Доля попаданий в кэш", ["cache"])
+CACHE_SIZE = Gauge("cache_entries", "Записей в кэше", ["cache"])
+CACHE_BYTES = Gauge("cache_bytes", "Оценка объема кэша в байтах", ["cache"])
+CACHE_COALESCED = Counter("cache_coalesced_total", "Промахи, присоединенные к уже идущему запросу", ["cache"])
+SEND_QUEUE_DEPTH = Gauge("telegram_send_queue_depth", "Запросы в очереди отправки", ["priority"])
+UPDATES_ACTIVE = Gauge("bot_updates_active", "Обновления, обрабатываемые сейчас")
+
+_ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+def endpoint_label(endpoint: str) -> str:
+    """Эндпоинт без числовых ID, чтобы число меток не росло: products/12 -> products/:id"""
+    return _ID_SEGMENT.sub('/:id', '/' + endpoint.strip('/'))[1:]
+
+def cache_collector(caches: Dict[str, Callable[[], Dict]]) -> Callable:
+    """Коллектор для кэшей TTLCache по их stats()"""
+    def collect():
+        events, hit_rate, size, size_bytes, coalesced = [], [], [], [], []
+        for name, get_stats in caches.items():
+            stats = get_stats()
+            events += [({"cache": name, "result": "hit"}, stats["hits"]),
+                       ({"cache": name, "result": "miss"}, stats["misses"]),
+                       ({"cache": name, "result": "eviction"}, stats["evictions"])]
+            hit_rate.append(({"cache": name}, stats["hit_rate"]))
+            size.append(({"cache": name}, stats["size"]))
+            size_bytes.append(({"cache": name}, stats.get("bytes", 0)))
+            if "coalesced" in stats:
+                coalesced.append(({"cache": name}, stats["coalesced"]))
+        return [(CACHE_EVENTS, events), (CACHE_HIT_RATE, hit_rate), (CACHE_SIZE, size), (CACHE_BYTES, size_bytes),
+                (CACHE_COALESCED, coalesced)]
+    return collect
+
+def timed_handler(callback: Callable) -> Callable:
+    """Обертка обработчика: время выполнения, ошибки и число выполняющихся"""
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        HANDLERS_IN_PROGRESS.inc()
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, handler=name)
+            HANDLERS_IN_PROGRESS.dec()
+
+    return wrapper
+
+async def start_metrics_server(host: str, port: int, registry: Registry = REGISTRY) -> web.AppRunner:
+    """HTTP-сервер с GET /metrics в текстовом формате Prometheus"""
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics endpoint listening on {host}:{port}/metrics")
+    return runner
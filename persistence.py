@@ -0,0 +1,215 @@
+# persistence.py
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id    INTEGER PRIMARY KEY,
+    data       TEXT    NOT NULL,
+    updated_at REAL    NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    name       TEXT    NOT NULL,
+    key        TEXT    NOT NULL,
+    state      TEXT    NOT NULL,
+    updated_at REAL    NOT NULL,
+    PRIMARY KEY (name, key)
+);
+"""
+
+def compact_user_data(data: Dict) -> Dict:
+    """
+    Часть user_data, которую имеет смысл сохранять
+
+    Ключи с префиксом "_" считаются временными (кэши, готовые страницы)
+    и не сохраняются; значения, которые нельзя представить в JSON, тоже.
+    Состояние списка хранится как фильтры и смещение, а не как страницы.
+    """
+    compact = {}
+    for key, value in data.items():
+        if not isinstance(key, str) or key.startswith('_'):
+            continue
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            logger.debug(f"user_data['{key}'] is not JSON serializable, skipped")
+            continue
+        compact[key] = value
+    return compact
+
+class SQLitePersistence(BasePersistence):
+    """
+    Хранение состояний диалогов и user_data в SQLite
+
+    Изменения копятся в памяти и записываются одной транзакцией за проход
+    Application.update_persistence (раз в update_interval секунд и при
+    остановке бота). Сессии, не менявшиеся дольше session_ttl секунд,
+    не загружаются и удаляются из базы. path=":memory:" - локальная
+    замена без файла (состояние живет до перезапуска).
+    """
+
+    def __init__(self, path: str, update_interval: float = 60, session_ttl: Optional[float] = None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self.session_ttl = session_ttl
+        self._connection: Optional[sqlite3.Connection] = None
+        # Запросы идут из пула потоков, соединение одно
+        self._db_lock = threading.Lock()
+        self._pending_users: Dict[int, Optional[str]] = {}
+        self._pending_conversations: Dict[Tuple[str, str], Optional[str]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self.writes = 0
+        self.evicted = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(_SCHEMA)
+        return self._connection
+
+    def _query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._db_lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    def _expired_before(self) -> float:
+        return time.time() - self.session_ttl if self.session_ttl else 0.0
+
+    # ===== ЗАГРУЗКА =====
+    async def get_user_data(self) -> Dict[int, Dict]:
+        rows = await asyncio.to_thread(
+            self._query, "SELECT user_id, data FROM user_data WHERE updated_at >= ?", (self._expired_before(),)
+        )
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    async def get_conversations(self, name: str) -> Dict:
+        rows = await asyncio.to_thread(
+            self._query, "SELECT key, state FROM conversations WHERE name = ? AND updated_at >= ?",
+            (name, self._expired_before())
+        )
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    # ===== ОТЛОЖЕННАЯ ЗАПИСЬ =====
+    def _schedule_flush(self) -> None:
+        """Записать накопленное после того, как Application передаст все изменения прохода"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(0)
+        await self._write_pending()
+
+    async def update_user_data(self, user_id: int, data: Dict) -> None:
+        self._pending_users[user_id] = json.dumps(compact_user_data(data), ensure_ascii=False, separators=(',', ':'))
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._pending_users[user_id] = None
+        self._schedule_flush()
+
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]) -> None:
+        state = None if new_state is None else json.dumps(new_state)
+        self._pending_conversations[(name, json.dumps(list(key)))] = state
+        self._schedule_flush()
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict) -> None:
+        pass
+
+    async def _write_pending(self) -> None:
+        if not self._pending_users and not self._pending_conversations:
+            return
+        users, self._pending_users = self._pending_users, {}
+        conversations, self._pending_conversations = self._pending_conversations, {}
+        await asyncio.to_thread(self._write_batch, users, conversations)
+
+    def _write_batch(self, users: Dict[int, Optional[str]],
+                     conversations: Dict[Tuple[str, str], Optional[str]]) -> None:
+        now = time.time()
+        with self._db_lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO user_data (user_id, data, updated_at) VALUES (?, ?, ?)",
+                    [(user_id, data, now) for user_id, data in users.items() if data is not None]
+                )
+                connection.executemany(
+                    "DELETE FROM user_data WHERE user_id = ?",
+                    [(user_id,) for user_id, data in users.items() if data is None]
+                )
+                connection.executemany(
+                    "INSERT OR REPLACE INTO conversations (name, key, state, updated_at) VALUES (?, ?, ?, ?)",
+                    [(name, key, state, now) for (name, key), state in conversations.items() if state is not None]
+                )
+                connection.executemany(
+                    "DELETE FROM conversations WHERE name = ? AND key = ?",
+                    [(name, key) for (name, key), state in conversations.items() if state is None]
+                )
+                if self.session_ttl:
+                    expired_before = now - self.session_ttl
+                    evicted = connection.execute(
+                        "DELETE FROM user_data WHERE updated_at < ?", (expired_before,)
+                    ).rowcount
+                    evicted += connection.execute(
+                        "DELETE FROM conversations WHERE updated_at < ?", (expired_before,)
+                    ).rowcount
+                    self.evicted += evicted
+        self.writes += 1
+        logger.debug(f"Persistence flush: {len(users)} users, {len(conversations)} conversations")
+
+    async def flush(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+        await self._write_pending()
+        with self._db_lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def stats(self) -> Dict:
+        """Состояние для мониторинга"""
+        return {
+            "pending_users": len(self._pending_users),
+            "pending_conversations": len(self._pending_conversations),
+            "writes": self.writes,
+            "evicted": self.evicted,
+        }
+
+    # ===== НЕ ХРАНИТСЯ (см. store_data) =====
+    async def get_chat_data(self) -> Dict:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: Dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def get_bot_data(self) -> Dict:
+        return {}
+
+    async def update_bot_data(self, data: Dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict) -> None:
+        pass
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_callback_data(self, data) -> None:
+        pass
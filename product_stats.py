@@ -0,0 +1,123 @@
+# product_stats.py
+from typing import Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # NumPy - необязательная зависимость
+    np = None
+
+# Поля агрегатов; такие же ключи ожидаются от эндпоинта products/aggregates
+AGGREGATE_FIELDS = (
+    'total', 'active', 'out_of_stock', 'total_quantity', 'total_reserved',
+    'min_price', 'max_price', 'avg_price',
+)
+
+def aggregate_products(products: List[Dict], numpy_threshold: Optional[int] = None) -> Dict:
+    """
+    Считает статистику по списку продуктов за один проход
+
+    Args:
+        products: Список продуктов
+        numpy_threshold: С какого размера списка использовать NumPy (None - никогда)
+
+    Returns:
+        Dict: Агрегаты с ключами AGGREGATE_FIELDS
+    """
+    if np is not None and numpy_threshold is not None and len(products) >= numpy_threshold:
+        return _aggregate_numpy(products)
+
+    total = active = out_of_stock = total_quantity = total_reserved = 0
+    price_count = 0
+    price_sum = 0.0
+    min_price = max_price = None
+
+    for product in products:
+        total += 1
+        if product.get('is_active', True):
+            active += 1
+
+        quantity = product.get('total_quantity') or 0
+        if quantity <= 0:
+            out_of_stock += 1
+        total_quantity += quantity
+        total_reserved += product.get('num_reserved_goods') or 0
+
+        price = product.get('base_price')
+        if price is not None:
+            price = float(price)
+            price_count += 1
+            price_sum += price
+            if min_price is None or price < min_price:
+                min_price = price
+            if max_price is None or price > max_price:
+                max_price = price
+
+    return {
+        'total': total,
+        'active': active,
+        'out_of_stock': out_of_stock,
+        'total_quantity': total_quantity,
+        'total_reserved': total_reserved,
+        'min_price': min_price or 0,
+        'max_price': max_price or 0,
+        'avg_price': price_sum / price_count if price_count else 0,
+    }
+
+def _aggregate_numpy(products: List[Dict]) -> Dict:
+    """Векторизованный вариант aggregate_products для больших списков"""
+    count = len(products)
+    quantities = np.fromiter((p.get('total_quantity') or 0 for p in products), dtype=np.int64, count=count)
+    reserved = np.fromiter((p.get('num_reserved_goods') or 0 for p in products), dtype=np.int64, count=count)
+    active = np.fromiter((bool(p.get('is_active', True)) for p in products), dtype=bool, count=count)
+    prices = np.fromiter(
+        (float(p['base_price']) if p.get('base_price') is not None else np.nan for p in products),
+        dtype=np.float64, count=count,
+    )
+    prices = prices[~np.isnan(prices)]
+
+    return {
+        'total': count,
+        'active': int(active.sum()),
+        'out_of_stock': int((quantities <= 0).sum()),
+        'total_quantity': int(quantities.sum()),
+        'total_reserved': int(reserved.sum()),
+        'min_price': float(prices.min()) if prices.size else 0,
+        'max_price': float(prices.max()) if prices.size else 0,
+        'avg_price': float(prices.mean()) if prices.size else 0,
+    }
+
+def normalize_aggregates(data: Optional[Dict]) -> Optional[Dict]:
+    """Приводит ответ сервера к формату aggregate_products (None - если ответ не подходит)"""
+    if not isinstance(data, dict) or 'total' not in data:
+        return None
+    try:
+        return {field: float(data.get(field) or 0) if 'price' in field else int(data.get(field) or 0)
+                for field in AGGREGATE_FIELDS}
+    except (TypeError, ValueError):
+        return None
+
+def format_statistics(stats: Dict, note: str = "", partial: bool = False) -> str:
+    """
+    Текст статистики для Telegram
+
+    partial=True - посчитано не по всему результату: точное число товаров
+    неизвестно, показывается нижняя граница.
+    """
+    if not stats or not stats['total']:
+        return "📊 Статистика: нет данных"
+
+    total = f"более {stats['total']}" if partial else str(stats['total'])
+    statistics = (
+        f"📊 Статистика поиска:\n"
+        f"• Всего найдено: {total} товаров\n"
+        f"• Активных: {stats['active']}\n"
+        f"• Неактивных: {stats['total'] - stats['active']}\n"
+        f"• Нет в наличии: {stats['out_of_stock']}\n"
+        f"• Общее количество: {stats['total_quantity']} шт.\n"
+        f"• Зарезервировано: {stats['total_reserved']} шт.\n"
+        f"• Цены: от ${stats['min_price']:.2f} до ${stats['max_price']:.2f}\n"
+        f"• Средняя цена: ${stats['avg_price']:.2f}"
+    )
+    if note:
+        statistics += f"\n• {note}"
+    return statistics
@@ -0,0 +1,114 @@
+# profiling.py
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import time
+import tracemalloc
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+class ProfilerBusy(Exception):
+    """Профилирование уже идет: одновременно работает только один профилировщик"""
+    pass
+
+# Оба профилировщика глобальны для процесса, поэтому запуск один на всех
+_profile_lock = asyncio.Lock()
+
+def is_busy() -> bool:
+    return _profile_lock.locked()
+
+def _ensure_idle() -> None:
+    if is_busy():
+        raise ProfilerBusy("Профилирование уже запущено")
+
+async def profile_for(seconds: float, top: int = 40) -> str:
+    """
+    Профилировать работающий бот seconds секунд и вернуть отчет
+
+    cProfile включается в потоке цикла событий, поэтому в отчет попадают
+    все обработчики, запросы к API и фоновые задачи этого окна. Отчет -
+    топ функций по собственному времени (tottime) и по времени с
+    вложенными вызовами (cumtime).
+    Raises:
+        ProfilerBusy: если уже идет /profile или /memprofile
+    """
+    _ensure_idle()
+    async with _profile_lock:
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+        elapsed = time.perf_counter() - started
+
+    output = io.StringIO()
+    output.write(f"cProfile: {elapsed:.1f} s\n\n")
+    stats = pstats.Stats(profiler, stream=output)
+    stats.strip_dirs()
+    output.write(f"===== Топ {top} по собственному времени (tottime) =====\n")
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(top)
+    output.write(f"===== Топ {top} по времени с вложенными вызовами (cumtime) =====\n")
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+    logger.info(f"Profiling window of {elapsed:.1f}s finished")
+    return output.getvalue()
+
+# Свои кадры tracemalloc и импорт модулей только зашумляют отчет
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+def _format_size(size: int) -> str:
+    return f"{size / 1024:.1f} KiB"
+
+async def memory_diff_for(seconds: float, top: int = 25, frames: int = 1) -> str:
+    """
+    Снимки tracemalloc в начале и в конце окна seconds секунд и их разница
+
+    В отчете - строки кода, больше всего нарастившие память за окно, и
+    самые большие источники выделений на момент второго снимка. Если
+    tracemalloc не был включен, он включается только на время окна
+    (чтобы видеть и более ранние выделения, бот запускают с PYTHONTRACEMALLOC=1).
+    Raises:
+        ProfilerBusy: если уже идет /profile или /memprofile
+    """
+    _ensure_idle()
+    async with _profile_lock:
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start(frames)
+        try:
+            before = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+            await asyncio.sleep(seconds)
+            after = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if started_here:
+                tracemalloc.stop()
+
+    key_type = "traceback" if frames > 1 else "lineno"
+    lines: List[str] = [
+        f"tracemalloc: окно {seconds:g} s, сейчас {_format_size(current)}, пик {_format_size(peak)}",
+        "",
+        f"===== Топ {top} по приросту за окно =====",
+    ]
+    for diff in after.compare_to(before, key_type)[:top]:
+        lines.append(
+            f"{diff.traceback}: {_format_size(diff.size)} ({diff.size_diff / 1024:+.1f} KiB), "
+            f"{diff.count} блоков ({diff.count_diff:+d})"
+        )
+        if frames > 1:
+            lines.extend(f"    {line}" for line in diff.traceback.format())
+
+    lines += ["", f"===== Топ {top} источников выделений ====="]
+    for stat in after.statistics("lineno")[:top]:
+        lines.append(f"{stat.traceback}: {_format_size(stat.size)}, {stat.count} блоков")
+    logger.info(f"Memory profiling window of {seconds:g}s finished")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,242 @@
+# ratelimit.py
+import asyncio
+import bisect
+import contextvars
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Coroutine, Dict, Iterator, List, Optional, Tuple, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import TELEGRAM_REQUESTS
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты отправки: меньше - раньше
+INTERACTIVE = 0
+BULK = 1
+
+# Приоритет запросов текущей задачи (см. bulk_sends)
+send_priority: contextvars.ContextVar[int] = contextvars.ContextVar('send_priority', default=INTERACTIVE)
+
+@contextmanager
+def bulk_sends() -> Iterator[None]:
+    """Запросы внутри блока уступают очередь ответам на действия пользователей"""
+    token = send_priority.set(BULK)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.paused_until - now)
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def idle(self, now: float) -> bool:
+        """Ведро полное и не на паузе - его можно не хранить"""
+        return self.delay(now) == 0 and self.tokens >= self.capacity and self.paused_until <= now
+
+_Waiter = Tuple[int, int, Any, asyncio.Future]
+
+class SendScheduler(BaseRateLimiter[int]):
+    """
+    Очередь исходящих запросов к Telegram Bot API
+
+    Запросы с chat_id проходят через общее ведро токенов (лимит бота) и
+    ведро своего чата (личные чаты и группы - с разными лимитами). Из
+    готовых к отправке первым уходит запрос с наименьшим приоритетом
+    (INTERACTIVE раньше BULK), при равном - пришедший раньше. Ответ
+    RetryAfter ставит чат на паузу, после нее запрос повторяется
+    (не больше max_retries раз).
+
+    Приоритет берется из rate_limit_args или из контекста (bulk_sends).
+    """
+
+    def __init__(self, overall_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 group_rate: float = 20 / 60, group_burst: float = 3, max_retries: int = 2):
+        self.overall = TokenBucket(overall_rate, overall_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._queue: List[_Waiter] = []
+        self._sequence = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.throttled = 0
+        self.retry_after_count = 0
+        self.max_depth = 0
+        self.wait_seconds = 0.0
+
+    async def initialize(self) -> None:
+        # Может вызываться повторно (ExtBot и Application инициализируют его оба)
+        if self._dispatcher is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for _, _, _, future in self._queue:
+            if not future.done():
+                future.cancel()
+        self._queue.clear()
+
+    def _bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательные ID - группы и каналы, у них лимит в минуту
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _acquire(self, chat_id: Any, priority: int) -> None:
+        """Дождаться своей очереди на отправку"""
+        future = asyncio.get_running_loop().create_future()
+        # Номер в очереди уникален, поэтому chat_id и future не сравниваются
+        bisect.insort(self._queue, (priority, next(self._sequence), chat_id, future))
+        self.max_depth = max(self.max_depth, len(self._queue))
+        self._wakeup.set()
+        started = time.monotonic()
+        # Отмененное ожидание диспетчер уберет из очереди сам
+        await future
+        waited = time.monotonic() - started
+        self.wait_seconds += waited
+        if waited > 0.01:
+            self.throttled += 1
+
+    async def _dispatch(self) -> None:
+        """Выдает разрешения на отправку по мере появления токенов"""
+        while True:
+            self._queue = [waiter for waiter in self._queue if not waiter[3].done()]
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            delay = self.overall.delay(now)
+            if delay <= 0:
+                delay = float('inf')
+                for index, (_, _, chat_id, future) in enumerate(self._queue):
+                    chat_delay = self._bucket(chat_id).delay(now)
+                    if chat_delay <= 0:
+                        del self._queue[index]
+                        self.overall.take()
+                        self._bucket(chat_id).take()
+                        future.set_result(None)
+                        delay = 0
+                        break
+                    delay = min(delay, chat_delay)
+                if delay == 0:
+                    continue
+                self._forget_idle_chats(now)
+
+            # Новый запрос в другой чат может быть готов раньше
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _forget_idle_chats(self, now: float) -> None:
+        waiting = {waiter[2] for waiter in self._queue}
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items()
+                        if chat_id not in waiting and bucket.idle(now)]:
+            del self._chats[chat_id]
+
+    @staticmethod
+    async def _send(callback: Callable[..., Coroutine], args: Any, kwargs: Dict[str, Any], endpoint: str):
+        """Выполнить запрос и учесть его результат в метриках"""
+        try:
+            result = await callback(*args, **kwargs)
+        except RetryAfter:
+            TELEGRAM_REQUESTS.inc(endpoint=endpoint, result="retry_after")
+            raise
+        except Exception:
+            TELEGRAM_REQUESTS.inc(endpoint=endpoint, result="error")
+            raise
+        TELEGRAM_REQUESTS.inc(endpoint=endpoint, result="ok")
+        return result
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict, List[Dict]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Union[bool, Dict, List[Dict]]:
+        chat_id = data.get("chat_id")
+        # Служебные запросы (answerCallbackQuery, getMe, setWebhook...) не ограничиваются
+        if chat_id is None:
+            with span(f"telegram {endpoint}"):
+                return await self._send(callback, args, kwargs, endpoint)
+
+        priority = send_priority.get() if rate_limit_args is None else rate_limit_args
+        with span(f"telegram {endpoint}", priority=priority) as send_span:
+            for attempt in range(self.max_retries + 1):
+                started = time.monotonic()
+                await self._acquire(chat_id, priority)
+                send_span.set(queued_ms=round((time.monotonic() - started) * 1000, 1), attempts=attempt + 1)
+                try:
+                    result = await self._send(callback, args, kwargs, endpoint)
+                except RetryAfter as e:
+                    self.retry_after_count += 1
+                    retry_after = e.retry_after if isinstance(e.retry_after, (int, float)) else e.retry_after.total_seconds()
+                    logger.warning(f"Flood limit for chat {chat_id} on {endpoint}: retry after {retry_after}s")
+                    self._bucket(chat_id).paused_until = time.monotonic() + retry_after
+                    if attempt == self.max_retries:
+                        raise
+                    continue
+                self.sent += 1
+                return result
+
+    def stats(self) -> Dict:
+        """Глубина очереди и счетчики для мониторинга"""
+        depth: Dict[str, int] = {"interactive": 0, "bulk": 0}
+        for priority, _, _, future in self._queue:
+            if not future.done():
+                depth["interactive" if priority <= INTERACTIVE else "bulk"] += 1
+        return {
+            "queued": depth,
+            "max_depth": self.max_depth,
+            "chats": len(self._chats),
+            "sent": self.sent,
+            "throttled": self.throttled,
+            "retry_after": self.retry_after_count,
+            "wait_seconds": round(self.wait_seconds, 3),
+        }
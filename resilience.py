@@ -0,0 +1,86 @@
+# resilience.py
+import random
+import time
+from typing import Dict, Optional
+
+class CircuitBreaker:
+    """
+    Предохранитель для внешнего API
+
+    closed    - запросы идут как обычно, считаются подряд идущие ошибки
+    open      - после failure_threshold ошибок запросы сразу отклоняются
+    half_open - через reset_timeout пропускается один пробный запрос
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self.rejected = 0
+        self.opened_count = 0
+
+    @property
+    def state(self) -> str:
+        """Текущее состояние с учетом истекшего reset_timeout"""
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def allow(self) -> bool:
+        """Можно ли выполнить запрос сейчас"""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        """Успешный ответ: закрываем предохранитель"""
+        self._state = self.CLOSED
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        """
+        Пробный запрос завершился без результата (например, отменен)
+
+        Без этого предохранитель остался бы в half_open с занятой пробой
+        и отклонял бы все запросы. После record_success/record_failure
+        вызов ничего не меняет.
+        """
+        if self._state == self.HALF_OPEN:
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        """Ошибка сервиса (5xx, таймаут, обрыв соединения)"""
+        self._failures += 1
+        if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self._state != self.OPEN:
+                self.opened_count += 1
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def stats(self) -> Dict:
+        """Состояние для мониторинга"""
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "rejected": self.rejected,
+            "opened_count": self.opened_count,
+        }
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Экспоненциальная задержка с полным джиттером: случайно от 0 до min(cap, base * 2^attempt)"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
@@ -0,0 +1,260 @@
+# search.py
+import asyncio
+import logging
+import time
+from collections import Counter, defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+class SearchStrategy(NamedTuple):
+    """Один вариант поиска: имя, приоритет (меньше - важнее) и фабрика корутины"""
+    name: str
+    rank: int
+    run: Callable[[], Awaitable[Any]]
+
+async def run_search_strategies(strategies: List[SearchStrategy]) -> Tuple[Optional[str], Any]:
+    """
+    Запускает все стратегии одновременно и возвращает первый полезный результат
+
+    Результат стратегии принимается, только когда все стратегии с меньшим rank
+    уже завершились без результата. Стратегии одного rank равноправны -
+    побеждает та, что ответила первой. Остальные задачи отменяются.
+
+    Returns:
+        Tuple[Optional[str], Any]: имя победившей стратегии и ее результат
+        или (None, None), если полезных результатов нет
+    """
+    tasks = {
+        asyncio.ensure_future(strategy.run()): strategy
+        for strategy in strategies
+    }
+    pending = set(tasks)
+    # Полезные результаты в порядке завершения
+    useful: List[Tuple[SearchStrategy, Any]] = []
+
+    try:
+        while True:
+            # sorted устойчива: при равном rank побеждает ответивший первым
+            for strategy, result in sorted(useful, key=lambda item: item[0].rank):
+                if not any(tasks[task].rank < strategy.rank for task in pending):
+                    logger.info(f"Search strategy '{strategy.name}' won")
+                    return strategy.name, result
+
+            if not pending:
+                return None, None
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                strategy = tasks[task]
+                try:
+                    result = task.result()
+                except Exception as e:
+                    logger.error(f"Search strategy '{strategy.name}' failed: {e}")
+                    continue
+                if result:
+                    useful.append((strategy, result))
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+# ===== ЛОКАЛЬНЫЙ ИНДЕКС ТОВАРОВ =====
+# Кириллица приводится к латинице, чтобы "стэнли" находило "Stanley"
+_TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '',
+    'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+})
+
+_INDEXED_FIELDS = ('name', 'sku', 'category_name')
+
+def normalize_text(text: str) -> str:
+    """Нижний регистр, транслитерация и только буквы/цифры через пробел"""
+    text = str(text or '').lower().translate(_TRANSLIT)
+    return ' '.join(''.join(ch if ch.isalnum() else ' ' for ch in text).split())
+
+def trigrams(text: str) -> Set[str]:
+    """Триграммы нормализованного текста (каждое слово дополняется пробелами)"""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def edit_distance(a: str, b: str) -> int:
+    """Расстояние Левенштейна"""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ch_a in enumerate(a, 1):
+        current = [i]
+        for j, ch_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ch_a != ch_b),
+            ))
+        previous = current
+    return previous[-1]
+
+class ProductIndex:
+    """Триграммный инвертированный индекс по названию, артикулу и категории"""
+
+    def __init__(self, min_score: float = 0.3, max_candidates: int = 30,
+                 max_common_fraction: float = 0.2):
+        self.min_score = min_score
+        self.max_candidates = max_candidates
+        self.max_common_fraction = max_common_fraction
+        self._products: Dict[int, Dict] = {}
+        self._versions: Dict[int, Any] = {}
+        self._fields: Dict[int, List[Tuple[str, Set[str]]]] = {}
+        self._postings: Dict[str, Set[int]] = defaultdict(set)
+        self.ready = False
+        self.last_refresh: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self._products)
+
+    def upsert(self, product: Dict) -> bool:
+        """Добавить или обновить товар; неизмененные версии пропускаются"""
+        product_id = product.get('id')
+        if product_id is None:
+            return False
+
+        version = product.get('updated_at')
+        if product_id in self._products and version is not None and self._versions.get(product_id) == version:
+            return False
+
+        self.remove(product_id)
+
+        fields = []
+        for field in _INDEXED_FIELDS:
+            text = normalize_text(product.get(field) or '')
+            if text:
+                fields.append((text, trigrams(text)))
+
+        self._products[product_id] = product
+        self._versions[product_id] = version
+        self._fields[product_id] = fields
+        for _, grams in fields:
+            for gram in grams:
+                self._postings[gram].add(product_id)
+        return True
+
+    def remove(self, product_id: int) -> None:
+        """Удалить товар из индекса"""
+        if product_id not in self._products:
+            return
+        for _, grams in self._fields.pop(product_id):
+            for gram in grams:
+                ids = self._postings.get(gram)
+                if ids is not None:
+                    ids.discard(product_id)
+                    if not ids:
+                        del self._postings[gram]
+        del self._products[product_id]
+        self._versions.pop(product_id, None)
+
+    def search(self, query: str, limit: int = 5) -> List[Dict]:
+        """Нечеткий поиск: ранжирование по триграммам и расстоянию Левенштейна"""
+        query_text = normalize_text(query)
+        query_grams = trigrams(query_text)
+        if not query_grams:
+            return []
+
+        # Слишком частые триграммы почти не различают товары - пропускаем их,
+        # если у запроса есть более редкие
+        postings = [self._postings[gram] for gram in query_grams if gram in self._postings]
+        rare = [ids for ids in postings if len(ids) <= self.max_common_fraction * len(self._products)]
+        postings = rare or postings
+
+        # Кандидаты - товары с наибольшим числом общих триграмм
+        overlap: Counter = Counter()
+        for ids in postings:
+            overlap.update(ids)
+        candidates = [product_id for product_id, _ in overlap.most_common(self.max_candidates)]
+
+        # Слова в каталоге часто повторяются - схожесть слов считаем один раз
+        word_scores: Dict[Tuple[str, str], float] = {}
+        scored = []
+        for product_id in candidates:
+            score = max(
+                (self._score(query_text, query_grams, text, grams, word_scores)
+                 for text, grams in self._fields[product_id]),
+                default=0.0,
+            )
+            if score >= self.min_score:
+                scored.append((score, product_id))
+
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [self._products[product_id] for _, product_id in scored[:limit]]
+
+    @staticmethod
+    def _score(query_text: str, query_grams: Set[str], text: str, grams: Set[str],
+               word_scores: Dict[Tuple[str, str], float]) -> float:
+        """Схожесть запроса с полем товара от 0 до 1"""
+        common = len(query_grams & grams)
+        dice = 2 * common / (len(query_grams) + len(grams))
+        # Насколько запрос покрыт полем: важно для частичных запросов
+        coverage = common / len(query_grams)
+
+        # Опечатки в отдельных словах
+        word_similarity = 0.0
+        for query_word in query_text.split():
+            for word in text.split():
+                key = (query_word, word)
+                similarity = word_scores.get(key)
+                if similarity is None:
+                    longest = max(len(query_word), len(word))
+                    similarity = 1 - edit_distance(query_word, word) / longest
+                    word_scores[key] = similarity
+                word_similarity = max(word_similarity, similarity)
+
+        return max(dice, 0.9 * coverage, 0.8 * word_similarity)
+
+    async def refresh(self, fetch_page: Callable[[int, int], Awaitable[Optional[List[Dict]]]],
+                      page_size: int = 100) -> int:
+        """
+        Инкрементально обновить индекс, постранично загружая каталог
+
+        Args:
+            fetch_page: корутина (limit, offset) -> список товаров
+            page_size: размер страницы
+
+        Returns:
+            int: количество добавленных или измененных товаров
+        """
+        seen: Set[int] = set()
+        changed = 0
+        offset = 0
+
+        while True:
+            page = await fetch_page(page_size, offset)
+            if page is None:
+                # Ошибка API: оставляем индекс как есть до следующего обновления
+                logger.warning("Product index refresh aborted: API unavailable")
+                return changed
+
+            page_ids = {product.get('id') for product in page}
+            if page_ids and page_ids <= seen:
+                # API не поддерживает offset и вернул ту же страницу
+                break
+
+            for product in page:
+                changed += self.upsert(product)
+            seen |= page_ids
+
+            if len(page) < page_size:
+                break
+            offset += page_size
+
+        for product_id in set(self._products) - seen:
+            self.remove(product_id)
+
+        self.ready = True
+        self.last_refresh = time.time()
+        logger.info(f"Product index refreshed: {len(self)} products, {changed} changed")
+        return changed
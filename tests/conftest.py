@@ -0,0 +1,10 @@
+# tests/conftest.py
+import os
+import sys
+
+# config.py проверяет настройки при импорте
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:test")
+os.environ.setdefault("WAREHOUSE_API_URL", "http://127.0.0.1:1/api")
+os.environ.setdefault("LOG_FILE", "")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
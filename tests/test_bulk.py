@@ -0,0 +1,44 @@
+# tests/test_bulk.py
+import asyncio
+
+import pytest
+
+import bulk
+
+class SlowApi:
+    """create_thermocup: строка "slow" создается долго, остальные - сразу"""
+
+    def __init__(self):
+        self.created = []
+
+    async def create_thermocup(self, data):
+        if data["name"] == "slow":
+            await asyncio.sleep(5)
+        self.created.append(data["name"])
+        return {"id": len(self.created)}
+
+async def _rows_with_error():
+    yield ["slow", "1", "10", "1"]
+    yield ["A", "1", "10", "1"]
+    await asyncio.sleep(0.05)
+    raise UnicodeDecodeError("utf-8", b"\xff", 0, 1, "invalid start byte")
+
+def test_header_only_when_no_numeric_column_parses():
+    assert bulk._is_header(["Название", "Категория ID", "Цена", "Количество"])
+    assert not bulk._is_header(["A", "x", "10.5", "1"])
+    assert not bulk._is_header(["A", "1", "цена", "1"])
+
+def test_read_error_cancels_workers_and_reports_partial_result():
+    async def scenario():
+        api = SlowApi()
+        with pytest.raises(bulk.ImportAborted) as aborted:
+            await bulk.import_thermocups(api, _rows_with_error(), concurrency=3)
+
+        assert isinstance(aborted.value.__cause__, UnicodeDecodeError)
+        assert aborted.value.created == 1
+        # Прерванное создание - в отклоненных, после ошибки ничего не создается
+        assert [row.values[0] for row in aborted.value.rejected] == ["slow"]
+        await asyncio.sleep(0.1)
+        assert api.created == ["A"]
+
+    asyncio.run(scenario())
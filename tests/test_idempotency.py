@@ -0,0 +1,70 @@
+# tests/test_idempotency.py
+import asyncio
+from typing import List
+
+from aiohttp import web
+
+from api_client import WarehouseAPIClient
+
+async def _flaky_server(statuses: List[int], calls: List[str]) -> web.AppRunner:
+    """Отвечает статусами из statuses по очереди, затем 200; ключи запросов - в calls"""
+    async def handler(request: web.Request) -> web.Response:
+        calls.append(request.headers.get("Idempotency-Key"))
+        status = statuses.pop(0) if statuses else 200
+        return web.json_response({"ok": status == 200}, status=status)
+
+    app = web.Application()
+    app.router.add_route("*", "/api/{tail:.*}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    return runner
+
+def _client(runner: web.AppRunner) -> WarehouseAPIClient:
+    client = WarehouseAPIClient()
+    port = runner.addresses[0][1]
+    client.base_url = f"http://127.0.0.1:{port}/api"
+    return client
+
+def test_unknown_outcome_needs_confirmation():
+    async def scenario():
+        calls: List[str] = []
+        runner = await _flaky_server([503], calls)
+        client = _client(runner)
+        try:
+            assert await client.update_thermocup_stock(1, 1, 5, idempotency_key="k") is None
+            assert client.outcome_unknown("k")
+            assert len(calls) == 1
+
+            # Без подтверждения повтор не отправляется: изменение могло примениться
+            assert await client.update_thermocup_stock(1, 1, 5, idempotency_key="k") is None
+            assert len(calls) == 1
+
+            assert await client.update_thermocup_stock(1, 1, 5, idempotency_key="k", confirmed=True) == {"ok": True}
+            assert calls == ["k", "k"]
+            assert not client.outcome_unknown("k")
+
+            # Примененная операция больше не отправляется
+            assert await client.update_thermocup_stock(1, 1, 5, idempotency_key="k") == {"ok": True}
+            assert len(calls) == 2
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+def test_rejected_request_can_be_resent():
+    async def scenario():
+        calls: List[str] = []
+        runner = await _flaky_server([400], calls)
+        client = _client(runner)
+        try:
+            assert await client.update_thermocup_reserved(1, -5, idempotency_key="k") is None
+            assert not client.outcome_unknown("k")
+            assert await client.update_thermocup_reserved(1, -5, idempotency_key="k") == {"ok": True}
+            assert len(calls) == 2
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    asyncio.run(scenario())
@@ -0,0 +1,194 @@
+# tests/test_resilience.py
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+
+import resilience
+from api_client import WarehouseAPIClient
+from config import Config
+from resilience import CircuitBreaker
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(resilience.time, "monotonic", fake)
+    return fake
+
+def open_breaker(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.failure_threshold):
+        assert breaker.allow()
+        breaker.record_failure()
+
+def test_opens_after_threshold_and_rejects(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.stats()["rejected"] == 1
+    assert breaker.stats()["opened_count"] == 1
+
+def test_success_resets_failure_count(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+def test_half_open_allows_single_probe(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    open_breaker(breaker)
+
+    clock.now += 9.9
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 0.1
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+
+def test_probe_success_closes(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    open_breaker(breaker)
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+def test_probe_failure_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    open_breaker(breaker)
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.stats()["opened_count"] == 2
+
+def test_release_probe_allows_next_probe(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    open_breaker(breaker)
+    clock.now += 10
+    assert breaker.allow()
+    breaker.release_probe()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+
+def test_release_probe_after_outcome_is_noop(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    open_breaker(breaker)
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_failure()
+    breaker.release_probe()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+# ===== WarehouseAPIClient =====
+async def _slow_server(delay: float) -> web.AppRunner:
+    async def handler(request: web.Request) -> web.Response:
+        await asyncio.sleep(delay)
+        return web.json_response({"ok": True})
+
+    app = web.Application()
+    app.router.add_route("*", "/api/{tail:.*}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    # Порт 0 - свободный порт от ОС: тесты не мешают друг другу
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    return runner
+
+def _client(runner: web.AppRunner) -> WarehouseAPIClient:
+    client = WarehouseAPIClient()
+    port = runner.addresses[0][1]
+    client.base_url = f"http://127.0.0.1:{port}/api"
+    return client
+
+def _half_open_client(runner: web.AppRunner) -> WarehouseAPIClient:
+    client = _client(runner)
+    client.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    client.breaker.record_failure()
+    assert client.breaker.state == CircuitBreaker.HALF_OPEN
+    return client
+
+def test_cancelled_probe_releases_breaker():
+    async def scenario():
+        runner = await _slow_server(1)
+        client = _half_open_client(runner)
+        await client.start()
+        try:
+            probe = asyncio.create_task(client.update_thermocup_stock(1, 1, 5))
+            await asyncio.sleep(0.1)
+            assert client.breaker._probe_in_flight
+            probe.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await probe
+            assert not client.breaker._probe_in_flight
+            assert client.breaker.allow()
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+def test_stale_cache_while_probe_in_flight():
+    async def scenario():
+        runner = await _slow_server(0.3)
+        client = _half_open_client(runner)
+        key = client._cache_key("products/7")
+        client.cache.set(key, {"id": 7}, ttl=-1)
+        await client.start()
+        try:
+            probe = asyncio.create_task(client.update_thermocup_stock(1, 1, 5))
+            await asyncio.sleep(0.05)
+            # Проба занята: запрос отклонен, но устаревшие данные из кэша отдаются
+            assert await client.get_product_by_id(7) == {"id": 7}
+            await probe
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+def test_retries_stop_at_request_deadline(monkeypatch):
+    monkeypatch.setattr(Config, "API_REQUEST_DEADLINE", 0.5)
+    monkeypatch.setattr(Config, "API_RETRY_ATTEMPTS", 5)
+
+    async def scenario():
+        runner = await _slow_server(2)
+        client = _client(runner)
+        await client.start()
+        try:
+            started = time.monotonic()
+            assert await client.get_product_by_id(1) is None
+            assert time.monotonic() - started < 1
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+def test_programming_error_is_not_a_breaker_failure(monkeypatch):
+    async def broken_session():
+        raise RuntimeError("bug")
+
+    async def scenario():
+        client = WarehouseAPIClient()
+        monkeypatch.setattr(client, "_get_session", broken_session)
+        with pytest.raises(RuntimeError):
+            await client.update_thermocup_stock(1, 1, 5)
+        assert client.breaker.stats()["consecutive_failures"] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,46 @@
+# tests/test_webhook.py
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook import SECRET_HEADER, create_webhook_app
+
+class _Queue:
+    def __init__(self):
+        self.items = []
+
+    async def put(self, item):
+        self.items.append(item)
+
+class _Application:
+    def __init__(self):
+        self.update_queue = _Queue()
+        self.bot = None
+        self.running = True
+
+def test_empty_secret_is_rejected():
+    with pytest.raises(ValueError):
+        create_webhook_app(_Application(), "/hook", "")
+
+@pytest.mark.parametrize("headers", [{}, {SECRET_HEADER: ""}, {SECRET_HEADER: "wrong"}])
+def test_update_without_valid_secret_is_forbidden(headers):
+    async def scenario():
+        application = _Application()
+        async with TestClient(TestServer(create_webhook_app(application, "/hook", "s3cret"))) as client:
+            response = await client.post("/hook", json={"update_id": 1}, headers=headers)
+            assert response.status == 403
+        assert application.update_queue.items == []
+
+    asyncio.run(scenario())
+
+@pytest.mark.parametrize("body", ["not json", "[1, 2]", '{"message": {"text": "no update_id"}}'])
+def test_malformed_update_is_dropped_without_redelivery(body):
+    async def scenario():
+        application = _Application()
+        async with TestClient(TestServer(create_webhook_app(application, "/hook", "s3cret"))) as client:
+            response = await client.post("/hook", data=body, headers={SECRET_HEADER: "s3cret"})
+            assert response.status == 200
+        assert application.update_queue.items == []
+
+    asyncio.run(scenario())
@@ -0,0 +1,157 @@
+# tracing.py
+import contextvars
+import functools
+import logging
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class Span:
+    """Участок работы внутри трассировки: имя, атрибуты, длительность и вложенные участки"""
+
+    __slots__ = ("name", "attributes", "started", "duration", "children")
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.name = name
+        self.attributes = attributes
+        self.started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.children: List["Span"] = []
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self.started
+
+    def as_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "ms": round((self.duration or 0.0) * 1000, 1),
+            **({"attributes": self.attributes} if self.attributes else {}),
+            **({"children": [child.as_dict() for child in self.children]} if self.children else {}),
+        }
+
+    def format_tree(self, depth: int = 0) -> List[str]:
+        """Дерево участков текстом, по строке на участок"""
+        attributes = " ".join(f"{key}={value}" for key, value in self.attributes.items())
+        duration = "..." if self.duration is None else f"{self.duration * 1000:.1f} ms"
+        lines = [f"{'  ' * depth}{self.name} {duration} {attributes}".rstrip()]
+        for child in self.children:
+            lines.extend(child.format_tree(depth + 1))
+        return lines
+
+class _NoopSpan:
+    """Участок вне трассировки: атрибуты игнорируются"""
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+class Trace:
+    """Трассировка одного обновления: ID для логов и заголовков, корневой участок"""
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.root = Span(name, attributes)
+        self.spans = 1
+        self.dropped = 0
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar('trace', default=None)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar('span', default=None)
+
+def current_trace_id() -> Optional[str]:
+    """ID трассировки текущей задачи (None вне обработки обновления)"""
+    trace = _current_trace.get()
+    return trace.trace_id if trace is not None else None
+
+@contextmanager
+def start_trace(name: str, **attributes: Any) -> Iterator[Any]:
+    """
+    Начать трассировку: все span() внутри блока (и в созданных из него
+    задачах) попадут в ее дерево. Если вся трассировка дольше
+    TRACE_SLOW_THRESHOLD секунд, дерево пишется в лог (доля
+    TRACE_SLOW_SAMPLE_RATE таких трассировок).
+    """
+    if not Config.TRACING_ENABLED:
+        yield NOOP_SPAN
+        return
+
+    trace = Trace(name, attributes)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(trace.root)
+    try:
+        yield trace.root
+    except Exception as e:
+        trace.root.set(error=type(e).__name__)
+        raise
+    finally:
+        trace.root.finish()
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        _report_slow(trace)
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Any]:
+    """Участок внутри текущей трассировки; вне трассировки ничего не записывает"""
+    trace = _current_trace.get()
+    parent = _current_span.get()
+    if trace is None or parent is None:
+        yield NOOP_SPAN
+        return
+    # Массовые операции порождают сотни запросов: дерево ограничено
+    if trace.spans >= Config.TRACE_MAX_SPANS:
+        trace.dropped += 1
+        yield NOOP_SPAN
+        return
+
+    child = Span(name, attributes)
+    parent.children.append(child)
+    trace.spans += 1
+    token = _current_span.set(child)
+    try:
+        yield child
+    except Exception as e:
+        child.set(error=type(e).__name__)
+        raise
+    finally:
+        child.finish()
+        _current_span.reset(token)
+
+def traced_handler(callback: Callable) -> Callable:
+    """Обертка обработчика: участок handler <имя> в трассировке обновления"""
+    name = f"handler {callback.__name__}"
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        with span(name):
+            return await callback(update, context)
+
+    return wrapper
+
+def _report_slow(trace: Trace) -> None:
+    duration = trace.root.duration or 0.0
+    if duration < Config.TRACE_SLOW_THRESHOLD or random.random() >= Config.TRACE_SLOW_SAMPLE_RATE:
+        return
+    lines = trace.root.format_tree()
+    if trace.dropped:
+        lines.append(f"... еще {trace.dropped} участков не записано (TRACE_MAX_SPANS)")
+    logger.warning(
+        f"Slow trace {trace.trace_id}: {duration:.2f}s\n" + "\n".join(lines),
+        extra={"trace_id": trace.trace_id, "spans": trace.root.as_dict()},
+    )
+
+class TraceIdFilter(logging.Filter):
+    """Добавляет к записи лога поле trace_id (или "-" вне обработки обновления)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, 'trace_id'):
+            record.trace_id = current_trace_id() or '-'
+        return True
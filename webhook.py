@@ -0,0 +1,104 @@
+# webhook.py
+import asyncio
+import hmac
+import logging
+import signal
+from typing import Callable, Dict, Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+def create_webhook_app(application: Application, path: str, secret: str,
+                       health_info: Optional[Callable[[], Dict]] = None) -> web.Application:
+    """
+    HTTP-приложение для приема обновлений от Telegram
+
+    POST {path}  - обновление от Telegram (проверяется секретный токен)
+    GET /healthz - процесс жив
+    GET /readyz  - бот запущен и готов принимать обновления
+
+    Raises:
+        ValueError: если секретный токен пуст - без него обновления мог бы прислать кто угодно
+    """
+    if not secret:
+        raise ValueError("Для webhook нужен секретный токен (WEBHOOK_SECRET)")
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            logger.warning(f"Webhook request with invalid secret token from {request.remote}")
+            return web.Response(status=403)
+
+        # Telegram повторяет доставку при любом ответе кроме 2xx: обновление,
+        # которое не удается разобрать, пропускаем с ответом 200
+        try:
+            data = await request.json()
+            update = Update.de_json(data, application.bot)
+        except Exception as e:
+            logger.error(f"Webhook update could not be parsed, dropping it: {e!r}")
+            return web.Response(status=200)
+
+        await application.update_queue.put(update)
+        return web.Response(status=200)
+
+    async def healthz(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    async def readyz(request: web.Request) -> web.Response:
+        body = {"status": "ready" if application.running else "starting"}
+        if health_info is not None:
+            body.update(health_info())
+        return web.json_response(body, status=200 if application.running else 503)
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/readyz", readyz)
+    return app
+
+async def run_webhook(application: Application, health_info: Optional[Callable[[], Dict]] = None) -> None:
+    """Запустить бота в режиме webhook со встроенным aiohttp-сервером"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    path = "/" + Config.WEBHOOK_PATH.lstrip("/")
+    runner = web.AppRunner(create_webhook_app(application, path, Config.WEBHOOK_SECRET, health_info))
+
+    # Тот же порядок хуков, что и в Application.run_polling
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+
+        await application.bot.set_webhook(
+            url=Config.WEBHOOK_URL.rstrip("/") + path,
+            secret_token=Config.WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        await application.start()
+
+        await runner.setup()
+        await web.TCPSite(runner, Config.WEBHOOK_LISTEN, Config.WEBHOOK_PORT).start()
+        logger.info(f"Webhook server listening on {Config.WEBHOOK_LISTEN}:{Config.WEBHOOK_PORT}{path}")
+
+        await stop_event.wait()
+    finally:
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)